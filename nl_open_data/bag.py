@@ -0,0 +1,373 @@
+"""Streaming parsing of BAG (Basisregistratie Adressen en Gebouwen) XML extracts.
+
+A BAG extract holds millions of objects per type, spread over XML files of tens of MBs. Rather
+than parsing a whole file into a DOM and converting every element to a dict, the files are parsed
+with `lxml.etree.iterparse`: every object element is read into column buffers as soon as it is
+complete and then cleared, and the buffers are written to parquet as a row group every
+`batch_size` objects. Memory use is bounded by `batch_size`, not by the size of the file.
+
+Which elements are objects, and which of their descendants become columns, is described by a
+`BagObject` spec. Paths in a spec are relative to the object element and use local names only,
+so they match regardless of the namespace prefixes of the extract.
+
+`extract_bag` parses a complete extract: a zip file holding a zip file of XML files per object
+type (i.e. '9999NUM08042022.zip'). Every nested zip file is decompressed to a temporary file once,
+and its XML files are parsed in a pool of processes. Every object
+type is written as a parquet dataset: a folder with a file per XML file.
+"""
+from typing import Union, Mapping, BinaryIO, Tuple, Sequence, List
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+from tempfile import TemporaryDirectory
+import math
+import os
+import re
+import shutil
+
+from lxml import etree
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BATCH_SIZE = 100_000  # Number of objects per row group
+SPOOL_CHUNK_SIZE = 2 ** 24  # Bytes copied at a time when decompressing a nested zip file
+# Nested zip file of an object type within a BAG extract, i.e. '9999NUM08042022.zip'
+NESTED_ZIP_PATTERN = re.compile(r"^\d{4}(?P<code>[A-Z]{3})\d{8}\.zip$")
+
+
+@dataclass(frozen=True)
+class BagObject:
+    """The spec of a BAG object type.
+
+    `fields` maps every column to the path of its element, relative to the object element (i.e.
+    'ligtAan/OpenbareRuimteRef'), and its Arrow type. Columns of a list type hold the text of all
+    elements on the path, other columns the text of the first.
+    """
+
+    code: str
+    tag: str
+    fields: Mapping[str, Tuple[str, pa.DataType]]
+
+    @property
+    def schema(self) -> pa.Schema:
+        return pa.schema([(name, type_) for name, (_, type_) in self.fields.items()])
+
+
+# Fields shared by all object types of BAG 2.0 extracts
+_VOORKOMEN = "voorkomen/Voorkomen/"
+_HISTORY = {
+    "status": ("status", pa.string()),
+    "geconstateerd": ("geconstateerd", pa.string()),
+    "documentdatum": ("documentdatum", pa.date32()),
+    "documentnummer": ("documentnummer", pa.string()),
+    "voorkomenidentificatie": (_VOORKOMEN + "voorkomenidentificatie", pa.int64()),
+    "begin_geldigheid": (_VOORKOMEN + "beginGeldigheid", pa.date32()),
+    "eind_geldigheid": (_VOORKOMEN + "eindGeldigheid", pa.date32()),
+    "tijdstip_registratie": (_VOORKOMEN + "tijdstipRegistratie", pa.timestamp("ms")),
+    "eind_registratie": (_VOORKOMEN + "eindRegistratie", pa.timestamp("ms")),
+}
+
+NUM = BagObject(
+    code="NUM",
+    tag="Nummeraanduiding",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        "huisnummer": ("huisnummer", pa.int64()),
+        "huisletter": ("huisletter", pa.string()),
+        "huisnummertoevoeging": ("huisnummertoevoeging", pa.string()),
+        "postcode": ("postcode", pa.string()),
+        "type_adresseerbaar_object": ("typeAdresseerbaarObject", pa.string()),
+        "openbare_ruimte_id": ("ligtAan/OpenbareRuimteRef", pa.string()),
+        "woonplaats_id": ("ligtIn/WoonplaatsRef", pa.string()),
+        **_HISTORY,
+    },
+)
+
+_ADDRESSES = {
+    "hoofdadres_id": ("heeftAlsHoofdadres/NummeraanduidingRef", pa.string()),
+    "nevenadres_ids": (
+        "heeftAlsNevenadres/NummeraanduidingRef",
+        pa.list_(pa.string()),
+    ),
+}
+# GML coordinates, of all (outer and inner) rings
+_POS_LISTS = ("geometrie//posList", pa.list_(pa.string()))
+
+VBO = BagObject(
+    code="VBO",
+    tag="Verblijfsobject",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        **_ADDRESSES,
+        "gebruiksdoelen": ("gebruiksdoel", pa.list_(pa.string())),
+        "oppervlakte": ("oppervlakte", pa.int64()),
+        "pand_ids": ("maaktDeelUitVan/PandRef", pa.list_(pa.string())),
+        "punt": ("geometrie//pos", pa.string()),
+        **_HISTORY,
+    },
+)
+
+PND = BagObject(
+    code="PND",
+    tag="Pand",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        "oorspronkelijk_bouwjaar": ("oorspronkelijkBouwjaar", pa.int64()),
+        "geometrie": _POS_LISTS,
+        **_HISTORY,
+    },
+)
+
+OPR = BagObject(
+    code="OPR",
+    tag="OpenbareRuimte",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        "naam": ("naam", pa.string()),
+        "type": ("type", pa.string()),
+        "woonplaats_id": ("ligtIn/WoonplaatsRef", pa.string()),
+        **_HISTORY,
+    },
+)
+
+WPL = BagObject(
+    code="WPL",
+    tag="Woonplaats",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        "naam": ("naam", pa.string()),
+        "geometrie": _POS_LISTS,
+        **_HISTORY,
+    },
+)
+
+LIG = BagObject(
+    code="LIG",
+    tag="Ligplaats",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        **_ADDRESSES,
+        "geometrie": _POS_LISTS,
+        **_HISTORY,
+    },
+)
+
+STA = BagObject(
+    code="STA",
+    tag="Standplaats",
+    fields={
+        "identificatie": ("identificatie", pa.string()),
+        **_ADDRESSES,
+        "geometrie": _POS_LISTS,
+        **_HISTORY,
+    },
+)
+
+BAG_OBJECTS = {spec.code: spec for spec in (NUM, VBO, PND, OPR, WPL, LIG, STA)}
+
+
+def _clear(element: etree._Element) -> None:
+    """Frees a parsed element, and the elements parsed before it, including those of its ancestors."""
+    element.clear(keep_tail=True)
+    for ancestor in element.iterancestors():
+        while ancestor.getprevious() is not None:
+            del ancestor.getparent()[0]
+
+
+def _to_table(columns: Mapping[str, list], spec: BagObject) -> pa.Table:
+    arrays = []
+    for name, (_, type_) in spec.fields.items():
+        if pa.types.is_list(type_):
+            arrays.append(pa.array(columns[name], type=type_))
+        else:
+            arrays.append(pa.array(columns[name], type=pa.string()).cast(type_))
+    return pa.Table.from_arrays(arrays, schema=spec.schema)
+
+
+def parse_bag_xml(
+    source: Union[str, Path, BinaryIO],
+    spec: BagObject,
+    out_file: Union[str, Path],
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Parses the objects of a BAG XML file into a parquet file, streaming.
+
+    Parameters
+    ----------
+    source : str, Path or file-like
+        The XML file, or an open binary stream (i.e. a member of a ZipFile)
+    spec : BagObject
+        The object type to parse (i.e. `NUM`)
+    out_file : str or Path
+        The parquet file to write
+    batch_size : int, default=100_000
+        Number of objects buffered before they are written as a row group
+
+    Returns
+    -------
+    int
+        The number of objects parsed
+    """
+    # Match any namespace, keeping '//' (any descendant) as is
+    paths = {
+        name: "/".join("{*}" + tag if tag else "" for tag in path.split("/"))
+        for name, (path, _) in spec.fields.items()
+    }
+    lists = {name for name, (_, type_) in spec.fields.items() if pa.types.is_list(type_)}
+    columns = {name: [] for name in spec.fields}
+    n_objects = 0
+
+    with pq.ParquetWriter(out_file, spec.schema) as writer:
+        for _, element in etree.iterparse(
+            source, events=("end",), tag="{*}" + spec.tag, huge_tree=True
+        ):
+            for name, path in paths.items():
+                if name in lists:
+                    columns[name].append([e.text for e in element.iterfind(path)])
+                else:
+                    columns[name].append(element.findtext(path) or None)
+            _clear(element)
+            n_objects += 1
+            if n_objects % batch_size == 0:
+                writer.write_table(_to_table(columns, spec))
+                columns = {name: [] for name in spec.fields}
+        if not n_objects or n_objects % batch_size:
+            writer.write_table(_to_table(columns, spec))
+    return n_objects
+
+
+def _xml_files(nested: ZipFile) -> List[str]:
+    """Lists the XML files of a nested zip file, in the order they are stored."""
+    infos = sorted(nested.infolist(), key=lambda info: info.header_offset)
+    return [info.filename for info in infos if info.filename.endswith(".xml")]
+
+
+def _nested_zips(outer: ZipFile, codes: Sequence[str]) -> List[Tuple[str, str]]:
+    """Lists the (code, name) of the nested zip files of the given object types."""
+    nested_zips = []
+    for name in outer.namelist():
+        match = NESTED_ZIP_PATTERN.match(Path(name).name)
+        if match and match.group("code") in codes:
+            nested_zips.append((match.group("code"), name))
+    return nested_zips
+
+
+def list_bag_members(
+    bag_zip: Union[str, Path], codes: Sequence[str] = None
+) -> List[Tuple[str, str, List[str]]]:
+    """Lists the XML files of every object type in a BAG extract.
+
+    Parameters
+    ----------
+    bag_zip : str or Path
+        The BAG extract, a zip file holding a zip file per object type
+    codes : list of str, default=None
+        The object types to list (i.e. ['NUM', 'VBO']). If None, all types in `BAG_OBJECTS` are listed.
+
+    Returns
+    -------
+    list
+        (code, nested zip file, XML files) tuples, with the XML files in the order they are stored
+    """
+    codes = list(BAG_OBJECTS) if codes is None else codes
+    members = []
+    with ZipFile(bag_zip) as outer:
+        for code, name in _nested_zips(outer, codes):
+            with outer.open(name) as stream, ZipFile(stream) as nested:
+                members.append((code, name, _xml_files(nested)))
+    return members
+
+
+def _spool(outer: ZipFile, name: str, folder: Path) -> Path:
+    """Decompresses a nested zip file to a file in folder, reading it once, front to back."""
+    path = folder / Path(name).name
+    with outer.open(name) as stream, open(path, "wb") as f:
+        shutil.copyfileobj(stream, f, SPOOL_CHUNK_SIZE)
+    return path
+
+
+def _parse_members(
+    nested_zip: Path,
+    code: str,
+    xml_files: Sequence[str],
+    out_folder: Path,
+    batch_size: int,
+) -> int:
+    """Parses XML files of a (spooled) nested zip file."""
+    spec = BAG_OBJECTS[code]
+    n_objects = 0
+    with ZipFile(nested_zip) as nested:
+        for xml_file in xml_files:
+            out_file = out_folder / (Path(xml_file).stem + ".parquet")
+            with nested.open(xml_file) as source:
+                n_objects += parse_bag_xml(source, spec, out_file, batch_size)
+    return n_objects
+
+
+def extract_bag(
+    bag_zip: Union[str, Path],
+    out_folder: Union[str, Path],
+    codes: Sequence[str] = None,
+    max_workers: int = None,
+    batch_size: int = BATCH_SIZE,
+    spool_folder: Union[str, Path] = None,
+) -> dict:
+    """Parses a BAG extract into a parquet dataset per object type, in a pool of processes.
+
+    Every nested zip file is decompressed from the extract to a temporary file once, as members
+    of a compressed stream can only be reached by decompressing it from the start. Its XML files
+    are then divided into `max_workers` contiguous chunks, each parsed by a worker opening the
+    temporary file, so all cores are used for both large and small object types. The next nested
+    zip file is decompressed while the workers parse the previous one. The temporary files take
+    about as much disk space as the extract, and are removed afterwards.
+
+    Parameters
+    ----------
+    bag_zip : str or Path
+        The BAG extract, a zip file holding a zip file per object type
+    out_folder : str or Path
+        The folder to write a dataset per object type into ('<out_folder>/<code>/<xml file>.parquet')
+    codes : list of str, default=None
+        The object types to parse (i.e. ['NUM', 'VBO']). If None, all types in `BAG_OBJECTS` are parsed.
+    max_workers : int, default=None
+        Number of processes. If None, the number of CPUs.
+    batch_size : int, default=100_000
+        Number of objects per row group
+    spool_folder : str or Path, default=None
+        The folder to decompress the nested zip files into. If None, the temp folder of the OS.
+
+    Returns
+    -------
+    dict
+        The dataset folder and number of objects ('folder', 'objects') per object type code
+    """
+    max_workers = max_workers or os.cpu_count()
+    codes = list(BAG_OBJECTS) if codes is None else codes
+    datasets = {}
+    futures = []
+    with TemporaryDirectory(prefix="bag_", dir=spool_folder) as spool:
+        with ZipFile(bag_zip) as outer, ProcessPoolExecutor(max_workers) as pool:
+            for code, name in _nested_zips(outer, codes):
+                nested_zip = _spool(outer, name, Path(spool))
+                with ZipFile(nested_zip) as nested:
+                    xml_files = _xml_files(nested)
+                folder = Path(out_folder) / code
+                folder.mkdir(parents=True, exist_ok=True)
+                datasets[code] = dict(folder=folder, objects=0)
+                chunk_size = max(math.ceil(len(xml_files) / max_workers), 1)
+                for i in range(0, len(xml_files), chunk_size):
+                    future = pool.submit(
+                        _parse_members,
+                        nested_zip,
+                        code,
+                        xml_files[i : i + chunk_size],
+                        folder,
+                        batch_size,
+                    )
+                    futures.append((code, future))
+            for code, future in futures:
+                datasets[code]["objects"] += future.result()
+    for code, dataset in datasets.items():
+        print(f"Parsed {dataset['objects']} {BAG_OBJECTS[code].tag} objects")
+    return datasets
@@ -0,0 +1,190 @@
+"""Planning and submitting balanced batches of Statline datasets.
+
+Mirroring a whole CBS catalog with fixed slices of ids per flow run gives batches taking seconds
+next to batches taking hours, as a single huge table stalls the batch it lands in. Here the work
+of every dataset is estimated from its number of cells (`RecordCount` x `ColumnCount` in the
+catalog), or from the duration of its previous run if that took longer. A previous run can be much
+shorter than mirroring the dataset, as unchanged datasets are skipped, so it never lowers the
+estimate of a large dataset. Datasets are then spread over
+batches of about `target_seconds` of work each, placing the largest datasets first, each into the
+batch with the least work so far (longest processing time first). Datasets expected to take longer
+than the target get a batch of their own, and the batches with the most work are submitted first,
+with at most `max_concurrent` flow runs running at a time.
+
+Durations are recorded per dataset in a json file in the cache folder (see `DurationHistory`),
+dividing the duration of every finished batch over its datasets by their estimates.
+"""
+from typing import Callable, Hashable, List, Mapping, Sequence, Union
+from pathlib import Path
+import heapq
+import json
+import math
+import time
+
+from nl_open_data.config import config
+
+OVERHEAD_SECONDS = 30  # Per dataset: fetching metadata, creating the BQ dataset and tables
+CELLS_PER_SECOND = 200_000
+TARGET_SECONDS = 1800  # Expected work per batch
+MAX_CONCURRENT = 8  # Flow runs running at the same time
+POLL_SECONDS = 30
+
+
+def estimate_seconds(
+    record_count: int,
+    column_count: int,
+    previous_seconds: float = None,
+    cells_per_second: float = CELLS_PER_SECOND,
+    overhead_seconds: float = OVERHEAD_SECONDS,
+) -> float:
+    """Estimates the seconds needed to mirror a dataset.
+
+    Parameters
+    ----------
+    record_count : int
+        The number of rows of the dataset (`RecordCount` in the catalog)
+    column_count : int
+        The number of columns of the dataset (`ColumnCount` in the catalog)
+    previous_seconds : float, default=None
+        The duration of the previous run of the dataset, used instead of its size if longer (a
+        previous run may have skipped the dataset as unchanged)
+    cells_per_second : float, default=CELLS_PER_SECOND
+        Cells processed per second
+    overhead_seconds : float, default=OVERHEAD_SECONDS
+        Seconds needed per dataset regardless of its size
+
+    Returns
+    -------
+    float
+        The estimated number of seconds
+    """
+    cells = (record_count or 0) * max(column_count or 0, 1)
+    return max(overhead_seconds + cells / cells_per_second, previous_seconds or 0)
+
+
+def plan_batches(
+    costs: Mapping[Hashable, float],
+    target_seconds: float = TARGET_SECONDS,
+    max_batch_size: int = None,
+) -> List[list]:
+    """Spreads datasets over batches with about equal work, see the module docstring.
+
+    Parameters
+    ----------
+    costs : Mapping
+        The estimated seconds per dataset id
+    target_seconds : float, default=TARGET_SECONDS
+        The work per batch to aim for
+    max_batch_size : int, default=None
+        If given, the maximum number of datasets per batch
+
+    Returns
+    -------
+    list of list
+        The ids per batch, the batch with the most work first and the largest dataset first within
+        every batch
+    """
+    if not costs:
+        return []
+    ordered = sorted(costs, key=costs.get, reverse=True)
+    total = sum(costs.values())
+    n_batches = max(
+        math.ceil(total / target_seconds),
+        sum(1 for cost in costs.values() if cost >= target_seconds),
+        math.ceil(len(costs) / max_batch_size) if max_batch_size else 1,
+    )
+    n_batches = min(n_batches, len(costs))
+    # (work, batch index) of every batch that can take another dataset
+    heap = [(0.0, i) for i in range(n_batches)]
+    batches = [[] for _ in range(n_batches)]
+    loads = [0.0] * n_batches
+    for id_ in ordered:
+        load, i = heapq.heappop(heap)
+        batches[i].append(id_)
+        loads[i] = load + costs[id_]
+        if not max_batch_size or len(batches[i]) < max_batch_size:
+            heapq.heappush(heap, (loads[i], i))
+    order = sorted(range(n_batches), key=lambda i: loads[i], reverse=True)
+    return [batches[i] for i in order]
+
+
+class DurationHistory:
+    """The durations of previous runs per dataset id, stored in a json file.
+
+    Parameters
+    ----------
+    path : str or Path, default=None
+        The json file. If None, 'statline_durations.json' in the cache folder from the config.
+    """
+
+    def __init__(self, path: Union[str, Path] = None):
+        if path is None:
+            path = Path(config.cache.folder) / "statline_durations.json"
+        self.path = Path(path).expanduser()
+        try:
+            self.seconds = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            self.seconds = {}
+
+    def get(self, id_: str) -> float:
+        return self.seconds.get(id_)
+
+    def record_batch(
+        self, ids: Sequence[str], seconds: float, estimates: Mapping[str, float]
+    ) -> None:
+        """Divides the duration of a batch over its datasets, in proportion to their estimates."""
+        total = sum(estimates[id_] for id_ in ids) or 1
+        for id_ in ids:
+            self.seconds[id_] = seconds * estimates[id_] / total
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.seconds, indent=1, sort_keys=True))
+
+
+def submit_batches(
+    batches: Sequence[list],
+    submit: Callable[[int, list], str],
+    is_finished: Callable[[str], bool],
+    max_concurrent: int = MAX_CONCURRENT,
+    poll_seconds: float = POLL_SECONDS,
+    on_finished: Callable[[list, float], None] = None,
+) -> List[str]:
+    """Submits batches in order, with at most `max_concurrent` of them running at a time.
+
+    Parameters
+    ----------
+    batches : list of list
+        The ids per batch, as returned by `plan_batches`
+    submit : callable
+        Called with the index and the ids of a batch, to start its flow run. Returns its id.
+    is_finished : callable
+        Called with the id of a flow run, to check whether it has finished
+    max_concurrent : int, default=MAX_CONCURRENT
+        The maximum number of unfinished flow runs
+    poll_seconds : float, default=POLL_SECONDS
+        Seconds between checks of the running flow runs
+    on_finished : callable, default=None
+        Called with the ids of every finished batch and its duration (measured from submission,
+        within `poll_seconds`), i.e. `DurationHistory.record_batch`
+
+    Returns
+    -------
+    list of str
+        The ids of the submitted flow runs
+    """
+    flow_run_ids = []
+    running = {}  # flow run id -> (batch, submission time)
+    pending = list(enumerate(batches))[::-1]
+    while pending or running:
+        while pending and len(running) < max_concurrent:
+            i, batch = pending.pop()
+            flow_run_id = submit(i, batch)
+            flow_run_ids.append(flow_run_id)
+            running[flow_run_id] = (batch, time.monotonic())
+        time.sleep(poll_seconds)
+        for flow_run_id in [id_ for id_ in running if is_finished(id_)]:
+            batch, started = running.pop(flow_run_id)
+            if on_finished:
+                on_finished(batch, time.monotonic() - started)
+    return flow_run_ids
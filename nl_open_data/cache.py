@@ -0,0 +1,209 @@
+"""A persistent, content-addressed cache for downloaded files.
+
+Temp folders are created anew for every flow run, so without a cache the same source files
+(i.e. the KWB and Nabijheid xls files, or older UWV zip files) are downloaded on every run.
+The cache keeps one copy of every file under its sha256 in `<folder>/objects`, and an sqlite
+index mapping urls to those objects, together with the ETag and Last-Modified validators needed
+to revalidate them. The least recently used files are evicted when the cache exceeds its size cap.
+
+Hits and misses are counted in the index as well, so the counters add up over all processes
+(i.e. Dask workers) using the same cache folder.
+"""
+from typing import Union, Optional
+from pathlib import Path
+import os
+import shutil
+import sqlite3
+import time
+
+from nl_open_data.config import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0);
+"""
+
+_cache = None
+
+
+class DownloadCache:
+    """A local file cache, keyed by url and validated by ETag / Last-Modified.
+
+    Parameters
+    ----------
+    folder : str or Path
+        The folder holding the cached files and the index. Created if it does not exist.
+    max_bytes : int
+        The maximum total size of the cached files, after which the least recently used are evicted
+    """
+
+    def __init__(self, folder: Union[str, Path], max_bytes: int):
+        self.folder = Path(folder).expanduser()
+        self.max_bytes = max_bytes
+        self.objects = self.folder / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index = self.folder / "index.sqlite"
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.index, timeout=60)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def _count(self, con: sqlite3.Connection, name: str, n: int = 1) -> None:
+        con.execute("UPDATE counters SET value = value + ? WHERE name = ?", (n, name))
+
+    def object_path(self, sha256: str) -> Path:
+        """The path of the cached file with this checksum."""
+        return self.objects / sha256[:2] / sha256
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """Returns the cache entry for a url, or None if the url is not cached."""
+        with self._connect() as con:
+            row = con.execute("SELECT * FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None or not self.object_path(row["sha256"]).exists():
+            return None
+        return dict(row)
+
+    def fetch(self, entry: dict, filepath: Union[str, Path]) -> Path:
+        """Places a cached file at filepath and counts a hit.
+
+        The file is hard linked if possible, and copied otherwise.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file was evicted (i.e. by another process) since it was looked up
+        """
+        filepath = Path(filepath)
+        if filepath.exists():
+            filepath.unlink()
+        _link_or_copy(self.object_path(entry["sha256"]), filepath)
+        with self._connect() as con:
+            con.execute(
+                "UPDATE entries SET last_access = ? WHERE url = ?",
+                (time.time(), entry["url"]),
+            )
+            self._count(con, "hits")
+        return filepath
+
+    def store(
+        self,
+        url: str,
+        filepath: Union[str, Path],
+        sha256: str,
+        etag: str = None,
+        last_modified: str = None,
+    ) -> dict:
+        """Adds a downloaded file to the cache, counts a miss and evicts files if needed.
+
+        The file itself is left in place.
+        """
+        filepath = Path(filepath)
+        obj = self.object_path(sha256)
+        if not obj.exists():
+            obj.parent.mkdir(exist_ok=True)
+            tmp = obj.with_name(f"{obj.name}.{os.getpid()}.tmp")
+            _link_or_copy(filepath, tmp)
+            tmp.replace(obj)
+        entry = dict(
+            url=url,
+            sha256=sha256,
+            size=filepath.stat().st_size,
+            etag=etag,
+            last_modified=last_modified,
+            last_access=time.time(),
+        )
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO entries VALUES "
+                "(:url, :sha256, :size, :etag, :last_modified, :last_access)",
+                entry,
+            )
+            self._count(con, "misses")
+        self.evict()
+        return entry
+
+    def evict(self) -> int:
+        """Removes the least recently used entries until the cache fits in max_bytes.
+
+        Returns
+        -------
+        int
+            The number of evicted entries
+        """
+        evicted = 0
+        with self._connect() as con:
+            total = con.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT DISTINCT sha256, size FROM entries)"
+            ).fetchone()[0]
+            rows = con.execute(
+                "SELECT url, sha256, size FROM entries ORDER BY last_access"
+            ).fetchall()
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                con.execute("DELETE FROM entries WHERE url = ?", (row["url"],))
+                evicted += 1
+                shared = con.execute(
+                    "SELECT 1 FROM entries WHERE sha256 = ?", (row["sha256"],)
+                ).fetchone()
+                if not shared:
+                    self.object_path(row["sha256"]).unlink(missing_ok=True)
+                    total -= row["size"]
+            self._count(con, "evictions", evicted)
+        return evicted
+
+    @property
+    def hits(self) -> int:
+        return self.stats()["hits"]
+
+    @property
+    def misses(self) -> int:
+        return self.stats()["misses"]
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and eviction counters, and the number and total size of cached files."""
+        with self._connect() as con:
+            stats = {
+                row["name"]: row["value"]
+                for row in con.execute("SELECT name, value FROM counters")
+            }
+            entries, size = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        stats.update(entries=entries, size_bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def get_cache() -> DownloadCache:
+    """Returns the download cache of this process, as configured in `[cache]` of 'user_config.toml'."""
+    global _cache
+    if _cache is None:
+        _cache = DownloadCache(
+            folder=config.cache.folder,
+            max_bytes=int(config.cache.max_size_gb * 2 ** 30),
+        )
+    return _cache
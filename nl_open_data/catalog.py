@@ -0,0 +1,452 @@
+"""Detecting changed Statline datasets from a single snapshot of a CBS catalog.
+
+Deciding per dataset whether it changed since it was last mirrored (as `statline_bq`'s
+`_skip_dataset` does) takes a metadata request to CBS and a metadata lookup in GCP for every id.
+Instead, the `Modified` dates of all datasets are fetched in a single pass over the catalog, and
+compared to the `Modified` dates of the last mirrored versions, listed in a single GCS request.
+Datasets missing from this snapshot (i.e. in the first runs after it was introduced) are still
+checked per dataset, and recorded in the snapshot afterwards. Datasets only published in odata v4
+are looked up in the v4 catalog, and recorded in a snapshot of their own.
+
+The last mirrored `Modified` date of every dataset is kept as the metadata of an empty marker blob
+per dataset ('<SNAPSHOT_PREFIX>/<source>_<odata version>/<id>'), rather than in one json file, so
+concurrent flow runs (i.e. the batches of `nl_open_data.batches`) can record their datasets without
+overwriting each other's.
+
+Catalogs are fetched page by page, following OData's next links, with the shared (pooled, retrying
+and compressed) download session, and every page is turned into an Arrow record batch rather than
+collected into one list of dicts (see `iter_record_batches` and `fetch_catalogs`). The v3 catalogs
+are read with a declared schema (`CATALOG_SCHEMAS`), so their types do not depend on the values of
+a page.
+
+The CBS catalogs are also kept in a local sqlite index (see `CatalogIndex`), refreshed by the
+'statline-catalogs' flow, so scripts listing the datasets of a source (i.e. the `run_*` scripts)
+do not query the catalogs in BigQuery on every launch. BigQuery is only queried if the index of a
+catalog is missing or older than `max_age_hours` in the `[catalog]` section of the config.
+"""
+from typing import Iterable, Iterator, Mapping, Optional, Sequence, Tuple, Union
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+import sqlite3
+import time
+
+import pyarrow as pa
+import requests
+
+from nl_open_data.config import config
+from nl_open_data.download import TIMEOUT, get_session
+from nl_open_data.utils import get_gcs_bucket, query_catalog_tables
+
+CATALOG_URLS = {
+    "cbs_v3": "https://opendata.cbs.nl/ODataCatalog/Tables",
+    "external_v3": "https://dataderden.cbs.nl/ODataCatalog/Tables",
+    "cbs_v4": "https://odata4.cbs.nl/CBS/Datasets",
+}
+# The fields of the odata v3 catalogs ('Tables'), all strings but the counts
+_V3_INTEGERS = {"ID", "RecordCount", "ColumnCount"}
+_V3_FIELDS = (
+    "ID Title ShortTitle Identifier Summary Modified MetaDataModified ReasonDelivery "
+    "ExplanatoryText OutputStatus Language Catalog Frequency Period SummaryAndLinks ApiUrl "
+    "FeedUrl DefaultPresentation DefaultSelection GraphTypes RecordCount ColumnCount "
+    "SearchPriority"
+).split()
+V3_CATALOG_SCHEMA = pa.schema(
+    [(name, pa.int64() if name in _V3_INTEGERS else pa.string()) for name in _V3_FIELDS]
+)
+CATALOG_SCHEMAS = {"cbs_v3": V3_CATALOG_SCHEMA, "external_v3": V3_CATALOG_SCHEMA}
+NEXT_LINKS = ("odata.nextLink", "@odata.nextLink")  # The next page in odata v3 and v4
+SNAPSHOT_PREFIX = "_snapshots/statline"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    catalog TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    source TEXT,
+    modified TEXT,
+    record_count INTEGER,
+    column_count INTEGER,
+    PRIMARY KEY (catalog, identifier)
+);
+CREATE INDEX IF NOT EXISTS tables_source ON tables (catalog, source);
+CREATE TABLE IF NOT EXISTS refreshes (
+    catalog TEXT PRIMARY KEY,
+    refreshed REAL NOT NULL
+);
+"""
+
+_index = None
+
+
+def catalog_name(third_party: bool = False, odata_version: str = "v3") -> str:
+    """Returns the name of a catalog, i.e. 'cbs_v3' or 'external_v3'."""
+    return f"{'external' if third_party else 'cbs'}_{odata_version}"
+
+
+def catalog_url(third_party: bool = False, odata_version: str = "v3") -> str:
+    """Returns the url of the core (or third party) CBS catalog."""
+    return CATALOG_URLS[catalog_name(third_party, odata_version)]
+
+
+def iter_pages(
+    url: str, params: Mapping = None, session: requests.Session = None
+) -> Iterator[list]:
+    """Yields the records of every page of an OData collection, following its next links.
+
+    Parameters
+    ----------
+    url : str
+        The url of the collection, i.e. a catalog url
+    params : Mapping, default=None
+        Query parameters of the first request (i.e. '$select'). Next links hold their own.
+    session : requests.Session, default=None
+        The session to use. If None, the shared download session.
+
+    Yields
+    ------
+    list of dict
+        The records ('value') of a page
+    """
+    session = session or get_session()
+    params = {"$format": "json", **(params or {})}
+    while url:
+        response = session.get(url, params=params, timeout=TIMEOUT)
+        response.raise_for_status()
+        page = response.json()
+        yield page["value"]
+        next_link = next((page[key] for key in NEXT_LINKS if page.get(key)), None)
+        url, params = (urljoin(url, next_link), None) if next_link else (None, None)
+
+
+def iter_record_batches(
+    url: str,
+    schema: pa.Schema = None,
+    params: Mapping = None,
+    session: requests.Session = None,
+) -> Iterator[pa.RecordBatch]:
+    """Yields every page of an OData collection as an Arrow record batch, see `iter_pages`.
+
+    Parameters
+    ----------
+    url, params, session
+        See `iter_pages`
+    schema : pa.Schema, default=None
+        The schema of the records. Fields missing from a record are null, and fields missing from
+        the schema are dropped. If None, the schema of every page is inferred.
+
+    Yields
+    ------
+    pa.RecordBatch
+        The records of a page
+    """
+    for records in iter_pages(url, params, session):
+        if records:
+            yield pa.RecordBatch.from_pylist(records, schema=schema)
+
+
+def fetch_catalogs(
+    urls: Mapping[str, str],
+    schemas: Mapping[str, pa.Schema] = None,
+    max_workers: int = None,
+) -> dict:
+    """Fetches CBS catalogs concurrently, each as an Arrow table of its pages.
+
+    Parameters
+    ----------
+    urls : Mapping
+        The url of every catalog by name (i.e. `CATALOG_URLS`)
+    schemas : Mapping, default=None
+        The schema of the records of catalogs by name. Other catalogs have their schemas inferred,
+        and pages with different inferred types are promoted to a common schema.
+    max_workers : int, default=None
+        Number of catalogs fetched at the same time. If None, all of them.
+
+    Returns
+    -------
+    dict
+        The table of every catalog by name
+    """
+    schemas = schemas or {}
+
+    def fetch(name: str) -> pa.Table:
+        schema = schemas.get(name)
+        batches = list(iter_record_batches(urls[name], schema))
+        if schema is not None:
+            return pa.Table.from_batches(batches, schema=schema)
+        if not batches:
+            return pa.table({})
+        tables = [pa.Table.from_batches([batch]) for batch in batches]
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(urls) or 1) as pool:
+        return dict(zip(urls, pool.map(fetch, urls)))
+
+
+def fetch_modified(
+    third_party: bool = False,
+    source: str = None,
+    odata_version: str = "v3",
+    session: requests.Session = None,
+) -> dict:
+    """Fetches the `Modified` date of every dataset in a CBS catalog, in a single pass.
+
+    Parameters
+    ----------
+    third_party : bool, default=False
+        Whether to fetch the third party (dataderden) catalog instead of the core catalog
+    source : str, default=None
+        If given, only datasets of this `Catalog` (i.e. 'mlz') are returned
+    odata_version : str, default="v3"
+        The odata version of the catalog
+    session : requests.Session, default=None
+        The session to use. If None, the shared download session.
+
+    Returns
+    -------
+    dict
+        The `Modified` date (as given by CBS, i.e. '2021-06-04T02:00:00') by dataset id
+    """
+    pages = iter_pages(
+        catalog_url(third_party, odata_version),
+        params={"$select": "Identifier,Modified,Catalog"},
+        session=session,
+    )
+    return {
+        table["Identifier"]: table["Modified"]
+        for records in pages
+        for table in records
+        if source is None or table["Catalog"].lower() == source.lower()
+    }
+
+
+def snapshot_prefix(source: str, odata_version: str = "v3") -> str:
+    return f"{SNAPSHOT_PREFIX}/{source.lower()}_{odata_version}/"
+
+
+def read_snapshot(source: str, gcp: Mapping, odata_version: str = "v3") -> dict:
+    """Lists the `Modified` dates of the last mirrored versions of all datasets of a source.
+
+    Parameters
+    ----------
+    source : str
+        The source of the datasets (i.e. 'cbs' or 'mlz')
+    gcp : Box
+        A Box object, holding GCP project parameters
+    odata_version : str, default="v3"
+        The odata version of the datasets
+
+    Returns
+    -------
+    dict
+        The `Modified` date by dataset id
+    """
+    prefix = snapshot_prefix(source, odata_version)
+    return {
+        blob.name[len(prefix) :]: (blob.metadata or {}).get("modified")
+        for blob in get_gcs_bucket(gcp).list_blobs(prefix=prefix)
+    }
+
+
+def write_snapshot(
+    modified: Mapping[str, str], source: str, gcp: Mapping, odata_version: str = "v3"
+) -> None:
+    """Records the `Modified` dates of mirrored datasets, see `read_snapshot`."""
+    bucket = get_gcs_bucket(gcp)
+    prefix = snapshot_prefix(source, odata_version)
+    for id_, date in modified.items():
+        blob = bucket.blob(prefix + id_)
+        blob.metadata = {"modified": date}
+        blob.upload_from_string(b"")
+
+
+def catalog_versions(third_party: bool = False) -> tuple:
+    """Returns the odata versions of the core (or third party) catalogs, v3 first."""
+    return tuple(
+        version
+        for version in ("v3", "v4")
+        if catalog_name(third_party, version) in CATALOG_URLS
+    )
+
+
+def fetch_modified_versions(
+    third_party: bool = False, source: str = None, session: requests.Session = None
+) -> Tuple[dict, dict]:
+    """Fetches the `Modified` dates of the datasets in all (v3 and v4) catalogs of CBS.
+
+    Datasets listed in both catalogs are taken from the v3 catalog.
+
+    Returns
+    -------
+    tuple of dict
+        The `Modified` date and the odata version of the catalog, by dataset id
+    """
+    modified, versions = {}, {}
+    for odata_version in catalog_versions(third_party):
+        dates = fetch_modified(third_party, source, odata_version, session=session)
+        for id_, date in dates.items():
+            if id_ not in modified:
+                modified[id_], versions[id_] = date, odata_version
+    return modified, versions
+
+
+def split_changed_ids(
+    ids: Sequence[str], modified: Mapping[str, str], snapshot: Mapping[str, str]
+) -> Tuple[list, list]:
+    """Splits ids in those known to have changed, and those not in the snapshot or catalog.
+
+    The first are the ids whose catalog `Modified` date differs from the snapshot. Nothing is
+    known of the others: they may not have been mirrored since the snapshot was introduced, or not
+    be in the catalog, so whether they changed has to be checked against GCP per dataset. Ids whose
+    date equals the snapshot are left out, as unchanged.
+    """
+    changed, unknown = [], []
+    for id_ in ids:
+        if id_ not in modified or snapshot.get(id_) is None:
+            unknown.append(id_)
+        elif snapshot[id_] != modified[id_]:
+            changed.append(id_)
+    return changed, unknown
+
+
+class CatalogIndex:
+    """A local sqlite index of the datasets in the CBS catalogs.
+
+    Parameters
+    ----------
+    path : str or Path
+        The sqlite file. Its folder is created if it does not exist.
+    max_age_hours : float, default=24
+        The age after which the index of a catalog is stale
+    """
+
+    def __init__(self, path: Union[str, Path], max_age_hours: float = 24):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age_hours = max_age_hours
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=60)
+        con.row_factory = sqlite3.Row
+        return con
+
+    def refresh(self, catalog: str, tables: Iterable[Mapping]) -> int:
+        """Replaces the index of a catalog by its tables, as listed by CBS or in BigQuery.
+
+        Parameters
+        ----------
+        catalog : str
+            The name of the catalog, i.e. 'cbs_v3'
+        tables : Iterable of Mapping
+            The `Identifier`, `Catalog`, `Modified`, `RecordCount` and `ColumnCount` of every dataset
+
+        Returns
+        -------
+        int
+            The number of indexed datasets
+        """
+        rows = [
+            (
+                catalog,
+                table["Identifier"],
+                (table.get("Catalog") or "").lower(),
+                str(table["Modified"]) if table.get("Modified") else None,
+                table.get("RecordCount"),
+                table.get("ColumnCount"),
+            )
+            for table in tables
+        ]
+        with self._connect() as con:
+            con.execute("DELETE FROM tables WHERE catalog = ?", (catalog,))
+            con.executemany(
+                "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            con.execute(
+                "INSERT OR REPLACE INTO refreshes VALUES (?, ?)", (catalog, time.time())
+            )
+        return len(rows)
+
+    def refreshed(self, catalog: str) -> Optional[float]:
+        """Returns the time the index of a catalog was refreshed, or None if it never was."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT refreshed FROM refreshes WHERE catalog = ?", (catalog,)
+            ).fetchone()
+        return row["refreshed"] if row else None
+
+    def is_stale(self, catalog: str) -> bool:
+        refreshed = self.refreshed(catalog)
+        return refreshed is None or time.time() - refreshed > self.max_age_hours * 3600
+
+    def tables(
+        self,
+        catalog: str,
+        source: str = None,
+        modified_since: str = None,
+        min_records: int = None,
+        max_records: int = None,
+    ) -> list:
+        """Returns the indexed datasets of a catalog, as dicts, ordered by identifier.
+
+        Parameters
+        ----------
+        catalog : str
+            The name of the catalog, i.e. 'cbs_v3'
+        source : str, default=None
+            If given, only datasets of this source (`Catalog`, i.e. 'mlz')
+        modified_since : str, default=None
+            If given, only datasets modified at or after this ISO date (i.e. '2021-06-01')
+        min_records, max_records : int, default=None
+            If given, only datasets with at least / at most this many rows (`RecordCount`)
+        """
+        conditions, params = ["catalog = ?"], [catalog]
+        for condition, value in (
+            ("source = ?", source.lower() if source else None),
+            ("modified >= ?", modified_since),
+            ("record_count >= ?", min_records),
+            ("record_count <= ?", max_records),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        query = f"SELECT * FROM tables WHERE {' AND '.join(conditions)} ORDER BY identifier"
+        with self._connect() as con:
+            return [dict(row) for row in con.execute(query, params)]
+
+    def ids_by_source(self, catalog: str) -> dict:
+        """Returns the dataset ids of a catalog, grouped by source in a single pass."""
+        ids = defaultdict(list)
+        for table in self.tables(catalog):
+            ids[table["source"]].append(table["identifier"])
+        return dict(ids)
+
+
+def get_catalog_index() -> CatalogIndex:
+    """Returns the catalog index of this process, as configured in `[catalog]` of 'user_config.toml'."""
+    global _index
+    if _index is None:
+        settings = config.get("catalog", {})
+        _index = CatalogIndex(
+            settings.get("path", Path(config.cache.folder) / "catalogs.sqlite"),
+            max_age_hours=settings.get("max_age_hours", 24),
+        )
+    return _index
+
+
+def load_catalog(
+    third_party: bool = False, odata_version: str = "v3", index: CatalogIndex = None
+) -> str:
+    """Makes sure the local index of a catalog is fresh, refreshing it from BigQuery if it is stale.
+
+    Returns
+    -------
+    str
+        The name of the catalog in the index
+    """
+    index = index or get_catalog_index()
+    catalog = catalog_name(third_party, odata_version)
+    if index.is_stale(catalog):
+        index.refresh(catalog, query_catalog_tables(third_party, odata_version))
+    return catalog
@@ -1,8 +1,185 @@
+"""Generating SQL queries flattening Statline datasets in BigQuery.
+
+The dimensions and topics of a dataset are read from its `{id}_DataProperties` table. Generating
+queries for hundreds of datasets took a query per dataset for both, so the properties of all
+datasets can be fetched at once into a local `DataPropertiesCache` instead: the
+`_DataProperties` tables are listed with a single `INFORMATION_SCHEMA` query, and read with a
+few `UNION ALL` queries of `TABLES_PER_QUERY` tables each. `flatten_table` then renders its SQL
+from the cache, without querying BigQuery.
+"""
+from typing import Iterable, Mapping, Sequence, Union
+from collections import defaultdict
+from pathlib import Path
+import json
+
 from nl_open_data.config import config
 
 # from nl_open_data.config import get_config
 from google.cloud import bigquery
 
+import nl_open_data.utils as nlu
+
+DATA_PROPERTIES_SUFFIX = "_DataProperties"
+# Tables read per UNION ALL query, well below the 1000 tables a BigQuery query may reference
+TABLES_PER_QUERY = 500
+# The rows of the DataProperties tables needed to flatten a dataset
+PROPERTIES_FILTER = "Type LIKE '%Dimension%' OR Type LIKE '%Geo%' OR Type = 'Topic'"
+
+
+def _get_client(credentials=None, GCP=None) -> bigquery.Client:
+    """Returns the shared client of a GCP environment, or a new one for explicit credentials."""
+    if credentials is not None:
+        return bigquery.Client(
+            credentials=credentials, project=GCP.project_id, location=GCP.location
+        )
+    return nlu.get_bq_client(GCP)
+
+
+def get_data_properties_from_bq(id, schema="cbs", credentials=None, GCP=None) -> list:
+    """Query dataset for its dimensions and topics, in a single query
+
+    Returns the Key, Title and Type of every dimension and topic of the dataset, see
+    `get_dimensions_from_bq` and `get_topics_from_bq`.
+    """
+    query = f"""
+    SELECT Key, Title, Type
+    FROM {GCP.project_id}.{schema}.{id}{DATA_PROPERTIES_SUFFIX}
+    WHERE {PROPERTIES_FILTER}
+    """
+    bq = _get_client(credentials, GCP)
+    return [dict(row.items()) for row in bq.query(query)]
+
+
+def list_data_properties_tables(
+    GCP, schemas: Iterable[str] = None, credentials=None
+) -> list:
+    """Lists the (schema, id) of every DataProperties table of a project, in a single query
+
+    The tables are listed from the INFORMATION_SCHEMA of the region of the project
+    (`GCP.location`), optionally only those in the given schemas (datasets).
+    """
+    query = f"""
+    SELECT table_schema, table_name
+    FROM `{GCP.project_id}`.`region-{GCP.location.lower()}`.INFORMATION_SCHEMA.TABLES
+    WHERE ENDS_WITH(table_name, '{DATA_PROPERTIES_SUFFIX}')
+    """
+    job_config = None
+    if schemas is not None:
+        query += "AND table_schema IN UNNEST(@schemas)\n"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("schemas", "STRING", list(schemas))
+            ]
+        )
+    bq = _get_client(credentials, GCP)
+    return sorted(
+        (row["table_schema"], row["table_name"][: -len(DATA_PROPERTIES_SUFFIX)])
+        for row in bq.query(query, job_config=job_config)
+    )
+
+
+def query_data_properties(
+    tables: Sequence[tuple],
+    GCP,
+    credentials=None,
+    tables_per_query: int = TABLES_PER_QUERY,
+) -> dict:
+    """Reads the dimensions and topics of many datasets with a few UNION ALL queries
+
+    Given the (schema, id) of every dataset (i.e. from `list_data_properties_tables`), the
+    DataProperties tables are read `tables_per_query` at a time. All queries are started before
+    the results of the first are read, so BigQuery runs them concurrently.
+
+    Returns the rows of every dataset, by `DataPropertiesCache.key`.
+    """
+    bq = _get_client(credentials, GCP)
+    jobs = []
+    for start in range(0, len(tables), tables_per_query):
+        selects = [
+            f"""
+    SELECT '{schema}' AS dataset_schema, '{id}' AS dataset_id, Key, Title, Type
+    FROM {GCP.project_id}.{schema}.{id}{DATA_PROPERTIES_SUFFIX}
+    WHERE {PROPERTIES_FILTER}"""
+            for schema, id in tables[start : start + tables_per_query]
+        ]
+        jobs.append(bq.query("\n    UNION ALL".join(selects)))
+    properties = {DataPropertiesCache.key(id, schema): [] for schema, id in tables}
+    for job in jobs:
+        for row in job:
+            key = DataPropertiesCache.key(row["dataset_id"], row["dataset_schema"])
+            properties[key].append(
+                {"Key": row["Key"], "Title": row["Title"], "Type": row["Type"]}
+            )
+    return properties
+
+
+class DataPropertiesCache:
+    """The dimensions and topics of Statline datasets, stored in a json file.
+
+    Filled with `refresh`, which fetches the DataProperties of all datasets in a few queries (see
+    the module docstring), after which `flatten_table` needs no queries for these datasets.
+
+    Parameters
+    ----------
+    path : str or Path, default=None
+        The json file. If None, 'data_properties.json' in the cache folder from the config.
+    """
+
+    def __init__(self, path: Union[str, Path] = None):
+        if path is None:
+            path = Path(config.cache.folder) / "data_properties.json"
+        self.path = Path(path).expanduser()
+        try:
+            self.properties = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            self.properties = {}
+
+    @staticmethod
+    def key(id: str, schema: str = "cbs") -> str:
+        return f"{schema}.{id}"
+
+    def get(self, id: str, schema: str = "cbs") -> list:
+        """Returns the rows (Key, Title and Type) of a dataset, raising a KeyError if not cached."""
+        try:
+            return self.properties[self.key(id, schema)]
+        except KeyError:
+            raise KeyError(
+                f"No DataProperties of {self.key(id, schema)} in {self.path}, "
+                "refresh the cache first"
+            ) from None
+
+    def refresh(
+        self, GCP, schemas: Iterable[str] = None, credentials=None, save: bool = True
+    ) -> int:
+        """Fetches the DataProperties of all datasets (in `schemas`, if given) of a project
+
+        Returns the number of datasets fetched.
+        """
+        tables = list_data_properties_tables(
+            GCP, schemas=schemas, credentials=credentials
+        )
+        properties = query_data_properties(tables, GCP, credentials=credentials)
+        self.properties.update(properties)
+        if save:
+            self.save()
+        return len(tables)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.properties, indent=1, sort_keys=True))
+
+
+def split_properties(rows: Iterable[Mapping]) -> dict:
+    """Places the Key-Title pairs of DataProperties rows in dicts according to their Type
+
+    In a single pass over the rows, i.e. {"Dimension": {...}, "TimeDimension": {...},
+    "GeoDimension": {...}, "GeoDetail": {...}, "Topic": {...}}, keeping their order.
+    """
+    by_type = defaultdict(dict)
+    for row in rows:
+        by_type[row["Type"]][row["Key"]] = row["Title"]
+    return by_type
+
 
 def get_dimensions_from_bq(id, schema="cbs", credentials=None, GCP=None):
     """Query dataset for its dimensions
@@ -18,9 +195,7 @@ def get_dimensions_from_bq(id, schema="cbs", credentials=None, GCP=None):
     """
 
     # initialize client
-    bq = bigquery.Client(
-        credentials=credentials, project=GCP.project_id, location=GCP.location
-    )
+    bq = _get_client(credentials, GCP)
 
     # prepare sql query text
     query = f"""
@@ -42,7 +217,7 @@ def get_topics_from_bq(id, schema="cbs", credentials=None, GCP=None):
     """
 
     # initialize client
-    bq = bigquery.Client(credentials=credentials, project=GCP.project_id)
+    bq = _get_client(credentials, GCP)
 
     # prepare sql query text
     query = f"""
@@ -119,42 +294,38 @@ def write_join_dimensions(dims_dict, join_type, id, schema, GCP):
     return string
 
 
-def flatten_table(id, join_type="INNER", schema="cbs", credentials=None, GCP=None):
+def flatten_table(
+    id, join_type="INNER", schema="cbs", credentials=None, GCP=None, properties=None
+):
     """Flatten a table by joining a fact table (TypedDataSet) with its
     corresponding dimension tables.
+
+    The dimensions and topics are taken from `properties`, either a `DataPropertiesCache` or the
+    DataProperties rows of the dataset, without querying BigQuery. If None, they are queried from
+    the DataProperties table of the dataset.
     """
     # get title
     # title = short title from TableInfos? From user? Other idea?
     title = "Insert Title Here"  # temp - use static TODO
     title = title.lower().replace(" ", "_")  # pythonize title string
 
-    # get dimension info
-    dims_query = get_dimensions_from_bq(
-        id=id, schema=schema, credentials=credentials, GCP=GCP
-    )
-
-    # place dimensions in dicts according to type / ALTERNATIVE OPTION - one iterable with 'Type' marked per item?
-    # dim_types = ["Dimension", "TimeDimension", "GeoDimension", "GeoDetail"]
-    dims = {
-        row["Key"]: row["Title"] for row in dims_query if row["Type"] == "Dimension"
-    }
-    time_dims = {
-        row["Key"]: row["Title"] for row in dims_query if row["Type"] == "TimeDimension"
-    }
-    geo_dims = {
-        row["Key"]: row["Title"] for row in dims_query if row["Type"] == "GeoDimension"
-    }
-    geo_details = {
-        row["Key"]: row["Title"] for row in dims_query if row["Type"] == "GeoDetail"
-    }
-
-    # get topics info
-    topics_query = get_topics_from_bq(
-        id=id, schema=schema, credentials=credentials, GCP=GCP
-    )
+    # get dimension and topic info
+    if properties is None:
+        rows = get_data_properties_from_bq(
+            id=id, schema=schema, credentials=credentials, GCP=GCP
+        )
+    elif isinstance(properties, DataPropertiesCache):
+        rows = properties.get(id, schema)
+    else:
+        rows = properties
 
-    # place topics in a list
-    topics = {row["Key"]: row["Title"] for row in topics_query}
+    # place dimensions and topics in dicts according to type
+    by_type = split_properties(rows)
+    dims = by_type["Dimension"]
+    time_dims = by_type["TimeDimension"]
+    geo_dims = by_type["GeoDimension"]
+    geo_details = by_type["GeoDetail"]
+    topics = by_type["Topic"]
 
     # CREATE statement
     create = f"CREATE OR REPLACE TABLE {GCP.project_id}.dso.{title}"
@@ -171,7 +342,7 @@ def flatten_table(id, join_type="INNER", schema="cbs", credentials=None, GCP=Non
 
     # JOIN statement
     join = write_join_dimensions(
-        dims_dict=dims, join_type="INNER", id=id, schema=schema, GCP=GCP
+        dims_dict=dims, join_type=join_type, id=id, schema=schema, GCP=GCP
     )
 
     # concat query
@@ -0,0 +1,450 @@
+"""In-process http downloads, replacing `curl` subprocesses.
+
+All downloads in a process share a single pooled `requests.Session`, so connections to the same
+host (i.e. cbs.nl or data.overheid.nl) are reused. Files are streamed to disk in chunks while their
+sha256 checksum is computed. Interrupted downloads are resumed using `Range` headers, large files
+can be downloaded as parallel ranges, and files downloaded before are only fetched again if they
+changed, using the ETag and Last-Modified validators stored next to them.
+"""
+from typing import Union, Callable
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from nl_open_data.cache import DownloadCache
+from nl_open_data.utils import process_local
+
+CHUNK_SIZE = 2 ** 20  # 1 MiB
+PART_SIZE = 64 * 2 ** 20  # 64 MiB
+TIMEOUT = (10, 300)  # (connect, read) in seconds
+
+
+@dataclass
+class DownloadResult:
+    """The outcome of a single download.
+
+    `status` is one of 'downloaded', 'resumed', 'not_modified' or 'cached'.
+    """
+
+    url: str
+    path: Path
+    status: str
+    size: int
+    seconds: float
+    sha256: str = None
+    etag: str = None
+    last_modified: str = None
+
+    @property
+    def mb_per_second(self) -> float:
+        if not self.seconds or self.status in ("not_modified", "cached"):
+            return 0.0
+        return self.size / 2 ** 20 / self.seconds
+
+
+def get_session(pool_size: int = 16, retries: int = 3) -> requests.Session:
+    """Returns the http session shared by all downloads in this process.
+
+    The session is registered with `nl_open_data.utils.process_local`, so forked processes
+    create their own session instead of sharing connections.
+
+    Parameters
+    ----------
+    pool_size : int, default=16
+        Maximum number of connections kept open per host
+    retries : int, default=3
+        Number of retries on connection errors and 5xx responses
+
+    Returns
+    -------
+    session: requests.Session
+        A session with a pooled, retrying adapter mounted for http and https
+    """
+
+    def create_session():
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    return process_local(("http_session", pool_size, retries), create_session)
+
+
+def _meta_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".meta.json")
+
+
+def _part_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".part")
+
+
+def read_meta(filepath: Union[str, Path]) -> dict:
+    """Returns the download metadata stored next to a file, or an empty dict if there is none."""
+    meta_path = _meta_path(Path(filepath))
+    if not meta_path.exists():
+        return {}
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(filepath: Path, meta: dict) -> None:
+    with open(_meta_path(filepath), "w") as f:
+        json.dump(meta, f)
+
+
+def file_sha256(filepath: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> str:
+    """Computes the sha256 hex digest of a file, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _validators(response: requests.Response) -> dict:
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def _conditional_headers(validators: dict) -> dict:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def is_fresh(url: str, validators: dict, session: requests.Session = None) -> bool:
+    """Checks with a conditional HEAD request whether a url still matches the given validators.
+
+    Parameters
+    ----------
+    url : str
+        The url to check
+    validators : dict
+        Holding the 'etag' and/or 'last_modified' of a previous download, i.e. a cache entry
+    session : requests.Session, default=None
+        The session to use. If None, the shared session from `get_session` is used.
+
+    Returns
+    -------
+    bool
+        True if the server reports the url as not modified, False otherwise (or if there are no validators)
+    """
+    headers = _conditional_headers(validators)
+    if not headers:
+        return False
+    session = session or get_session()
+    r = session.head(url, headers=headers, allow_redirects=True, timeout=TIMEOUT)
+    return r.status_code == 304
+
+
+def _can_split(response: requests.Response, part_size: int) -> bool:
+    size = int(response.headers.get("Content-Length", 0))
+    return (
+        response.status_code == 200
+        and response.headers.get("Accept-Ranges") == "bytes"
+        and "Content-Encoding" not in response.headers
+        and size >= 2 * part_size
+    )
+
+
+def _download_range(
+    session: requests.Session,
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    if_range: str,
+    chunk_size: int,
+    timeout,
+) -> int:
+    headers = {"Range": f"bytes={start}-{end}"}
+    if if_range:
+        headers["If-Range"] = if_range
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError(f"Server did not honour range request for {url}")
+        offset = start
+        for chunk in r.iter_content(chunk_size):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    if offset != end + 1:
+        raise IOError(f"Incomplete range {start}-{end} for {url}")
+    return offset - start
+
+
+def _download_parallel(
+    session: requests.Session,
+    url: str,
+    part: Path,
+    size: int,
+    validators: dict,
+    part_size: int,
+    max_workers: int,
+    chunk_size: int,
+    timeout,
+) -> None:
+    if_range = validators["etag"] or validators["last_modified"]
+    ranges = [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(
+                    _download_range,
+                    session,
+                    url,
+                    fd,
+                    start,
+                    end,
+                    if_range,
+                    chunk_size,
+                    timeout,
+                )
+                for start, end in ranges
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
+def download_file(
+    url: str,
+    filepath: Union[str, Path],
+    session: requests.Session = None,
+    chunk_size: int = CHUNK_SIZE,
+    part_size: int = PART_SIZE,
+    max_workers: int = 4,
+    expected_sha256: str = None,
+    progress: Callable[[int, int], None] = None,
+    timeout=TIMEOUT,
+    cache: DownloadCache = None,
+) -> DownloadResult:
+    """Downloads a url to a file, streaming it to disk.
+
+    * If the file was downloaded before, a conditional request (If-None-Match / If-Modified-Since)
+      is made, and the file is left untouched if it did not change.
+    * Otherwise, if the url is in `cache`, the same conditional request is made with the validators
+      of the cached file, which is used if it did not change. New downloads are added to the cache.
+    * If a previous download was interrupted, it is resumed from where it stopped (Range / If-Range).
+    * If the server supports range requests and the file is larger than twice `part_size`,
+      it is downloaded in parallel ranges of `part_size` bytes.
+
+    The file is written to '<filepath>.part' and only moved to `filepath` when complete. ETag,
+    Last-Modified and sha256 are stored in '<filepath>.meta.json'.
+
+    Parameters
+    ----------
+    url : str
+        Url to download
+    filepath : str or Path
+        File for saving the fetched url
+    session : requests.Session, default=None
+        The session to use. If None, the shared session from `get_session` is used.
+    chunk_size : int, default=1 MiB
+        Number of bytes to read from the network at once
+    part_size : int, default=64 MiB
+        Size of the ranges for parallel downloads
+    max_workers : int, default=4
+        Maximum number of parallel ranges. Set to 1 to disable parallel downloads.
+    expected_sha256 : str, default=None
+        If given, the download is verified against this checksum
+    progress : callable, default=None
+        Called as `progress(bytes_done, bytes_total)` while streaming. `bytes_total` is 0 if unknown.
+    timeout : float or tuple, default=(10, 300)
+        Connect and read timeouts passed to requests
+    cache : DownloadCache, default=None
+        A download cache to consult first and add downloads to (i.e. `nl_open_data.cache.get_cache()`)
+
+    Returns
+    -------
+    DownloadResult
+        The path, status, size, duration, checksum and validators of the download
+
+    Raises
+    ------
+    requests.HTTPError
+        If the server responds with an error status
+    ValueError
+        If the checksum does not match `expected_sha256`
+    """
+    session = session or get_session()
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    part = _part_path(filepath)
+    meta = read_meta(filepath)
+    cached = None
+    start_time = time.perf_counter()
+
+    headers = {}
+    resume_from = 0
+    if filepath.exists() and meta:
+        headers = _conditional_headers(meta)
+    elif part.exists() and meta.get("partial"):
+        resume_from = part.stat().st_size
+        headers["Range"] = f"bytes={resume_from}-"
+        if meta.get("etag") or meta.get("last_modified"):
+            headers["If-Range"] = meta.get("etag") or meta["last_modified"]
+    elif cache is not None:
+        cached = cache.lookup(url)
+        if cached:
+            headers = _conditional_headers(cached)
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 304 and cached:
+            try:
+                cache.fetch(cached, filepath)
+            except FileNotFoundError:
+                # Evicted by another process since the lookup: download it as a cache miss
+                print(f"Cached copy of {url} was evicted, downloading it again")
+                return download_file(
+                    url,
+                    filepath,
+                    session=session,
+                    chunk_size=chunk_size,
+                    part_size=part_size,
+                    max_workers=max_workers,
+                    expected_sha256=expected_sha256,
+                    progress=progress,
+                    timeout=timeout,
+                    cache=cache,
+                )
+            _write_meta(
+                filepath,
+                dict(
+                    url=url,
+                    sha256=cached["sha256"],
+                    size=cached["size"],
+                    etag=cached["etag"],
+                    last_modified=cached["last_modified"],
+                ),
+            )
+            return DownloadResult(
+                url=url,
+                path=filepath,
+                status="cached",
+                size=cached["size"],
+                seconds=time.perf_counter() - start_time,
+                sha256=cached["sha256"],
+                etag=cached["etag"],
+                last_modified=cached["last_modified"],
+            )
+        if r.status_code == 304:
+            return DownloadResult(
+                url=url,
+                path=filepath,
+                status="not_modified",
+                size=filepath.stat().st_size,
+                seconds=time.perf_counter() - start_time,
+                sha256=meta.get("sha256"),
+                etag=meta.get("etag"),
+                last_modified=meta.get("last_modified"),
+            )
+        if r.status_code == 416:
+            # The partial file is not a prefix of the current file anymore: start over
+            part.unlink()
+            _meta_path(filepath).unlink()
+            return download_file(
+                url,
+                filepath,
+                session=session,
+                chunk_size=chunk_size,
+                part_size=part_size,
+                max_workers=max_workers,
+                expected_sha256=expected_sha256,
+                progress=progress,
+                timeout=timeout,
+                cache=cache,
+            )
+        r.raise_for_status()
+
+        validators = _validators(r)
+        _write_meta(filepath, dict(url=url, partial=True, **validators))
+        total = int(r.headers.get("Content-Length", 0))
+        sha256 = hashlib.sha256()
+
+        if r.status_code == 206:
+            status = "resumed"
+            total += resume_from
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    sha256.update(chunk)
+            mode = "ab"
+        else:
+            status = "downloaded"
+            resume_from = 0
+            mode = "wb"
+
+        if max_workers > 1 and _can_split(r, part_size):
+            r.close()
+            _download_parallel(
+                session,
+                url,
+                part,
+                total,
+                validators,
+                part_size,
+                max_workers,
+                chunk_size,
+                timeout,
+            )
+            digest = file_sha256(part, chunk_size)
+            if progress:
+                progress(total, total)
+        else:
+            done = resume_from
+            with open(part, mode) as f:
+                for chunk in r.iter_content(chunk_size):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done, total)
+            digest = sha256.hexdigest()
+
+    if expected_sha256 and digest != expected_sha256:
+        part.unlink()
+        _meta_path(filepath).unlink()
+        raise ValueError(
+            f"Checksum mismatch for {url}: expected {expected_sha256}, got {digest}"
+        )
+
+    part.replace(filepath)
+    size = filepath.stat().st_size
+    _write_meta(filepath, dict(url=url, sha256=digest, size=size, **validators))
+    if cache is not None:
+        cache.store(url, filepath, digest, **validators)
+    return DownloadResult(
+        url=url,
+        path=filepath,
+        status=status,
+        size=size,
+        seconds=time.perf_counter() - start_time,
+        sha256=digest,
+        **validators,
+    )
@@ -0,0 +1,131 @@
+"""Dask executors for flows mixing CPU-bound conversions with I/O.
+
+Conversions such as `xls_to_parquet` and `fwf_to_parquet` hold the GIL, so running them on the
+threads of a few Dask workers serializes them. The 'conversion' executor starts a cluster with:
+
+* a process per core (within the memory available), each with a single thread, offering the
+  'CPU' resource, for CPU-bound tasks;
+* one worker with many threads, offering the 'IO' resource, for downloads and uploads.
+
+Tasks choose a pool with a Dask resource tag (see `CPU_BOUND` and `IO_BOUND`), which Prefect's
+`DaskExecutor` turns into resource restrictions. Untagged tasks run on any worker. Workers of the
+'threads' executor offer both resources, so tagged tasks also run there, and with a
+`LocalExecutor` tags are ignored.
+
+The executor of the conversion flows is configured in the `[executor]` section of the config, see
+`dask_executor`.
+"""
+from typing import Mapping
+import os
+
+import psutil
+from prefect.executors import DaskExecutor
+
+# Tags routing a task to a process worker, or to the thread worker
+CPU_BOUND = "dask-resource:CPU=1"
+IO_BOUND = "dask-resource:IO=1"
+
+GB = 2 ** 30
+UNLIMITED = 2 ** 20  # Amount of a resource offered by workers of a 'threads' cluster
+
+
+def conversion_workers(
+    n_processes: int = None,
+    memory_per_process_gb: float = 2,
+    io_threads: int = 16,
+    total_memory: int = None,
+) -> dict:
+    """Returns the worker specs of a conversion cluster, for `distributed.SpecCluster`.
+
+    Parameters
+    ----------
+    n_processes : int, default=None
+        Number of single-threaded process workers. If None, the number of cores, limited to the
+        number of processes that get `memory_per_process_gb` of the available memory each.
+    memory_per_process_gb : float, default=2
+        Memory needed per process worker, used to limit the default number of processes
+    io_threads : int, default=16
+        Number of threads of the I/O worker
+    total_memory : int, default=None
+        Bytes of memory to divide over the workers. If None, the available memory.
+
+    Returns
+    -------
+    dict
+        Worker specs by name: 'cpu-<n>' process workers and an 'io' thread worker
+    """
+    from distributed import Nanny
+
+    total_memory = total_memory or psutil.virtual_memory().available
+    if n_processes is None:
+        by_memory = int(total_memory // (memory_per_process_gb * GB))
+        n_processes = max(min(os.cpu_count() or 1, by_memory), 1)
+    memory_limit = int(total_memory // (n_processes + 1))
+    workers = {
+        f"cpu-{i}": {
+            "cls": Nanny,
+            "options": {
+                "nthreads": 1,
+                "memory_limit": memory_limit,
+                "resources": {"CPU": 1},
+            },
+        }
+        for i in range(n_processes)
+    }
+    workers["io"] = {
+        "cls": Nanny,
+        "options": {
+            "nthreads": io_threads,
+            "memory_limit": memory_limit,
+            "resources": {"IO": io_threads},
+        },
+    }
+    return workers
+
+
+def conversion_cluster(
+    n_processes: int = None,
+    memory_per_process_gb: float = 2,
+    io_threads: int = 16,
+    dashboard_address: str = ":8787",
+):
+    """Starts a `distributed.SpecCluster` with process workers for CPU-bound and a thread worker for I/O tasks.
+
+    See `conversion_workers` for the parameters.
+    """
+    from distributed import Scheduler, SpecCluster
+
+    return SpecCluster(
+        workers=conversion_workers(n_processes, memory_per_process_gb, io_threads),
+        scheduler={"cls": Scheduler, "options": {"dashboard_address": dashboard_address}},
+    )
+
+
+def dask_executor(settings: Mapping = None) -> DaskExecutor:
+    """Returns the Dask executor described by the `[executor]` section of the config.
+
+    Parameters
+    ----------
+    settings : Mapping, default=None
+        `mode` selects the cluster, and the section named after it holds its keyword arguments:
+
+        * 'threads' (the default): a `LocalCluster` (i.e. `n_workers`, `threads_per_worker`)
+        * 'conversion': a `conversion_cluster` (i.e. `n_processes`, `memory_per_process_gb`, `io_threads`)
+
+    Returns
+    -------
+    DaskExecutor
+        The executor to run a flow with
+    """
+    settings = settings or {}
+    mode = settings.get("mode", "threads")
+    cluster_kwargs = dict(settings.get(mode, {}))
+    if mode == "conversion":
+        return DaskExecutor(
+            cluster_class=conversion_cluster, cluster_kwargs=cluster_kwargs
+        )
+    if mode == "threads":
+        # Offer the resources of tagged tasks on every worker, without limiting them
+        cluster_kwargs.setdefault("resources", {"CPU": UNLIMITED, "IO": UNLIMITED})
+        return DaskExecutor(cluster_kwargs=cluster_kwargs)
+    raise ValueError(f"Unknown executor mode {mode}, use 'threads' or 'conversion'")
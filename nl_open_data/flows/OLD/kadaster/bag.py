@@ -1,19 +1,17 @@
 import io
 from pathlib import Path
-import json
 import zipfile
 
 import prefect
-from prefect import task, Parameter, Flow
+from prefect import task, Parameter, Flow, unmapped
 from prefect.tasks.shell import ShellTask
 from prefect.engine.result_handlers import LocalResultHandler
 from prefect.tasks.secrets import PrefectSecret
 from prefect.tasks.gcp.bigquery import BigQueryLoadFile
 from prefect. utilities.configuration import set_temporary_config
-from lxml import etree, objectify
-import xmltodict
 
 from nl_open_data.config import get_config
+import nl_open_data.bag as nlb
 from nimbletl.tasks import curl_cmd, unzip, create_dir
 
 
@@ -34,6 +32,10 @@ NUM_XPATH = ".//" + NUM_TAG
 # VBO data
 VBO_FILE = CONFIG.path.root / CONFIG.path.bag / (f"9999VBO{BAG_VERSION}" + ".zip")
 
+# Complete extract, holding a zip file per object type
+BAG_FILE = CONFIG.path.root / CONFIG.path.bag / "lvbag-extract-nl.zip"
+BAG_TMP_DIR = CONFIG.path.root / CONFIG.path.tmp / Path("BAG")
+
 
 @task
 def create_xml_list(zip_file):
@@ -49,42 +51,37 @@ def create_xml_list(zip_file):
 def parse_num(xml_file, tmp_dir=NUM_TMP_DIR):
     """Parse xml file in BAG NUM zip archive.
 
+    The xml file is streamed out of the zip archive and parsed with `nl_open_data.bag.parse_bag_xml`.
+
     Args:
         - xml_file: str of XML file to be processed in NUM zip archive
 
     Returns:
-        - Path-object to ndjson file
+        - Path-object to parquet file
 
     """
+    parquet = tmp_dir / (xml_file.split(".")[0] + ".parquet")
+    with zipfile.ZipFile(NUM_FILE) as zip, zip.open(xml_file) as file_:
+        nlb.parse_bag_xml(file_, nlb.NUM, parquet)
+    return parquet
 
-    def remove_ns_keys(dict_, root):
-        """Removes keys containing namespaces."""
-        keys = list(dict_[root].keys())
-        for key in keys:
-            if key.startswith("@xmlns"):
-                del dict_[root][key]
-        return dict_
 
-    zip = zipfile.Path(NUM_FILE, xml_file)
-    with zip.open() as file_:
-        xml = etree.parse(file_).getroot()
+@task
+def parse_bag(bag_file=BAG_FILE, out_folder=BAG_TMP_DIR, codes=None):
+    """Parse all object types (NUM, VBO, PND, OPR, WPL, LIG, STA) of a BAG extract.
 
-    # https://stackoverflow.com/questions/18159221/remove-namespace-and-prefix-from-xml-in-python-using-lxml
-    for elem in xml.getiterator():
-        elem.tag = etree.QName(elem).localname
-    etree.cleanup_namespaces(xml)
+    The nested zip files are streamed out of the extract and parsed in a pool of processes,
+    see `nl_open_data.bag.extract_bag`.
 
-    elements = [
-        remove_ns_keys(xmltodict.parse(etree.tostring(element)), root=NUM_TAG)
-        for element in xml.findall(NUM_XPATH)
-    ]
+    Args:
+        - bag_file: Path of the BAG extract zip file
+        - out_folder: Path of the folder to write a parquet dataset per object type into
+        - codes: list of object types to parse, all if None
 
-    # https://stackoverflow.com/questions/51300674/converting-json-into-newline-delimited-json-in-python
-    json_records = [json.dumps(element[NUM_TAG]) for element in elements]
-    ndjson = tmp_dir / (xml_file.split(".")[0] + ".ndjson")
-    with open(ndjson, "w") as file_:
-        file_.write("\n".join(json_records))
-    return ndjson
+    Returns:
+        - dict with the dataset folder and number of objects per object type
+    """
+    return nlb.extract_bag(bag_file, out_folder, codes=codes)
 
 
 load_file = BigQueryLoadFile(
@@ -109,8 +106,12 @@ with Flow("BAG NUM") as flow:
     # TODO: create dataset 'bag'
 
     xmls = create_xml_list(NUM_FILE)
-    ndjson = parse_num.map(xmls)
-    load_job = load_file.map(ndjson)
+    parquet = parse_num.map(xmls)
+    load_job = load_file.map(parquet, source_format=unmapped("PARQUET"))
+
+with Flow("BAG") as bag_flow:
+    codes = Parameter("codes", default=None)
+    datasets = parse_bag(BAG_FILE, BAG_TMP_DIR, codes=codes)
 
 if __name__ == "__main__":
     with Flow("test load file") as test_flow:
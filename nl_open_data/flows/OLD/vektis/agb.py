@@ -3,12 +3,14 @@ from pathlib import Path
 # TODO: use dataclass
 from bunch import Bunch
 import google.auth
-import pandas as pd
 import pandas_gbq
+import pyarrow as pa
 from prefect import task, Parameter, Flow
 from prefect.engine.executors import DaskExecutor
 
 from nl_open_data.config import get_config
+from nl_open_data.fwf import read_fwf
+from nl_open_data.periods import parse_dates
 
 config = get_config("dataverbinders")
 AGB_FOLDER = config.path.root / config.path.agb
@@ -136,15 +138,18 @@ AGB = Bunch(
 def parse_agb():
     dfs = Bunch()
     for k, v in AGB.items():
-        dfs[k] = pd.read_fwf(v.file, widths=v.widths)
-        dfs[k].columns = v.cols
-        if "date_cols" in v:
-            for date_col in v.date_cols:
-                dfs[k][date_col] = pd.to_datetime(
-                    dfs[k][date_col].astype(str).str.pad(8, fillchar="0"),
-                    format="%d%m%Y",
-                    errors="coerce",
-                )
+        date_cols = v.get("date_cols", [])
+        table = read_fwf(
+            v.file,
+            widths=v.widths,
+            names=v.cols,
+            header=0,
+            dtypes={col: pa.string() for col in date_cols},
+        )
+        for date_col in date_cols:
+            i = table.column_names.index(date_col)
+            table = table.set_column(i, date_col, parse_dates(table[date_col]))
+        dfs[k] = table.to_pandas()
     return dfs
 
 
@@ -0,0 +1,235 @@
+"""Builders of the zip and xls flows, with the paths of all files planned in a single task.
+
+The flows used to map a chain of one-line tasks over every url (`get_filename_from_url`,
+`add_folder_to_filename` or `create_path`, `replace_suffix`, and `clean_file_name` afterwards),
+each creating a task run per file whose scheduling and state handling take longer than its work.
+Here the folders and all paths are planned at once by `nl_open_data.tasks.plan_files`, so per file
+only the tasks doing real work (downloading, converting and uploading) are run.
+
+Running this module compares the task runs and wall time of planning the paths both ways:
+
+    python -m nl_open_data.flows.builders [n_files]
+"""
+from pathlib import Path
+import sys
+import time
+
+from prefect import Flow, Parameter, unmapped
+from prefect.triggers import all_finished, any_successful
+
+from nl_open_data.config import config
+import nl_open_data.tasks as nlt
+
+
+def build_zip_flow(name: str = "zipped_file") -> Flow:
+    """Builds a Prefect Flow downloading zipped folders containing csv files.
+
+    This flow takes a list of urls, and assumes each url points to a zip file. It further assumes
+    the zip file contains one or more csv files, in an arbitrarly deep folder.
+
+    The csv files are streamed out of the zip files and converted to parquet files in record batches,
+    without extracting the zip files to disk. The schema of each csv file is inferred once per run,
+    from a scan of the first zip file, and all zip files are cast to it. Fixed width txt files (i.e. metadata)
+    are converted to newline delimited json. The parquet files are uploaded to GCS, into a single specific folder.
+    In other words - this flow should be used to process multiple csv files all pertaining to a single dataset.
+
+    Flow parameters
+    ---------------
+    urls : str
+        The urls of the zipped files
+    csv_delimiter : str, default = ","
+        The delimiter used in the zipped csv files
+    csv_encoding : str, default="utf-8"
+        The encoding of the csv files
+    csv_block_size : int, default=None
+        Number of bytes of csv to convert per batch, bounding peak memory use. If None, pyarrow's default is used.
+    gcs_folder : str
+        The gcs_folder to upload the table into
+    gcp_env : str
+        Determines which GCP environment to use from config.gcp
+    prod_env : str
+        If gcp_env = "prod", determines which GCP environemnt to use from config.gcp.prod
+    manifest_blob : str, default=None
+        If given, the run is incremental: urls listed in this manifest blob (in the bucket of the GCP environment)
+        are skipped unless they changed (by ETag / Last-Modified, or checksum), and the urls fully processed in
+        this run are added to it afterwards.
+    partition : str, default=None
+        If given ('key=value', i.e. 'run_date=2021-06-04'), the parquet files are uploaded in a Hive partitioned
+        layout ('<gcs_folder>/<csv name>/<partition>/<zip name>.parquet'), so each csv file can be linked as a
+        single BQ table over all runs.
+    period_column : str, default=None
+        If given (i.e. 'Perioden'), CBS period codes in this column are decoded at conversion, into typed
+        `jaar`, `periode_start` and `periode_type` columns.
+    """
+    with Flow(name) as flow:
+        urls = Parameter("urls")
+        csv_delimiter = Parameter("csv_delimiter", default=",")
+        csv_encoding = Parameter("csv_encoding", default="utf-8")
+        csv_block_size = Parameter("csv_block_size", default=None)
+        gcs_folder = Parameter("gcs_folder")
+        gcp_env = Parameter("gcp_env", default="dev")
+        prod_env = Parameter("prod_env", default=None)
+        manifest_blob = Parameter("manifest_blob", default=None)
+        partition = Parameter("partition", default=None)
+        period_column = Parameter("period_column", default=None)
+
+        local_folder = nlt.create_temp_dir("zipped_csv_flow")
+
+        # In incremental runs, only process urls not processed in previous runs
+        manifest = nlt.load_manifest(
+            manifest_blob, config=config, gcp_env=gcp_env, prod_env=prod_env
+        )
+        new_urls = nlt.filter_new_urls(urls, manifest)
+        plan = nlt.plan_files(new_urls, local_folder)
+        upload_folder = plan["out_folder"]
+
+        downloads = nlt.download.map(new_urls, plan["download"])
+        # Drop files whose checksum matches the manifest (i.e. urls without ETag / Last-Modified)
+        zip_files = nlt.drop_unchanged_file.map(downloads, new_urls, unmapped(manifest))
+        # Infer the schemas once, from the first zip file (allowing some downloads to fail)
+        schemas = nlt.infer_csv_schemas(
+            zip_files,
+            delimiter=csv_delimiter,
+            encoding=csv_encoding,
+            block_size=csv_block_size,
+            task_args=dict(trigger=any_successful),
+        )
+        pq_files = nlt.zip_csv_to_parquet.map(
+            zip_files,
+            out_folder=unmapped(upload_folder),
+            delimiter=unmapped(csv_delimiter),
+            encoding=unmapped(csv_encoding),
+            block_size=unmapped(csv_block_size),
+            schemas=unmapped(schemas),
+            period_column=unmapped(period_column),
+        )
+
+        # Files identical to blobs from a previous run are not uploaded again
+        existing_hashes = nlt.list_blob_hashes(
+            gcs_folder, config=config, gcp_env=gcp_env, prod_env=prod_env
+        )
+        # Skipping the files of zips that failed to download or convert
+        gcs_ids = nlt.upload_to_gcs.map(
+            to_upload=nlt.flatten_files(pq_files),
+            local_parent=unmapped(upload_folder),
+            gcs_folder=unmapped(gcs_folder),
+            config=unmapped(config),
+            gcp_env=unmapped(gcp_env),
+            prod_env=unmapped(prod_env),
+            existing_hashes=unmapped(existing_hashes),
+            partition=unmapped(partition),
+        )
+        # Record the urls that were fully processed, even if some others failed
+        nlt.update_manifest(
+            manifest_blob,
+            manifest,
+            new_urls,
+            zip_files,
+            pq_files,
+            gcs_ids,
+            config=config,
+            gcp_env=gcp_env,
+            prod_env=prod_env,
+            task_args=dict(trigger=all_finished),
+        )
+        # Always clean up at end
+        nlt.remove_dir(
+            local_folder,
+            upstream_tasks=[gcs_ids],
+            task_args=dict(trigger=all_finished),
+        )
+
+    flow.set_reference_tasks([gcs_ids])
+    return flow
+
+
+def build_xls_flow(name: str = "xls_flow") -> Flow:
+    """Builds a Prefect Flow converting Excel (.xls) files to parquet and uploading them to GCS.
+
+    Every xls file is converted to a parquet file named after the cleaned name of the xls file,
+    see `nl_open_data.tasks.xls_to_parquet`.
+
+    Flow parameters
+    ---------------
+    urls : str
+        The urls of the xls files
+    gcs_folder : str
+        The gcs_folder to upload the parquet files into
+    gcp_env : str
+        Determines which GCP environment to use from config.gcp
+    prod_env : str
+        If gcp_env = "prod", determines which GCP environemnt to use from config.gcp.prod
+    column_types : dict, default=None
+        Arrow types of columns by name, instead of inferring them
+    """
+    with Flow(name) as flow:
+        urls = Parameter("urls")
+        gcs_folder = Parameter("gcs_folder")
+        gcp_env = Parameter("gcp_env", default="dev")
+        prod_env = Parameter("prod_env", default=None)
+        column_types = Parameter("column_types", default=None)
+
+        local_folder = nlt.create_temp_dir("xls_to_gcs_flow")
+        plan = nlt.plan_files(urls, local_folder, download_dir="xls")
+        xls_files = nlt.download.map(url=urls, filepath=plan["download"])
+        pq_files = nlt.xls_to_parquet.map(
+            file=xls_files,
+            out_file=plan["out_file"],
+            column_types=unmapped(column_types),
+        )
+        ## To GCS
+        # Files identical to blobs from a previous run are not uploaded again
+        existing_hashes = nlt.list_blob_hashes(
+            gcs_folder, config=config, gcp_env=gcp_env, prod_env=prod_env
+        )
+        gcs_ids = nlt.upload_to_gcs.map(
+            to_upload=pq_files,
+            local_parent=unmapped(plan["out_folder"]),
+            gcs_folder=unmapped(gcs_folder),
+            config=unmapped(config),
+            gcp_env=unmapped(gcp_env),
+            prod_env=unmapped(prod_env),
+            existing_hashes=unmapped(existing_hashes),
+        )
+
+    flow.set_reference_tasks([gcs_ids])
+    return flow
+
+
+def count_task_runs(state) -> int:
+    """Returns the number of task runs of a finished flow run, counting every mapped child."""
+    return sum(
+        len(task_state.map_states) if task_state.is_mapped() else 1
+        for task_state in state.result.values()
+    )
+
+
+def _benchmark(n_files: int = 1000) -> None:
+    """Compares planning the paths of `n_files` urls with mapped one-line tasks and with `plan_files`."""
+    urls = [f"https://www.cbs.nl/-/media/_excel/kwb-{i}.xls" for i in range(n_files)]
+
+    with Flow("mapped_paths") as mapped:
+        local_folder = nlt.create_temp_dir("paths_benchmark")
+        upload_folder = nlt.create_dir(local_folder / Path("upload_to_gcs"))
+        xls_folder = nlt.create_dir(local_folder / Path("xls"))
+        xls_filenames = nlt.get_filename_from_url.map(urls)
+        nlt.add_folder_to_filename.map(unmapped(xls_folder), xls_filenames)
+        pq_filenames = nlt.replace_suffix.map(xls_filenames, unmapped(".parquet"))
+        pq_filepaths = nlt.create_path.map(unmapped(upload_folder), pq_filenames)
+        nlt.remove_dir(local_folder, upstream_tasks=[pq_filepaths])
+
+    with Flow("planned_paths") as planned:
+        local_folder = nlt.create_temp_dir("paths_benchmark")
+        plan = nlt.plan_files(urls, local_folder, download_dir="xls")
+        paths = [plan["download"], plan["out_file"], plan["out_folder"]]
+        nlt.remove_dir(local_folder, upstream_tasks=paths)
+
+    for flow in (mapped, planned):
+        start = time.perf_counter()
+        state = flow.run()
+        seconds = time.perf_counter() - start
+        print(f"{flow.name}: {count_task_runs(state)} task runs in {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -1,4 +1,6 @@
 # Registers a flow that takes a single gcs folder, and creates a dataset, where each parquet file in the folder is a table.
+# With `append=True`, the tables are added to the existing dataset instead of recreating it (i.e. for incremental runs).
+# With `partitioned=True`, Hive partitioned folders (i.e. '<table>/run_date=2021-06-04/...') are linked as a single table each.
 from prefect import Flow, Parameter
 from prefect.run_configs import LocalRun
 from prefect.storage import GCS
@@ -14,6 +16,8 @@ with Flow("gcs_folder_to_bq_flow") as gcs_folder_to_bq_flow:
     gcp_env = Parameter("gcp_env", default="dev")
     prod_env = Parameter("prod_env", default=None)
     description = Parameter("description", default="")
+    append = Parameter("append", default=False)
+    partitioned = Parameter("partitioned", default=False)
 
     nlt.gcs_folder_to_bq(
         gcs_folder=gcs_folder,
@@ -22,6 +26,8 @@ with Flow("gcs_folder_to_bq_flow") as gcs_folder_to_bq_flow:
         source=source,
         gcp_env=gcp_env,
         prod_env=prod_env,
+        append=append,
+        partitioned=partitioned,
         description=description,
     )
 
@@ -15,7 +15,7 @@ from prefect.triggers import all_finished
 from statline_bq.statline import _check_v4, _get_urls, get_metadata_cbs
 from statline_bq.gcpl import _set_gcp, _get_metadata_gcp
 from statline_bq.utils import _check_gcp_env, _create_named_dir
-from statline_bq.main import main, _skip_dataset
+from statline_bq.main import main
 
 from nl_open_data.config import config as CONFIG
 from nl_open_data.tasks import remove_dir
@@ -28,7 +28,6 @@ set_gcp = task(_set_gcp)
 get_urls = task(_get_urls)
 get_metadata_cbs = task(get_metadata_cbs)
 get_metadata_gcp = task(_get_metadata_gcp)
-skip_dataset = task(_skip_dataset)
 create_named_dir = task(_create_named_dir)
 main = task(main)
 
@@ -73,6 +72,9 @@ with Flow("statline-bq") as statline_flow:
 
     force : bool, default = False
         If set to True, processes datasets, even if Modified dates are identical in source and target locations.
+        Otherwise, datasets whose Modified date in the CBS catalog did not change since they were last mirrored
+        are skipped, found in a single pass over the catalogs (see `nl_open_data.catalog`). Datasets not yet in
+        the snapshot of mirrored datasets are checked against their metadata in GCP by `main`.
     
     credentials: Credentials, default=None
         Google oauth2 credentials, passed to google-cloud clients. If not passed,
@@ -93,31 +95,34 @@ with Flow("statline-bq") as statline_flow:
     credentials = Parameter("credentials", default=None)
 
     gcp_env = nlt.lower(gcp_env)
-    odata_versions = check_v4.map(ids)
-    gcp = set_gcp(config, gcp_env, source)
-    skips = skip_dataset.map(
-        id=ids,
-        source=unmapped(source),
-        third_party=unmapped(third_party),
-        odata_version=odata_versions,
-        gcp=unmapped(gcp),
-        force=unmapped(force),
-        credentials=unmapped(credentials),
+    # Diff the catalog against the last mirrored versions once, instead of checking every id
+    changes = nlt.detect_changed_datasets(
+        ids, source, config, third_party=third_party, gcp_env=gcp_env, force=force
     )
-    go_nogo = nlt.skip_task.map(x=skips)
+    changed_ids = changes["ids"]
+    odata_versions = check_v4.map(changed_ids)
     pq_files = main.map(
-        id=ids,
+        id=changed_ids,
         source=unmapped(source),
         third_party=unmapped(third_party),
         config=unmapped(config),
         gcp_env=unmapped(gcp_env),
-        force=unmapped(force),
+        # Known changes are forced, others are checked against GCP by `main`
+        force=changes["force"],
         credentials=unmapped(credentials),
-        upstream_tasks=[go_nogo],
+    )
+    # Record the mirrored datasets, even if some others failed
+    nlt.update_catalog_snapshot(
+        changes,
+        pq_files,
+        source,
+        config,
+        gcp_env=gcp_env,
+        task_args=dict(trigger=all_finished),
     )
     # This returns the directories used in main, possibly recreating them if they were properly deleted in main
     local_folders = create_named_dir.map(
-        id=ids,
+        id=changed_ids,
         odata_version=odata_versions,
         source=unmapped(source),
         config=unmapped(config),
@@ -7,11 +7,12 @@ TODO: Docstring
 from nl_open_data.config import config
 
 from prefect import task, Flow, unmapped, Parameter
+from prefect.triggers import all_finished
 from prefect.run_configs import LocalRun
 from prefect.storage import GCS
-from prefect.executors import DaskExecutor
 
 import nl_open_data.tasks as nlt
+from nl_open_data.executors import dask_executor
 
 with Flow("statline-catalogs") as st_catalogs_flow:
     catalog_urls = Parameter("catalog_urls")
@@ -19,15 +20,21 @@ with Flow("statline-catalogs") as st_catalogs_flow:
     gcp_env = Parameter("gcp_env", default="dev")
     prod_env = Parameter("prod_env", default=None)
 
-    catalogs = nlt.get_from_cbs_url.map(url=catalog_urls, get_value_only=unmapped(True))
+    # Fetched concurrently and page by page, as Arrow tables
+    catalogs = nlt.fetch_catalogs(catalog_urls, catalog_names)
+    # Keep the local catalog index (used by the run_* scripts) in sync with BQ
+    nlt.refresh_catalog_index(catalogs, catalog_names)
+    # A folder of this run, so concurrent runs do not overwrite each other's files
+    local_folder = nlt.create_temp_dir("statline_catalogs")
     catalog_files = nlt.struct_to_parquet.map(  # TODO - verify that the order remains intact
-        struct=catalogs, file_name=catalog_names
+        struct=catalogs, file_name=catalog_names, folder=unmapped(local_folder)
     )
     # catalog_files = struct_to_parquet.map(  # TODO - verify that the order remains intact
     #     struct=catalogs, folder_name=unmapped("catalogs"), file_name=catalog_names
     # )
     gcs_ids = nlt.upload_to_gcs.map(
         to_upload=catalog_files,
+        local_parent=unmapped(local_folder),
         gcs_folder=unmapped("_catalogs"),
         config=unmapped(config),
         gcp_env=unmapped(gcp_env),
@@ -41,6 +48,9 @@ with Flow("statline-catalogs") as st_catalogs_flow:
         prod_env=unmapped(prod_env),
         upstream_tasks=[gcs_ids],
     )
+    nlt.remove_dir(
+        local_folder, upstream_tasks=[gcs_ids], task_args=dict(trigger=all_finished)
+    )
 
 if __name__ == "__main__":
     # Register flow
@@ -50,13 +60,7 @@ if __name__ == "__main__":
     )
     # st_catalogs_flow.run_config = LocalRun(labels=["nl-open-data-preemptible-1"])
     st_catalogs_flow.run_config = LocalRun(labels=["nl-open-data-vm-1"])
-    st_catalogs_flow.executor = DaskExecutor(
-        # cluster_class="LocalCluster",
-        cluster_kwargs={"n_workers": 8},
-        # debug=True,
-        # processes=True,
-        # silence_logs=100, # TODO (?) : find out what the number stands for
-    )
+    st_catalogs_flow.executor = dask_executor(config.executor)
     flow_id = st_catalogs_flow.register(
         project_name="nl_open_data", version_group_id="statline_catalogs"
     )
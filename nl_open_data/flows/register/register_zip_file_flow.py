@@ -1,116 +1,20 @@
 """Registering a Prefect Flow downloading a zipped folder containing csv files.
 """
 # the config object must be imported from config.py before any Prefect imports
-from pathlib import Path
+from nl_open_data.config import config
 
-from prefect import Flow, unmapped, Parameter, flatten, case, apply_map
-from prefect.tasks.shell import ShellTask
-from prefect.triggers import all_finished
 from prefect.run_configs import LocalRun
 from prefect.storage import GCS
-from prefect.executors import DaskExecutor
-from prefect.utilities.tasks import task
 
-from nl_open_data.config import config
-import nl_open_data.tasks as nlt
+from nl_open_data.executors import dask_executor
+from nl_open_data.flows.builders import build_zip_flow
 
 # Prefect flow parameters
 PROJECT_NAME = "nl_open_data"
 VERSION_GROUP_ID = "zipped_csv"
 
-curl_download = ShellTask(name="curl_download")
-
-# Allow skipping unzip (if folder already locally unzipped)
-nlt.unzip.skip_on_upstream_skip = False
-# Always clean up at end
-nlt.remove_dir.trigger = all_finished
-
-
-with Flow("zipped_file") as zip_flow:
-    """a Prefect Flow downloading a zipped folder containing csv files.
-    
-    This flow takes a list of urls, and assumes each url points to a zip file. It further assumes
-    the zip file contains one or more csv files, in an arbitrarly deep folder.
-
-    The csv files are converted to parquet files, and uploaded to GCS, into a single specific folder.
-    In other words - this flow should be used to process multiple csv files all pertaining to a single dataset.
-
-    Parameters
-    ----------
-    urls : str
-        The urls of the zipped files
-    csv_delimiter : str, default = ","
-        The delimiter used in the zipped csv files
-    csv_encoding : str, default="utf-8"
-        The encoding of the csv files
-    gcs_folder : str
-        The gcs_folder to upload the table into
-    gcp_env : str
-        Determines which GCP environment to use from config.gcp
-    prod_env : str
-        If gcp_env = "prod", determines which GCP environemnt to use from config.gcp.prod
-    """
-
-    urls = Parameter("urls")
-    csv_delimiter = Parameter("csv_delimiter", default=",")
-    csv_encoding = Parameter("csv_encoding", default="utf-8")
-    gcs_folder = Parameter("gcs_folder")
-    gcp_env = Parameter("gcp_env", default="dev")
-    prod_env = Parameter("prod_env", default=None)
-
-    # For local testing
-    # local_folder = nlt.create_dir(Path("." / Path("zipped_csv_flow")))
-    local_folder = nlt.create_temp_dir("zipped_csv_flow")
-    zip_filenames = nlt.get_filename_from_url.map(urls)
-
-    download_folder = nlt.create_dir(local_folder / Path("download"))
-
-    unzip_folder = nlt.create_dir(local_folder / Path("unzipped"))
-    unzip_folder_names = nlt.stem_wrap.map(zip_filenames)
-    unzip_folder_paths = nlt.create_path.map(unmapped(unzip_folder), unzip_folder_names)
-    unzip_folders = nlt.create_dir.map(unzip_folder_paths)
-
-    upload_folder = nlt.create_dir(local_folder / Path("upload_to_gcs"))
-
-    zip_filepaths = nlt.create_path.map(unmapped(download_folder), zip_filenames)
-    curl_commands = nlt.curl_cmd.map(urls, zip_filepaths, limit_retries=unmapped(False))
-    curl_downloads = curl_download.map(
-        command=curl_commands, upstream_tasks=[unmapped(download_folder)]
-    )
-    unzipped_folders = nlt.unzip.map(
-        zip_filepaths, out_folder=unzip_folders, upstream_tasks=[curl_downloads],
-    )
-    files = nlt.list_dir.map(folder=unzipped_folders)
-    same_files = nlt.same_path(
-        flatten(files)
-    )  # flatten does not play nice with apply_map
-    rel_paths = nlt.relative_to_wrap.map(same_files, unmapped(unzip_folder))
-    out_filepaths = nlt.create_path.map(unmapped(upload_folder), rel_paths)
-
-    pq_files = apply_map(
-        nlt.convert_files_switch,
-        same_files,
-        out_filepaths,
-        delimiter=unmapped(csv_delimiter),
-        encoding=unmapped(csv_encoding),
-    )
-
-    clean_upload_folder = nlt.clean_folder_names(
-        upload_folder, upstream_tasks=[pq_files]
-    )
-    clean_files = nlt.list_dir(folder=clean_upload_folder)
-
-    gcs_ids = nlt.upload_to_gcs.map(
-        to_upload=clean_files,
-        local_parent=unmapped(upload_folder),
-        gcs_folder=unmapped(gcs_folder),
-        config=unmapped(config),
-        gcp_env=unmapped(gcp_env),
-        prod_env=unmapped(prod_env),
-    )
-    nlt.remove_dir(local_folder, upstream_tasks=[gcs_ids])
-
-zip_flow.set_reference_tasks([gcs_ids])
+# The flow is described in `nl_open_data.flows.builders.build_zip_flow`
+zip_flow = build_zip_flow("zipped_file")
 
 if __name__ == "__main__":
     # from datetime import datetime
@@ -122,7 +26,7 @@ if __name__ == "__main__":
     )
     # zip_flow.run_config = LocalRun(labels=["nl-open-data-preemptible-1"])
     zip_flow.run_config = LocalRun(labels=["nl-open-data-vm-1"])
-    zip_flow.executor = DaskExecutor(cluster_kwargs={"n_workers": 8},)
+    zip_flow.executor = dask_executor(config.executor)
     flow_id = zip_flow.register(
         project_name=PROJECT_NAME, version_group_id=VERSION_GROUP_ID
     )
@@ -0,0 +1,102 @@
+"""Registering a Prefect Flow downloading, converting and uploading zipped csv files as a per-file pipeline.
+"""
+# the config object must be imported from config.py before any Prefect imports
+from prefect import Flow, Parameter
+from prefect.triggers import all_finished
+from prefect.run_configs import LocalRun
+from prefect.storage import GCS
+
+from nl_open_data.config import config
+import nl_open_data.tasks as nlt
+
+# Prefect flow parameters
+PROJECT_NAME = "nl_open_data"
+VERSION_GROUP_ID = "zipped_csv_pipeline"
+
+# Always clean up at end
+nlt.remove_dir.trigger = all_finished
+
+
+with Flow("zipped_file_pipeline") as zip_pipeline_flow:
+    """a Prefect Flow downloading, converting and uploading zipped csv files, one file at a time.
+
+    Processes the same zip files as the "zipped_file" flow (see register_zip_file_flow.py), but instead
+    of mapping every stage over all files (downloading all files, then converting all of them, then
+    uploading all of them), every file moves through the download, convert and upload stages on its own,
+    through bounded queues (see `nl_open_data.tasks.zip_pipeline`). Downloads, conversions and uploads of
+    different files thus overlap. Incremental runs (`manifest_blob`) are only supported by the "zipped_file"
+    flow.
+
+    Parameters
+    ----------
+    urls : str
+        The urls of the zipped files
+    csv_delimiter : str, default = ","
+        The delimiter used in the zipped csv files
+    csv_encoding : str, default="utf-8"
+        The encoding of the csv files
+    csv_block_size : int, default=None
+        Number of bytes of csv to convert per batch, bounding peak memory use. If None, pyarrow's default is used.
+    gcs_folder : str
+        The gcs_folder to upload the table into
+    gcp_env : str
+        Determines which GCP environment to use from config.gcp
+    prod_env : str
+        If gcp_env = "prod", determines which GCP environemnt to use from config.gcp.prod
+    partition : str, default=None
+        If given ('key=value', i.e. 'run_date=2021-06-04'), the parquet files are uploaded in a Hive partitioned
+        layout, see the "zipped_file" flow.
+    period_column : str, default=None
+        If given (i.e. 'Perioden'), CBS period codes in this column are decoded at conversion.
+    download_threads : int, default=4
+        Number of concurrent downloads
+    convert_threads : int, default=None
+        Number of concurrent conversions. If None, the number of cores.
+    upload_threads : int, default=8
+        Number of concurrent uploads
+    """
+
+    urls = Parameter("urls")
+    csv_delimiter = Parameter("csv_delimiter", default=",")
+    csv_encoding = Parameter("csv_encoding", default="utf-8")
+    csv_block_size = Parameter("csv_block_size", default=None)
+    gcs_folder = Parameter("gcs_folder")
+    gcp_env = Parameter("gcp_env", default="dev")
+    prod_env = Parameter("prod_env", default=None)
+    partition = Parameter("partition", default=None)
+    period_column = Parameter("period_column", default=None)
+    download_threads = Parameter("download_threads", default=4)
+    convert_threads = Parameter("convert_threads", default=None)
+    upload_threads = Parameter("upload_threads", default=8)
+
+    local_folder = nlt.create_temp_dir("zipped_csv_pipeline_flow")
+    gcs_ids = nlt.zip_pipeline(
+        urls,
+        local_folder,
+        gcs_folder,
+        config=config,
+        gcp_env=gcp_env,
+        prod_env=prod_env,
+        delimiter=csv_delimiter,
+        encoding=csv_encoding,
+        block_size=csv_block_size,
+        period_column=period_column,
+        partition=partition,
+        download_threads=download_threads,
+        convert_threads=convert_threads,
+        upload_threads=upload_threads,
+    )
+    nlt.remove_dir(local_folder, upstream_tasks=[gcs_ids])
+
+zip_pipeline_flow.set_reference_tasks([gcs_ids])
+
+if __name__ == "__main__":
+    # Register flow
+    zip_pipeline_flow.storage = GCS(
+        project="dataverbinders-dev",
+        bucket="dataverbinders-dev-prefect",  # TODO: Switch to using config (config.gcp.dev.project_id, etc.)
+    )
+    zip_pipeline_flow.run_config = LocalRun(labels=["nl-open-data-vm-1"])
+    flow_id = zip_pipeline_flow.register(
+        project_name=PROJECT_NAME, version_group_id=VERSION_GROUP_ID
+    )
@@ -21,13 +21,14 @@ THIRD_PARTY = True
 GCP_ENV = "prod"
 FORCE = False
 CONFIG = config
-ODATA_MLZ = query_cbs_catalogs(third_party=THIRD_PARTY, source=SOURCE)[SOURCE]
 
 # run parameters
 VERSION_GROUP_ID = "statline_bq"
 RUN_NAME = f"{SOURCE}_{datetime.today().date()}_{datetime.today().time()}"
 
 if __name__ == "__main__":
+    # Read from the local catalog index, see `nl_open_data.catalog`
+    ODATA_MLZ = query_cbs_catalogs(third_party=THIRD_PARTY, source=SOURCE)[SOURCE]
     prefect_client = PrefectClient()  # Local api key has been stored previously
     prefect_client.login_to_tenant(tenant_slug=TENANT_SLUG)  # For user-scoped API token
     parameters = {
@@ -21,21 +21,23 @@ THIRD_PARTY = True
 GCP_ENV = "prod"
 FORCE = False
 CONFIG = config
-ODATA_RIVM = query_cbs_catalogs(third_party=THIRD_PARTY, source=SOURCE)[SOURCE]
 
 # run parameters
 VERSION_GROUP_ID = "statline_bq"
 RUN_NAME = f"{SOURCE}_{datetime.today().date()}_{datetime.today().time()}"
 
-client = Client()  # Local api key has been stored previously
-client.login_to_tenant(tenant_slug=TENANT_SLUG)  # For user-scoped API token
-parameters = {
-    "ids": ODATA_RIVM,
-    "source": SOURCE,
-    "third_party": THIRD_PARTY,
-    "gcp_env": GCP_ENV,
-    "force": FORCE,
-}
-flow_run_id = client.create_flow_run(
-    version_group_id=VERSION_GROUP_ID, run_name=RUN_NAME, parameters=parameters
-)
+if __name__ == "__main__":
+    # Read from the local catalog index, see `nl_open_data.catalog`
+    ODATA_RIVM = query_cbs_catalogs(third_party=THIRD_PARTY, source=SOURCE)[SOURCE]
+    client = Client()  # Local api key has been stored previously
+    client.login_to_tenant(tenant_slug=TENANT_SLUG)  # For user-scoped API token
+    parameters = {
+        "ids": ODATA_RIVM,
+        "source": SOURCE,
+        "third_party": THIRD_PARTY,
+        "gcp_env": GCP_ENV,
+        "force": FORCE,
+    }
+    flow_run_id = client.create_flow_run(
+        version_group_id=VERSION_GROUP_ID, run_name=RUN_NAME, parameters=parameters
+    )
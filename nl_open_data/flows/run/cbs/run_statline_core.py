@@ -4,44 +4,74 @@ from datetime import datetime
 
 from prefect import Client as PrefectClient
 
-from nl_open_data.utils import query_cbs_catalogs
+import nl_open_data.batches as nlb
+from nl_open_data.utils import query_cbs_catalog_sizes
 
-# Schedules multiple flow-runs (10 datasets per flow_run) on prefect cloud to upload the entire CBS core statline repository
+# Schedules multiple flow-runs on prefect cloud to upload the entire CBS core statline repository.
+# The datasets are spread over batches of about equal expected work, and at most MAX_CONCURRENT
+# flow-runs run at a time, see `nl_open_data.batches`.
 # TODO: Currently only v3, add v4
 
 # Prefect client parameters
 TENANT_SLUG = "dataverbinders"
 
-prefect_client = PrefectClient()  # Local api key has been stored previously
-prefect_client.login_to_tenant(tenant_slug=TENANT_SLUG)  # For user-scoped API token
-
 # flow parameters
 SOURCE = "cbs"
 THIRD_PARTY = False
 GCP_ENV = "prod"
 FORCE = False
 CONFIG = config
-ODATA_CBS = query_cbs_catalogs(third_party=THIRD_PARTY, source=SOURCE)[SOURCE]
-
-mirror_time = f"{datetime.today().date()}_{datetime.today().time()}"
-
-## Schedule flow-runs
-for i in range(len(ODATA_CBS) // 10 + 1):
-    # for i in range(5):
-    # run parameters
-    VERSION_GROUP_ID = "statline_bq"
-    CBS_V3_RUN_NAME = f"cbs_v3_batch_{i}_{mirror_time}"
-
-    cbs_v3_parameters = {
-        "ids": ODATA_CBS[(10 * i) : (10 * i + 10)],
-        "source": SOURCE,
-        "third_party": THIRD_PARTY,
-        "gcp_env": GCP_ENV,
-        "force": FORCE,
+
+# batch parameters
+TARGET_SECONDS = nlb.TARGET_SECONDS
+MAX_CONCURRENT = nlb.MAX_CONCURRENT
+VERSION_GROUP_ID = "statline_bq"
+
+
+if __name__ == "__main__":
+    prefect_client = PrefectClient()  # Local api key has been stored previously
+    prefect_client.login_to_tenant(tenant_slug=TENANT_SLUG)  # For user-scoped API token
+
+    sizes = query_cbs_catalog_sizes(third_party=THIRD_PARTY, source=SOURCE)
+    history = nlb.DurationHistory()
+    estimates = {
+        id_: nlb.estimate_seconds(records, columns, history.get(id_))
+        for id_, (records, columns) in sizes.items()
     }
+    batches = nlb.plan_batches(estimates, target_seconds=TARGET_SECONDS)
+    print(
+        f"{len(estimates)} datasets in {len(batches)} batches, "
+        f"{sum(estimates.values()) / 3600:.1f} hours of expected work"
+    )
+
+    mirror_time = f"{datetime.today().date()}_{datetime.today().time()}"
+
+    def submit(i: int, ids: list) -> str:
+        cbs_v3_parameters = {
+            "ids": ids,
+            "source": SOURCE,
+            "third_party": THIRD_PARTY,
+            "gcp_env": GCP_ENV,
+            "force": FORCE,
+        }
+        return prefect_client.create_flow_run(
+            version_group_id=VERSION_GROUP_ID,
+            parameters=cbs_v3_parameters,
+            run_name=f"cbs_v3_batch_{i}_{mirror_time}",
+        )
+
+    def is_finished(flow_run_id: str) -> bool:
+        return prefect_client.get_flow_run_info(flow_run_id).state.is_finished()
+
+    def on_finished(ids: list, seconds: float) -> None:
+        history.record_batch(ids, seconds, estimates)
+        history.save()
 
-    flow_run_id = prefect_client.create_flow_run(
-        version_group_id=VERSION_GROUP_ID,
-        parameters=cbs_v3_parameters,
-        run_name=CBS_V3_RUN_NAME,
+    ## Schedule flow-runs
+    nlb.submit_batches(
+        batches,
+        submit,
+        is_finished,
+        max_concurrent=MAX_CONCURRENT,
+        on_finished=on_finished,
     )
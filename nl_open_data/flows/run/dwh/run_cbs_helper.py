@@ -46,24 +46,10 @@ KWB_URLS = [
     "https://www.cbs.nl/-/media/cbs/dossiers/nederland-regionaal/wijk-en-buurtstatistieken/_exel/kwb-2016.xls",
     "https://www.cbs.nl/-/media/cbs/dossiers/nederland-regionaal/wijk-en-buurtstatistieken/_exel/kwb-2017.xls",
     "https://www.cbs.nl/-/media/_excel/2021/12/kwb-2018.xls",
-    # "https://www.cbs.nl/-/media/_excel/2021/12/kwb-2019.xls",  # BUG: Unexpected error: ArrowInvalid('Could not convert 5,0 with type str: tried to convert to double', 'Conversion failed for column p_stadsv with type object')
-    # This issue stems from the mixed data types in Excel (NUMBER and TEXT).
-    # The column is translated as a dtype=object, and then crashes when trying to convert to parquet.
-    # This issue is related: https://issues.apache.org/jira/browse/ARROW-4131
-    # No trivial solution (skip_columns does not exist in read_excel, trying str.replace(".", ",") also fails
+    "https://www.cbs.nl/-/media/_excel/2021/12/kwb-2019.xls",
     "https://www.cbs.nl/-/media/_excel/2021/12/kwb-2020.xls",
 ]
 KWB_GCS_FOLDER = "cbs/kwb"
-KWB_KWARGS = [
-    {"na_values": [".", "        .", "        .       "]},  # 2013
-    {"na_values": [".", "        .", "        .       "]},  # 2014
-    {"na_values": [".", "        .", "        .       "]},  # 2015
-    {"na_values": [".", "        .", "        .       "]},  # 2016
-    {"na_values": [".", "        .", "        .       "]},  # 2017
-    {"na_values": [".", "        .", "        .       "]},  # 2018
-    # {"na_values": [".", "        .", "        .       "]},  # 2019 # BUG: (See above)
-    {"na_values": [".", "        .", "        .       "]},  # 2020
-]
 
 # run parameters
 VERSION_GROUP_ID = "xls_to_gcs"
@@ -71,7 +57,6 @@ RUN_NAME = f"cbs_helper_kwb_{RUN_TIME}"
 PARAMETERS = {
     "urls": KWB_URLS,
     "gcs_folder": KWB_GCS_FOLDER,
-    "read_excel_kwargs": KWB_KWARGS,
 }
 
 # Schedule run
@@ -110,19 +95,6 @@ NBH_URLS = [
 ]
 NBH_GCS_FOLDER = "cbs/nbh"
 GCP_ENV = "dev"
-KWARGS = [
-    {"na_values": [".", "        .", "        .       "]},  # 2006
-    {"na_values": [".", "        .", "        .       "]},  # 2007
-    {"na_values": [".", "        .", "        .       "]},  # 2008
-    {"na_values": [".", "        .", "        .       "]},  # 2009
-    {"na_values": [".", "        .", "        .       "]},  # 2010
-    {"na_values": [".", "        .", "        .       "]},  # 2011
-    {"na_values": [".", "        .", "        .       "]},  # 2012
-    {"na_values": [".", "        .", "        .       "]},  # 2013
-    {"na_values": [".", "        .", "        .       "]},  # 2014
-    {"skiprows": [1, 2], "na_values": [".", "        .", "        .       "]},  # 2015
-    {"skiprows": [1, 2], "na_values": [".", "        .", "        .       "]},  # 2016
-]
 
 # run parameters
 VERSION_GROUP_ID = "xls_to_gcs"
@@ -132,7 +104,6 @@ PARAMETERS = {
     "gcs_folder": NBH_GCS_FOLDER,
     "gcp_env": GCP_ENV,
     "PROD_ENV": PROD_ENV,
-    "read_excel_kwargs": KWARGS,
 }
 
 # Schedule run
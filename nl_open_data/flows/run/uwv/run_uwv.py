@@ -9,17 +9,25 @@ from nl_open_data.config import config as CONFIG
 from nl_open_data.utils import get_gcs_uris
 from nl_open_data.ckan import get_datasets
 
-# By Default use prod GCP env parameters
+# By Default use prod GCP env parameters, and reprocess the full history
 GCP_ENV = "prod"
 PROD_ENV = "external"
-# If dev
+INCREMENTAL = False
+PARTITIONED = False
+# If dev, incremental and/or partitioned
 print(sys.argv)
-if len(sys.argv) != 1:
-    if sys.argv[1] == "--dev":
-        GCP_ENV = sys.argv[1]
+for arg in sys.argv[1:]:
+    if arg == "--dev":
+        GCP_ENV = "dev"
         PROD_ENV = None
+    elif arg == "--incremental":
+        INCREMENTAL = True
+    elif arg == "--partitioned":
+        PARTITIONED = True
     else:
-        raise ValueError("Only '--dev' can be provided as an argument")
+        raise ValueError(
+            "Only '--dev', '--incremental' and '--partitioned' can be provided as arguments"
+        )
 
 # General script parameters
 SOURCE = "uwv"
@@ -42,7 +50,20 @@ UWV_OPEN_MATCH_URLS = [
 CSV_DELIMITER = ";"
 CSV_ENCODING = "8859"
 DATASET_NAME = "open_match_data"
-GCS_FOLDER = SOURCE + "/" + DATASET_NAME + "/" + datetime.today().strftime("%Y%m%d")
+# Partitioned runs upload into a single folder for all runs, with a 'run_date' partition per run, which
+# is linked as one table per csv file (with a DATE column 'run_date') instead of one table per file.
+if PARTITIONED:
+    GCS_FOLDER = SOURCE + "/" + DATASET_NAME
+    PARTITION = f"run_date={datetime.today().date().isoformat()}"
+else:
+    GCS_FOLDER = (
+        SOURCE + "/" + DATASET_NAME + "/" + datetime.today().strftime("%Y%m%d")
+    )
+    PARTITION = None
+# Incremental runs only process zip files that are new or changed since they were added to this manifest,
+# and add them to it afterwards. Their files are uploaded to the folder of the run, and appended to the
+# existing BQ dataset as tables named '<zip name>_<csv name>' (or added as partitions, with --partitioned).
+MANIFEST_BLOB = f"_manifests/{SOURCE}/{DATASET_NAME}.json" if INCREMENTAL else None
 
 # run parameters
 ZIP_VERSION_GROUP_ID = "zipped_file"
@@ -57,6 +78,8 @@ zip_parameters = {
     "gcs_folder": GCS_FOLDER,
     "gcp_env": GCP_ENV,
     "prod_env": PROD_ENV,
+    "manifest_blob": MANIFEST_BLOB,
+    "partition": PARTITION,
 }
 
 zip_flow = StartFlowRun(
@@ -98,6 +121,8 @@ PARAMETERS = {
     "gcp_env": GCP_ENV,
     "prod_env": PROD_ENV,
     "description": BQ_DATASET_DESCRIPTION,
+    "append": INCREMENTAL,
+    "partitioned": PARTITIONED,
 }
 
 # Schedule run
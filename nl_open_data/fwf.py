@@ -0,0 +1,289 @@
+"""Vectorized parsing of fixed-width files into Arrow tables.
+
+`pd.read_fwf` parses fixed-width files line by line in Python, which is slow on large registers
+such as the Vektis AGB files. Here the file is memory-mapped as a NumPy byte array instead, and
+every column is sliced from all records at once, stripped of padding and turned into an Arrow
+array, without handling individual values in Python. When all records have the same length, the
+file is a (records x bytes) matrix and columns are plain slices of it.
+
+Columns are given as `widths` or `colspecs`, as in `pd.read_fwf`, or are inferred from the first
+lines of the file. Run this module to compare its speed to `pd.read_fwf`:
+
+    python -m nl_open_data.fwf [n_records]
+"""
+from typing import Union, Sequence, Mapping, BinaryIO, List, Tuple
+from pathlib import Path
+from functools import lru_cache
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+NEWLINE, CARRIAGE_RETURN, TAB, SPACE = 10, 13, 9, 32
+INFER_ROWS = 100  # Number of lines used to infer colspecs, as in `pd.read_fwf`
+BATCH_SIZE = 1_000_000  # Number of records sliced at once, to bound memory use
+
+
+def _read_bytes(source: Union[str, Path, BinaryIO]) -> np.ndarray:
+    if hasattr(source, "read"):
+        return np.frombuffer(source.read(), dtype=np.uint8)
+    if Path(source).stat().st_size == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(source, dtype=np.uint8, mode="r")
+
+
+def _line_bounds(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the start and end offsets of all non-empty lines, excluding line endings."""
+    ends = np.flatnonzero(data == NEWLINE)
+    if len(data) and data[-1] != NEWLINE:
+        ends = np.append(ends, len(data))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)[: len(ends)]
+    # Strip '\r' of Windows line endings
+    crlf = (ends > starts) & (data[np.maximum(ends - 1, 0)] == CARRIAGE_RETURN)
+    ends = ends - crlf
+    non_empty = ends > starts
+    return starts[non_empty], ends[non_empty]
+
+
+def _columns_matrix(
+    data: np.ndarray, starts: np.ndarray, ends: np.ndarray, start: int, end: int
+) -> np.ndarray:
+    """Returns the bytes [start, end) of every line as a contiguous matrix, padded with spaces."""
+    lengths = ends - starts
+    stride = starts[1] - starts[0] if len(starts) > 1 else 0
+    if (
+        len(starts) > 1
+        and np.all(lengths == lengths[0])
+        and np.all(np.diff(starts) == stride)
+        and end <= lengths[0]
+        # The last record needs its line ending as well (i.e. not at the end of the file)
+        and starts[-1] + stride <= len(data)
+    ):
+        # Fixed-length records: slice the column from a (records x bytes) view on the memory map
+        records = data[starts[0] : starts[-1] + stride].reshape(len(starts), stride)
+        return np.ascontiguousarray(records[:, start:end])
+    positions = starts[:, None] + np.arange(start, end)
+    inside = positions < ends[:, None]
+    if not len(data):
+        return np.full(positions.shape, SPACE, dtype=np.uint8)
+    values = data[np.minimum(positions, len(data) - 1)]
+    return np.where(inside, values, SPACE).astype(np.uint8)
+
+
+def infer_colspecs(
+    data: np.ndarray, starts: np.ndarray, ends: np.ndarray, n_rows: int = INFER_ROWS
+) -> List[Tuple[int, int]]:
+    """Infers column positions from the first lines, as runs of positions that are not always blank.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The bytes of the file
+    starts, ends : np.ndarray
+        Offsets of the lines in `data`
+    n_rows : int, default=100
+        Number of lines to infer the columns from
+
+    Returns
+    -------
+    list
+        (start, end) tuples, as `colspecs` in `pd.read_fwf`
+    """
+    starts, ends = starts[:n_rows], ends[:n_rows]
+    if not len(starts):
+        return []
+    matrix = _columns_matrix(data, starts, ends, 0, int((ends - starts).max()))
+    filled = ((matrix != SPACE) & (matrix != TAB)).any(axis=0)
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], filled, [False]])))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+@lru_cache()
+def _utf8_table(encoding: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns a lookup table from the bytes of a single-byte encoding to UTF-8 bytes, and their lengths."""
+    characters = bytes(range(256)).decode(encoding, errors="replace")
+    if len(characters) != 256:
+        raise ValueError(
+            f"Encoding {encoding} is not supported: only UTF-8 and single-byte encodings are"
+        )
+    table = np.zeros((256, 4), dtype=np.uint8)
+    lengths = np.zeros(256, dtype=np.int64)
+    for i, character in enumerate(characters):
+        encoded = character.encode("utf-8")
+        table[i, : len(encoded)] = list(encoded)
+        lengths[i] = len(encoded)
+    return table, lengths
+
+
+def _is_utf8(encoding: str) -> bool:
+    return encoding.lower().replace("_", "-") in ("utf-8", "utf8", "ascii")
+
+
+def _string_array(matrix: np.ndarray, encoding: str = "utf-8") -> pa.Array:
+    """Converts a (records x bytes) matrix to a string array, stripped, with blanks as nulls."""
+    n, width = matrix.shape
+    filled = (matrix != SPACE) & (matrix != TAB)
+    valid = filled.any(axis=1)
+    first = filled.argmax(axis=1)
+    last = width - filled[:, ::-1].argmax(axis=1)
+    positions = np.arange(width)
+    keep = (positions >= first[:, None]) & (positions < last[:, None]) & valid[:, None]
+    lengths = np.where(valid, last - first, 0)
+    data = matrix[keep]  # Row-major, so the stripped values of all records concatenated
+
+    if len(data) and not _is_utf8(encoding) and data.max() >= 0x80:
+        table, byte_lengths = _utf8_table(encoding)
+        out_lengths = byte_lengths[data]
+        rows = np.repeat(np.arange(n), lengths)
+        lengths = np.bincount(rows, weights=out_lengths, minlength=n).astype(np.int64)
+        data = table[data][np.arange(4) < out_lengths[:, None]]
+
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    large = offsets[-1] >= 2 ** 31
+    array = pa.Array.from_buffers(
+        pa.large_string() if large else pa.string(),
+        n,
+        [
+            pa.py_buffer(np.packbits(valid, bitorder="little")),
+            pa.py_buffer(offsets.astype(np.int64 if large else np.int32)),
+            pa.py_buffer(np.ascontiguousarray(data)),
+        ],
+        null_count=int(n - valid.sum()),
+    )
+    if _is_utf8(encoding):
+        array.validate(full=True)  # Raises on invalid UTF-8
+    return array
+
+
+def _infer_type(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Casts a string column to int64 or float64 if all its values allow, as `pd.read_fwf` does."""
+    for type_ in (pa.int64(), pa.float64()):
+        try:
+            return pc.cast(column, type_)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+    return column
+
+
+def read_fwf(
+    source: Union[str, Path, BinaryIO],
+    colspecs: Union[str, Sequence[Tuple[int, int]]] = "infer",
+    widths: Sequence[int] = None,
+    names: Sequence[str] = None,
+    header: Union[str, int, None] = "infer",
+    encoding: str = "utf-8",
+    dtypes: Mapping[str, pa.DataType] = None,
+    infer_types: bool = True,
+    batch_size: int = BATCH_SIZE,
+) -> pa.Table:
+    """Reads a fixed-width file into an Arrow table, with the arguments of `pd.read_fwf`.
+
+    Column positions are in bytes, which equals characters for single-byte encodings such as latin-1.
+    Values are stripped of surrounding spaces and tabs, blank values become null, and blank lines
+    are skipped.
+
+    Parameters
+    ----------
+    source : str, Path or file-like
+        The file to read. Paths are memory-mapped, file-like objects are read into memory.
+    colspecs : list or 'infer', default='infer'
+        (start, end) byte positions of the columns, or 'infer' to infer them from the first 100 lines
+    widths : list, default=None
+        Widths of contiguous columns, instead of `colspecs`
+    names : list, default=None
+        Column names
+    header : int, None or 'infer', default='infer'
+        0 if the first line holds the column names, None if it does not. With 'infer', the first
+        line is the header unless `names` are given.
+    encoding : str, default='utf-8'
+        UTF-8 or a single-byte encoding
+    dtypes : dict, default=None
+        Arrow types of columns by name, i.e. to keep numbers with leading zeros as strings
+    infer_types : bool, default=True
+        Whether columns without `dtypes` are cast to int64 or float64 where all values allow
+    batch_size : int, default=1_000_000
+        Number of records converted at once
+
+    Returns
+    -------
+    pa.Table
+        The contents of the file
+    """
+    data = _read_bytes(source)
+    starts, ends = _line_bounds(data)
+
+    if widths is not None:
+        bounds = np.concatenate([[0], np.cumsum(widths)]).tolist()
+        colspecs = list(zip(bounds[:-1], bounds[1:]))
+    elif colspecs == "infer":
+        colspecs = infer_colspecs(data, starts, ends)
+
+    if header == "infer":
+        header = None if names is not None else 0
+    if header is not None:
+        header_matrices = [
+            _columns_matrix(data, starts[header : header + 1], ends[header : header + 1], *spec)
+            for spec in colspecs
+        ]
+        header_names = [
+            _string_array(matrix, encoding)[0].as_py() or "" for matrix in header_matrices
+        ]
+        names = names if names is not None else header_names
+        starts, ends = starts[header + 1 :], ends[header + 1 :]
+    if names is None:
+        names = [str(i) for i in range(len(colspecs))]
+    if len(names) != len(colspecs):
+        raise ValueError(f"Got {len(names)} names for {len(colspecs)} columns")
+
+    batches = [[] for _ in colspecs]
+    for i in range(0, max(len(starts), 1), batch_size):
+        batch_starts, batch_ends = starts[i : i + batch_size], ends[i : i + batch_size]
+        for column, spec in zip(batches, colspecs):
+            matrix = _columns_matrix(data, batch_starts, batch_ends, *spec)
+            column.append(_string_array(matrix, encoding))
+
+    dtypes = dtypes or {}
+    columns = []
+    for name, chunks in zip(names, batches):
+        column = pa.chunked_array(chunks, type=chunks[0].type)
+        if name in dtypes:
+            column = pc.cast(column, dtypes[name])
+        elif infer_types:
+            column = _infer_type(column)
+        columns.append(column)
+    return pa.table(columns, names=list(names))
+
+
+def _benchmark(n_records: int = 1_000_000) -> None:
+    """Compares `read_fwf` to `pd.read_fwf` on an AGB-like file of fixed-length records."""
+    import tempfile
+    import time
+
+    import pandas as pd
+
+    widths = [1, 2, 2, 6, 25, 6, 10, 2, 3, 24, 5, 5, 6, 24, 11, 8, 1, 8, 8, 2, 97]
+    rng = np.random.default_rng(0)
+    alphabet = np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ", dtype=np.uint8)
+    records = alphabet[rng.integers(0, len(alphabet), (n_records, sum(widths)))]
+    records = np.hstack([records, np.full((n_records, 1), NEWLINE, dtype=np.uint8)])
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = Path(folder) / "agb.txt"
+        records.tofile(file)
+        print(f"{n_records} records, {file.stat().st_size / 2 ** 20:.0f} MiB")
+
+        start = time.perf_counter()
+        pd.read_fwf(file, widths=widths, header=None, dtype=str)
+        pandas_seconds = time.perf_counter() - start
+        print(f"pd.read_fwf: {pandas_seconds:.2f}s")
+
+        start = time.perf_counter()
+        read_fwf(file, widths=widths, header=None, infer_types=False)
+        numpy_seconds = time.perf_counter() - start
+        print(f"read_fwf:    {numpy_seconds:.2f}s ({pandas_seconds / numpy_seconds:.0f}x)")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,199 @@
+"""Admitting conversions under a memory budget.
+
+Mapped conversion tasks all start at once, so a few multi-GB files converted concurrently can run a
+machine out of memory. Before converting a file, a task estimates the memory it needs from the
+file's size (the uncompressed size of its members, for zip files), and reserves that amount from a
+budget shared by all tasks. If the budget is used up, the task waits until others release theirs,
+so large files queue rather than run concurrently. A file larger than the whole budget waits for
+all others and then runs alone.
+
+On a Dask cluster, the budget is shared by all workers through a `distributed.Semaphore` with a
+lease per `LEASE_SIZE` bytes. Elsewhere (i.e. with a `LocalExecutor`) it is shared by the threads
+of the process. The peak RSS of the process during every conversion is measured and logged.
+
+The budget and the memory needed per byte of file (per file type) are set in the `[memory]`
+section of the config.
+"""
+from typing import Union, Mapping
+from pathlib import Path
+from contextlib import contextmanager
+from zipfile import ZipFile, is_zipfile
+import logging
+import math
+import threading
+
+import prefect
+import psutil
+
+from nl_open_data.config import config
+from nl_open_data.utils import process_local
+
+MB = 2 ** 20
+LEASE_SIZE = 64 * MB  # Bytes per lease of the distributed budget
+BUDGET_FRACTION = 0.75  # Default budget, as fraction of the machine's memory
+# Default bytes of memory needed per byte of file. Csv files are converted in streaming batches.
+MEMORY_FACTORS = {".csv": 0.5, ".txt": 6, ".xls": 10, ".json": 4}
+DEFAULT_FACTOR = 2
+SEMAPHORE_NAME = "nl-open-data-memory"
+
+
+def estimate_memory(file: Union[str, Path], factors: Mapping[str, float] = None) -> int:
+    """Estimates the memory needed to convert a file, from its size and type.
+
+    Parameters
+    ----------
+    file : str or Path
+        The file to convert. For zip files, the uncompressed sizes of the members are used.
+    factors : Mapping, default=None
+        Bytes of memory per byte of file by suffix (i.e. {'.xls': 10}), overriding `MEMORY_FACTORS`
+
+    Returns
+    -------
+    int
+        The estimated number of bytes
+    """
+    factors = {**MEMORY_FACTORS, **(factors or {})}
+    file = Path(file)
+    if is_zipfile(file):
+        with ZipFile(file) as zf:
+            sizes = [
+                (Path(info.filename).suffix.lower(), info.file_size)
+                for info in zf.infolist()
+                if not info.is_dir()
+            ]
+    else:
+        sizes = [(file.suffix.lower(), file.stat().st_size)]
+    return int(
+        sum(size * factors.get(suffix, DEFAULT_FACTOR) for suffix, size in sizes)
+    )
+
+
+class MemoryBudget:
+    """A budget of bytes shared by the threads of a process."""
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.available = budget
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> int:
+        nbytes = min(nbytes, self.budget)
+        with self._condition:
+            self._condition.wait_for(lambda: self.available >= nbytes)
+            self.available -= nbytes
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.available += nbytes
+            self._condition.notify_all()
+
+
+class DistributedMemoryBudget:
+    """A budget of bytes shared by all workers of a Dask cluster.
+
+    Reservations take leases of `LEASE_SIZE` bytes from a `distributed.Semaphore`. Leases are taken
+    while holding a `distributed.Lock`, so a large reservation can not starve by getting only part
+    of its leases while smaller ones keep taking the rest.
+    """
+
+    def __init__(self, budget: int):
+        from distributed import Lock, Semaphore
+
+        self.budget = budget
+        self.max_leases = max(budget // LEASE_SIZE, 1)
+        self._semaphore = Semaphore(max_leases=self.max_leases, name=SEMAPHORE_NAME)
+        self._lock = Lock(SEMAPHORE_NAME + "-admission")
+
+    def acquire(self, nbytes: int) -> int:
+        leases = min(max(math.ceil(nbytes / LEASE_SIZE), 1), self.max_leases)
+        with self._lock:
+            for _ in range(leases):
+                self._semaphore.acquire()
+        return leases
+
+    def release(self, leases: int) -> None:
+        for _ in range(leases):
+            self._semaphore.release()
+
+
+def get_budget(
+    settings: Mapping = None,
+) -> Union[MemoryBudget, DistributedMemoryBudget]:
+    """Returns the memory budget of the cluster this runs on, or of this process.
+
+    Parameters
+    ----------
+    settings : Mapping, default=None
+        The `[memory]` section of the config. If `budget_gb` is 0 or missing, the budget is
+        `BUDGET_FRACTION` of the memory of the machine.
+    """
+    settings = settings or {}
+    budget = int(settings.get("budget_gb", 0) * 2 ** 30)
+    budget = budget or int(psutil.virtual_memory().total * BUDGET_FRACTION)
+    try:
+        from distributed import get_worker
+
+        get_worker()
+    except (ImportError, ValueError):
+        return process_local(("memory_budget", budget), lambda: MemoryBudget(budget))
+    return process_local(
+        ("distributed_memory_budget", budget), lambda: DistributedMemoryBudget(budget)
+    )
+
+
+class PeakRSS:
+    """Measures the peak resident memory of this process, sampled while the context is open."""
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def __enter__(self):
+        self.start = self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+@contextmanager
+def limit_memory(file: Union[str, Path], settings: Mapping = None):
+    """Runs the conversion of a file within the memory budget, and logs its peak RSS.
+
+    Parameters
+    ----------
+    file : str or Path
+        The file to be converted
+    settings : Mapping, default=None
+        The `[memory]` section of the config (`budget_gb` and `factors`). If None, it is taken
+        from `nl_open_data.config.config`.
+
+    Yields
+    ------
+    PeakRSS
+        The memory measurement of the conversion
+    """
+    settings = config.get("memory", {}) if settings is None else settings
+    logger = prefect.context.get("logger") or logging.getLogger(__name__)
+    estimate = estimate_memory(file, settings.get("factors"))
+    budget = get_budget(settings)
+    reserved = budget.acquire(estimate)
+    try:
+        with PeakRSS() as rss:
+            yield rss
+    finally:
+        budget.release(reserved)
+    logger.info(
+        f"Converted {Path(file).name}: estimated {estimate / MB:.0f} MB, peak RSS "
+        f"{rss.peak / MB:.0f} MB ({(rss.peak - rss.start) / MB:+.0f} MB)"
+    )
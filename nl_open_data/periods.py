@@ -0,0 +1,110 @@
+"""Vectorized decoding of CBS period codes and dates with Arrow compute.
+
+CBS tables code their periods as a year, a period type and a number, i.e. '2019JJ00' (the year
+2019), '2020HJ02' (the second half of 2020), '2020KW01' (the first quarter) and '2020MM12'
+(December). Decoding these at ingest, into typed `jaar`, `periode_start` and `periode_type`
+columns, saves every downstream query from parsing the codes of every row, as in
+`cast(substr(fct.Perioden, 1, 4) as INT64) AS jaar`.
+"""
+from typing import Union, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PERIOD_PATTERN = r"^\d{4}(JJ|HJ|KW|MM)\d{2}$"
+# Number of months per period, per period type
+PERIOD_MONTHS = {"JJ": 0, "HJ": 6, "KW": 3, "MM": 1}
+PERIOD_COLUMNS = ("jaar", "periode_start", "periode_type")
+
+ArrayLike = Union[pa.Array, pa.ChunkedArray]
+
+
+def decode_periods(codes: ArrayLike) -> Tuple[ArrayLike, ArrayLike, ArrayLike]:
+    """Decodes CBS period codes to their year, start date and type.
+
+    Parameters
+    ----------
+    codes : pa.Array or pa.ChunkedArray
+        Period codes, i.e. '2019JJ00' or '2020KW01'
+
+    Returns
+    -------
+    tuple
+        The year (int64), the first day of the period (date32) and the period type (i.e. 'KW')
+        of every code. The start date and type are null for codes of other period types, the start
+        date is null for numbers out of range of their type (i.e. '2020KW05'), and all three are
+        null for codes that do not start with a year.
+    """
+    codes = pc.utf8_trim_whitespace(pc.cast(codes, pa.string()))
+    null = pa.scalar(None, pa.string())
+    has_year = pc.match_substring_regex(codes, r"^\d{4}")
+    year = pc.utf8_slice_codeunits(pc.if_else(has_year, codes, null), 0, 4)
+    jaar = pc.cast(year, pa.int64())
+
+    codes = pc.if_else(pc.match_substring_regex(codes, PERIOD_PATTERN), codes, null)
+    periode_type = pc.utf8_slice_codeunits(codes, 4, 6)
+    number = pc.cast(pc.utf8_slice_codeunits(codes, 6, 8), pa.int64())
+    months = pc.cast(
+        pc.index_in(periode_type, value_set=pa.array(list(PERIOD_MONTHS))), pa.int64()
+    )
+    months = pc.take(pa.array(list(PERIOD_MONTHS.values()), pa.int64()), months)
+    # i.e. the third quarter starts in month (3 - 1) * 3 + 1 = 7, a year in month 1
+    month = pc.add(pc.multiply(pc.subtract(number, 1), months), 1)
+    start = pc.binary_join_element_wise(
+        year, pc.utf8_lpad(pc.cast(month, pa.string()), 2, padding="0"), "01", "-"
+    )
+    # Numbers out of range for their type (i.e. '2020KW05' or '2020MM13') have no start date
+    periode_start = pc.strptime(start, format="%Y-%m-%d", unit="s", error_is_null=True)
+    periode_start = pc.cast(periode_start, pa.date32())
+    return jaar, periode_start, periode_type
+
+
+def add_period_columns(table: pa.Table, column: str = "Perioden") -> pa.Table:
+    """Appends the `jaar`, `periode_start` and `periode_type` of a column of CBS period codes.
+
+    Tables without the column are returned as is.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The table holding period codes
+    column : str, default="Perioden"
+        The name of the column with period codes
+
+    Returns
+    -------
+    pa.Table
+        The table with the decoded period columns appended (see `decode_periods`)
+    """
+    if column not in table.column_names:
+        return table
+    for name, values in zip(PERIOD_COLUMNS, decode_periods(table[column])):
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, values)
+        else:
+            table = table.append_column(name, values)
+    return table
+
+
+def parse_dates(values: ArrayLike, format: str = "%d%m%Y") -> ArrayLike:
+    """Parses dates, i.e. from fixed-width files, to date32.
+
+    Values are left-padded with zeros to the length of `format`, to restore leading zeros dropped
+    by numeric parsing (i.e. 1011990 for 01011990). Values that are not a valid date are null.
+
+    Parameters
+    ----------
+    values : pa.Array or pa.ChunkedArray
+        Dates as strings or integers
+    format : str, default="%d%m%Y"
+        The strptime format of the dates, without separators
+
+    Returns
+    -------
+    pa.Array or pa.ChunkedArray
+        The parsed dates
+    """
+    width = len(format.replace("%Y", "%Y%Y"))  # Every directive is two digits, years four
+    values = pc.utf8_lpad(pc.cast(values, pa.string()), width, padding="0")
+    dates = pc.strptime(values, format=format, unit="s", error_is_null=True)
+    return pc.cast(dates, pa.date32())
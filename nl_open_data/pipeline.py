@@ -0,0 +1,122 @@
+"""A per-file pipeline of stages connected by bounded queues.
+
+Mapping Prefect tasks over files runs every stage for all files before the next stage starts: all
+downloads, then all conversions, then all uploads, so the network is idle while the CPU converts
+and the other way around. Here every file moves through the stages (i.e. download, convert and
+upload) on its own. Each stage runs in its own pool of threads, and stages are connected by
+queues holding at most `queue_size` files, so a fast stage blocks (instead of piling up files on
+disk) when the next stage falls behind. The wall time of a run then approaches that of its slowest
+stage, instead of the sum of all stages.
+
+A file that fails in a stage is dropped from the following stages, and its error is returned in
+its `PipelineResult`, without stopping the other files.
+"""
+from typing import Any, Callable, Iterable, List, Sequence, Tuple
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+
+_DONE = object()  # Sentinel marking the end of the items in a queue
+
+
+@dataclass
+class PipelineResult:
+    """The outcome of a single item of a pipeline.
+
+    `value` is the return value of the last stage, and `error` the exception of the stage (named
+    in `failed_stage`) the item failed in, if any. `seconds` holds the time spent per stage.
+    """
+
+    item: Any
+    value: Any = None
+    error: BaseException = None
+    failed_stage: str = None
+    seconds: dict = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _run_stage(
+    name: str,
+    func: Callable,
+    inbox: queue.Queue,
+    outbox: queue.Queue,
+    results: List[PipelineResult],
+) -> None:
+    """Takes items from `inbox` until the sentinel, and puts the successful ones in `outbox`."""
+    while True:
+        entry = inbox.get()
+        if entry is _DONE:
+            inbox.put(_DONE)  # For the other threads of this stage
+            return
+        index, value = entry
+        result = results[index]
+        start = time.perf_counter()
+        try:
+            value = func(value)
+        except Exception as e:
+            result.error, result.failed_stage = e, name
+            continue
+        finally:
+            result.seconds[name] = time.perf_counter() - start
+        if outbox is None:
+            result.value = value
+        else:
+            outbox.put((index, value))
+
+
+def run_pipeline(
+    items: Iterable,
+    stages: Sequence[Tuple[str, Callable, int]],
+    queue_size: int = 2,
+) -> List[PipelineResult]:
+    """Runs every item through a sequence of stages, overlapping the stages of different items.
+
+    Parameters
+    ----------
+    items : Iterable
+        The input of the first stage, per item (i.e. urls)
+    stages : list of tuple
+        The (name, function, number of threads) of every stage. Every function takes the return
+        value of the previous stage (or the item, for the first stage) and returns the input of
+        the next one.
+    queue_size : int, default=2
+        Maximum number of items waiting for a stage, after the first
+
+    Returns
+    -------
+    list of PipelineResult
+        The outcome of every item, in the order of `items`
+    """
+    items = list(items)
+    results = [PipelineResult(item) for item in items]
+    # The first queue holds all items, the others apply backpressure
+    queues = [queue.Queue()] + [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+    pools = []
+    for i, (name, func, n_threads) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        threads = [
+            threading.Thread(
+                target=_run_stage,
+                args=(name, func, queues[i], outbox, results),
+                name=f"pipeline-{name}-{j}",
+                daemon=True,
+            )
+            for j in range(max(n_threads, 1))
+        ]
+        for thread in threads:
+            thread.start()
+        pools.append(threads)
+
+    for entry in enumerate(items):
+        queues[0].put(entry)
+    queues[0].put(_DONE)
+    for i, threads in enumerate(pools):
+        for thread in threads:
+            thread.join()
+        if i + 1 < len(stages):
+            queues[i + 1].put(_DONE)
+    return results
@@ -1,22 +1,35 @@
 from typing import Union, Mapping, Sequence
 from pathlib import Path
+from datetime import datetime
+from collections import defaultdict
 import os
+import threading
 from shutil import rmtree
 from tempfile import gettempdir, mkdtemp
 from zipfile import ZipFile
-import requests
 
 from box import Box
-from google.cloud import storage
 import pandas as pd
 from pyarrow import Table as PA_Table
-from pyarrow import csv
+from pyarrow import Schema as PA_Schema
 import pyarrow.parquet as pq
+import prefect
 from prefect import task, case
 from prefect.tasks.control_flow import merge
+from prefect.triggers import all_finished
 from prefect.engine.signals import SKIP
 
 import nl_open_data.utils as nlu
+import nl_open_data.download as nld
+import nl_open_data.cache as nlc
+import nl_open_data.catalog as nlcat
+import nl_open_data.upload as nlup
+import nl_open_data.executors as nle
+import nl_open_data.memory as nlm
+import nl_open_data.pipeline as nlpl
+import nl_open_data.fwf as nlf
+import nl_open_data.periods as nlp
+import nl_open_data.xls as nlx
 
 
 @task
@@ -66,6 +79,56 @@ def get_filename_from_url(url):
     return url.split("/")[-1]
 
 
+@task
+def plan_files(
+    urls: list,
+    local_folder: Union[str, Path],
+    download_dir: str = "download",
+    out_dir: str = "upload_to_gcs",
+    out_suffix: str = ".parquet",
+) -> dict:
+    """Creates the download and output folders, and plans the paths of all files in a single task.
+
+    Replaces mapping a chain of one-line tasks (i.e. `get_filename_from_url`, `create_path` and
+    `replace_suffix`) over every url, whose scheduling takes longer than their work. The lists
+    are in the order of `urls`, ready to be mapped over (i.e. `download.map(urls, plan["download"])`).
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the files
+    local_folder : str or Path
+        The folder to create `download_dir` and `out_dir` in
+    download_dir : str, default="download"
+        The name of the folder to download the files into
+    out_dir : str, default="upload_to_gcs"
+        The name of the folder to write the converted files into
+    out_suffix : str, default=".parquet"
+        The suffix of the converted files
+
+    Returns
+    -------
+    dict
+        The 'download_folder' and 'out_folder', and a list per key of
+        `nl_open_data.utils.plan_file` ('filename', 'download' and 'out_file')
+    """
+    download_folder = nlu.create_dir_util(Path(local_folder) / download_dir)
+    out_folder = nlu.create_dir_util(Path(local_folder) / out_dir)
+    # Files with the same name (i.e. from different folders) are numbered, to not overwrite them
+    plans = [
+        nlu.plan_file(url, download_folder, out_folder, out_suffix, filename)
+        for url, filename in zip(urls, nlu.url_filenames(urls))
+    ]
+    return dict(
+        download_folder=download_folder,
+        out_folder=out_folder,
+        **{
+            key: [plan[key] for plan in plans]
+            for key in ("filename", "download", "out_file")
+        },
+    )
+
+
 @task
 def upper(string):
     return string.upper()
@@ -99,47 +162,39 @@ def clean_folder_names(folder: Union[str, Path], extra_chars: str = ""):
     return folder
 
 
-# @task
-# def clean_file_name(file: Union[str, Path], chars: str = None) -> Path:
-#     """Renames files by replacing certain characters from the filename with an underscore.
-
-#     By default, replaces all occurrences of: hyphen, dot or parentheses.
-#     To replace different characters, provide a single string with desired characters.
-
-#     Original filepath must exist.
-
-#     Parameters
-#     ----------
-#     file : Union[str, Path]
-#         The file to clean its name.
-#     extra_chars : str, optional
-#         Additional characters to replace.
-
-#     Returns
-#     -------
-#     Path
-#         The filepath to the renamed file.
-
-#     Examples
-#     --------
-#     >>> path = "/some-folder/another.folder/some-file$@(1).txt"
-#     >>> new_path = clean_file_name(path)
-#     >>> new_path
-#     PosixPath('/some-folder/another.folder/some_file$@_1_.txt')
-#     >>> special_chars = "-()@$"
-#     >>> special_new_path = clean_file_name(path, special_chars)
-#     PosixPath('/some-folder/another.folder/some_file___1_.txt')
-#     """
-#     path = Path(file)
-#     if not chars:
-#         chars = "-.()%"
-#     # new_stem = path.stem
-#     for char in chars:
-#         new_path = path.replace(char, "_")
-#         # new_stem = new_stem.replace(char, "_")
-#     # new_path = path.parent / Path(new_stem + path.suffix)
-#     new_path = path.rename(new_path)
-#     return new_path
+@task
+def clean_file_name(file: Union[str, Path], extra_chars: str = "") -> Path:
+    """Renames a file by replacing certain characters in its name with an underscore.
+
+    Uses `nl_open_data.utils.clean_string`, which by default replaces all occurrences of:
+    hyphen, dot, parentheses or percent sign. The suffix is kept as is.
+
+    Original filepath must exist.
+
+    Parameters
+    ----------
+    file : Union[str, Path]
+        The file to clean its name.
+    extra_chars : str, optional
+        Additional characters to replace.
+
+    Returns
+    -------
+    Path
+        The filepath to the renamed file.
+
+    Examples
+    --------
+    >>> path = "/some-folder/another.folder/some-file$@(1).txt"
+    >>> new_path = clean_file_name(path)
+    >>> new_path
+    PosixPath('/some-folder/another.folder/some_file$@_1_.txt')
+    >>> special_new_path = clean_file_name(path, "@$")
+    PosixPath('/some-folder/another.folder/some_file___1_.txt')
+    """
+    path = Path(file)
+    new_path = path.parent / (nlu.clean_string(path.stem, extra_chars) + path.suffix)
+    return path.rename(new_path)
 
 
 @task
@@ -209,18 +264,25 @@ def curl_cmd(
     filepath: Union[str, Path],
     limit_retries: bool = True,
     std_out: bool = False,
+    use_cache: bool = True,
     **kwargs,
 ) -> str:
     """Template for curl command to download file.
 
     Uses `curl -fL -o` that fails silently and follows redirects.
 
+    If the url is in the download cache and did not change on the server since,
+    the cached file is placed at filepath instead and the download is skipped.
+    Files downloaded by curl are not added to the cache, use the `download` task for that.
+
     Parameters
     ----------
     url : str
         Url to download
     filepath : str or Path
         File for saving fecthed url
+    use_cache : bool, default=True
+        Whether to consult the download cache from `nl_open_data.cache.get_cache()`
     **kwargs
         Keyword arguments passed to Task constructor
 
@@ -232,7 +294,7 @@ def curl_cmd(
     Raises
     ------
     SKIP
-        if filepath exists
+        if filepath exists, or was served from the download cache
 
     Example
     -------
@@ -254,6 +316,12 @@ def curl_cmd(
     """
     if Path(filepath).exists():
         raise SKIP(f"File {filepath} already exists.")
+    if use_cache:
+        cache = nlc.get_cache()
+        entry = cache.lookup(url)
+        if entry and nld.is_fresh(url, entry):
+            cache.fetch(entry, filepath)
+            raise SKIP(f"File {filepath} served from download cache.")
     cmd = (
         f"curl -fL '{url}' -o '{filepath}'"
         if limit_retries
@@ -264,13 +332,108 @@ def curl_cmd(
     return cmd
 
 
+@task(log_stdout=True, tags=[nle.IO_BOUND])
+def download(
+    url: str, filepath: Union[str, Path], use_cache: bool = True, **kwargs
+) -> Path:
+    """Downloads a url to a file in-process, see `nl_open_data.download.download_file`.
+
+    Unlike `curl_cmd`, the connection pool is shared between downloads, interrupted downloads
+    are resumed, large files are fetched in parallel ranges, and files that were downloaded
+    before (in this or any previous flow run, through the download cache) are only fetched
+    again if they changed on the server.
+
+    Parameters
+    ----------
+    url : str
+        Url to download
+    filepath : str or Path
+        File for saving the fetched url
+    use_cache : bool, default=True
+        Whether to consult and fill the download cache from `nl_open_data.cache.get_cache()`
+    **kwargs
+        Keyword arguments passed to `nl_open_data.download.download_file`
+
+    Returns
+    -------
+    Path
+        The downloaded file
+    """
+    cache = nlc.get_cache() if use_cache else None
+    result = nld.download_file(url, filepath, cache=cache, **kwargs)
+    print(
+        f"{result.status} {result.url} -> {result.path} "
+        f"({result.size} bytes in {result.seconds:.1f}s, {result.mb_per_second:.1f} MB/s, "
+        f"sha256={result.sha256})"
+    )
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Download cache: {stats['hits']} hits, {stats['misses']} misses")
+    return result.path
+
+
 @task
 def get_from_cbs_url(url: str, get_value_only: bool):
-    r = requests.get(url).json()
     if get_value_only:
-        return r["value"]
+        # Follow the pages of the collection, see `nl_open_data.catalog.iter_pages`
+        return [record for page in nlcat.iter_pages(url) for record in page]
     else:
-        return r
+        response = nld.get_session().get(url, timeout=nld.TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+
+@task(log_stdout=True)
+def fetch_catalogs(catalog_urls: list, catalog_names: list) -> list:
+    """Fetches CBS catalogs concurrently and page by page, as Arrow tables.
+
+    See `nl_open_data.catalog.fetch_catalogs`.
+
+    Parameters
+    ----------
+    catalog_urls : list of str
+        The url of every catalog
+    catalog_names : list of str
+        The name of every catalog, i.e. 'cbs_v3'
+
+    Returns
+    -------
+    list of pyarrow.Table
+        The table of every catalog, in the order of `catalog_urls`
+    """
+    tables = nlcat.fetch_catalogs(
+        dict(zip(catalog_names, catalog_urls)), schemas=nlcat.CATALOG_SCHEMAS
+    )
+    for name, table in tables.items():
+        print(f"Fetched {table.num_rows} datasets from catalog {name}")
+    return [tables[name] for name in catalog_names]
+
+
+@task(log_stdout=True)
+def refresh_catalog_index(catalogs: list, catalog_names: list) -> dict:
+    """Refreshes the local catalog index with the tables of CBS catalogs, see `nl_open_data.catalog`.
+
+    Parameters
+    ----------
+    catalogs : list of list or pyarrow.Table
+        The tables of every catalog, as returned by `fetch_catalogs` or `get_from_cbs_url`
+    catalog_names : list of str
+        The name of every catalog, i.e. 'cbs_v3'
+
+    Returns
+    -------
+    dict
+        The number of indexed datasets per catalog
+    """
+    index = nlcat.get_catalog_index()
+    counts = {
+        name: index.refresh(
+            name, tables.to_pylist() if isinstance(tables, PA_Table) else tables
+        )
+        for name, tables in zip(catalog_names, catalogs)
+    }
+    print(f"Refreshed catalog index {index.path}: {counts}")
+    return counts
 
 
 @task
@@ -288,6 +451,378 @@ def unzip(zipfile: Union[Path, str], out_folder: Union[Path, str] = None):
     return out_folder
 
 
+@task(tags=[nle.CPU_BOUND])
+def zip_csv_to_parquet(
+    zipfile: Union[Path, str],
+    out_folder: Union[Path, str] = None,
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    block_size: int = None,
+    schemas: Mapping = None,
+    period_column: str = None,
+) -> list:
+    """Converts all csv files inside a zip file to parquet files, without extracting the zip file.
+
+    Each csv member is streamed straight out of the zip file and written in record batches,
+    so neither the extracted csv files nor a full table are ever held on disk or in memory.
+    The folder structure inside the zip file is kept, nested under a folder named after
+    the zip file, and all names are cleaned using `nl_open_data.utils.clean_string`.
+    Fixed width text (.txt) members (i.e. the metadata of UWV Open Match) are converted to
+    newline delimited json, as `convert_files_switch` does for extracted files. Other members
+    are ignored. The zip file is removed afterwards.
+
+    Parameters
+    ----------
+    zipfile : str or Path
+        The zip file to convert. If None, nothing is converted.
+    out_folder : str or Path, default=None
+        The folder to write the parquet files into. If None, a 'parquet' folder
+        next to the zip file is used.
+    delimiter : str, default=","
+        The delimiter used in the csv files
+    encoding : str, default="utf-8"
+        The encoding of the csv and txt files
+    block_size : int, default=None
+        Number of bytes of csv to process per batch. If None, pyarrow's default is used.
+    schemas : Mapping, default=None
+        Schemas to cast the csv members to, keyed by their table name (as returned by
+        `infer_csv_schemas`). Members without a schema have their types inferred.
+    period_column : str, default=None
+        The name of a column of CBS period codes (i.e. 'Perioden'), to add typed `jaar`,
+        `periode_start` and `periode_type` columns for (see `nl_open_data.periods`)
+
+    Returns
+    -------
+    list
+        Paths to the written parquet and json files
+    """
+    if zipfile is None:
+        return []  # i.e. dropped by `drop_unchanged_file`
+    zipfile = Path(zipfile)
+    if out_folder is None:
+        out_folder = zipfile.parents[0] / "parquet"
+    out_folder = Path(out_folder) / nlu.clean_string(zipfile.stem)
+
+    out_files = []
+    with nlm.limit_memory(zipfile), ZipFile(zipfile, "r") as zf:
+        for member in zf.infolist():
+            member_path = Path(member.filename)
+            suffix = member_path.suffix.lower()
+            if member.is_dir() or suffix not in (".csv", ".txt"):
+                continue
+            clean_parts = [nlu.clean_string(part) for part in member_path.parent.parts]
+            table_name = nlu.clean_string(member_path.stem)
+            out_file = out_folder.joinpath(*clean_parts, table_name)
+            nlu.create_dir_util(out_file.parents[0])
+            with zf.open(member) as stream:
+                if suffix == ".csv":
+                    out_file = out_file.with_suffix(".parquet")
+                    nlu.csv_stream_to_parquet(
+                        stream,
+                        out_file,
+                        delimiter=delimiter,
+                        encoding=encoding,
+                        block_size=block_size,
+                        schema=schemas.get(table_name) if schemas else None,
+                        period_column=period_column,
+                    )
+                else:
+                    # Parsed as in `fwf_to_ndjson`
+                    out_file = out_file.with_suffix(".json")
+                    df = nlf.read_fwf(stream, encoding=encoding).to_pandas()
+                    df.to_json(out_file, orient="records", lines=True)
+            out_files.append(out_file)
+    os.remove(zipfile)
+    return out_files
+
+
+@task
+def load_manifest(
+    manifest_blob: str,
+    config: Box,
+    source: str = None,
+    gcp_env: str = "dev",
+    prod_env: str = None,
+) -> dict:
+    """Loads the manifest of urls processed by previous incremental flow runs from GCS.
+
+    The manifest maps every processed url to the sha256 checksum and the ETag / Last-Modified
+    validators of the downloaded file, and the time it was processed (see `update_manifest`).
+
+    Parameters
+    ----------
+    manifest_blob : str
+        The name of the manifest blob in the bucket. If None, the flow run is not incremental,
+        and an empty manifest is returned.
+    config : Box
+        Config object
+    source : str, default=None
+        The source of the dataset
+    gcp_env : str, default="dev"
+        Determines which GCP configuration to use from config.gcp
+    prod_env : str, default=None
+        If gcp_env = "prod", determines which GCP environment to use from config.gcp.prod
+
+    Returns
+    -------
+    dict
+        The manifest, empty if it does not exist (yet)
+    """
+    if not manifest_blob:
+        return {}
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
+    manifest = nlu.read_gcs_json(manifest_blob, gcp) or {}
+    print(f"Manifest {manifest_blob} holds {len(manifest)} processed urls")
+    return manifest
+
+
+@task(log_stdout=True)
+def filter_new_urls(urls: list, manifest: Mapping) -> list:
+    """Returns the urls that are new or changed since they were added to the manifest of an incremental flow.
+
+    Urls in the manifest are checked with a conditional HEAD request, using the ETag / Last-Modified
+    validators of their previous download, so a resource replaced at the same url is processed again.
+    Urls whose server sent no validators are kept as well, to be compared by checksum once downloaded
+    (see `drop_unchanged_file`). The order of the urls is preserved.
+    """
+    new_urls = []
+    for url in urls:
+        entry = manifest.get(url)
+        if entry is None:
+            new_urls.append(url)
+        elif not nld.is_fresh(url, entry):
+            print(f"{url} may have changed since {entry.get('processed_at')}")
+            new_urls.append(url)
+    print(f"{len(new_urls)} of {len(urls)} urls are new or changed")
+    return new_urls
+
+
+@task(log_stdout=True)
+def drop_unchanged_file(
+    file: Union[str, Path], url: str, manifest: Mapping
+) -> Union[Path, None]:
+    """Returns a downloaded file, or None (removing the file) if it is unchanged since it was added to the manifest.
+
+    Parameters
+    ----------
+    file : str or Path
+        The file downloaded from url
+    url : str
+        The url of the file
+    manifest : Mapping
+        The manifest of an incremental flow, as loaded by `load_manifest`
+
+    Returns
+    -------
+    Path or None
+        The file, if its sha256 checksum differs from the one in the manifest
+    """
+    file = Path(file)
+    sha256 = nld.read_meta(file).get("sha256") or nld.file_sha256(file)
+    if manifest.get(url, {}).get("sha256") == sha256:
+        print(f"{url} is unchanged (sha256={sha256}), skipping it")
+        os.remove(file)
+        return None
+    return file
+
+
+@task(trigger=all_finished)
+def flatten_files(nested: list) -> list:
+    """Flattens the lists of files returned by the children of a mapped task.
+
+    Unlike Prefect's `flatten`, children that failed (passing their exception instead of a list)
+    are skipped, so the files of the other children are still processed downstream.
+
+    Parameters
+    ----------
+    nested : list
+        The results of the children, i.e. of a mapped `zip_csv_to_parquet`
+
+    Returns
+    -------
+    list
+        All files returned by the successful children
+    """
+    return [file for files in nested if isinstance(files, list) for file in files]
+
+
+@task
+def update_manifest(
+    manifest_blob: str,
+    manifest: Mapping,
+    urls: list,
+    files: list,
+    out_files: list,
+    gcs_ids: list,
+    config: Box,
+    source: str = None,
+    gcp_env: str = "dev",
+    prod_env: str = None,
+) -> dict:
+    """Adds the urls fully processed in this flow run to the manifest of an incremental flow, and writes it to GCS.
+
+    A url is only recorded if all files converted from it were uploaded, so that urls whose
+    conversion or upload failed are processed again in the next run. Meant to run with an
+    `all_finished` trigger, downstream of the (mapped) upload, so that a single failed upload
+    does not prevent recording the others.
+
+    Parameters
+    ----------
+    manifest_blob : str
+        The name of the manifest blob in the bucket. If None, the flow run is not incremental and nothing is written.
+    manifest : Mapping
+        The manifest as loaded at the start of the flow run, by `load_manifest`
+    urls : list of str
+        The urls processed in this flow run
+    files : list of str or Path
+        The files downloaded from `urls`, in the same order. None for files that were unchanged.
+    out_files : list of lists
+        Per downloaded file, the files converted from it (i.e. the results of a mapped `zip_csv_to_parquet`)
+    gcs_ids : list
+        Per converted file, in the (flattened) order of out_files, the result of its upload.
+        Failed uploads hold their exception instead.
+    config : Box
+        Config object
+    source : str, default=None
+        The source of the dataset
+    gcp_env : str, default="dev"
+        Determines which GCP configuration to use from config.gcp
+    prod_env : str, default=None
+        If gcp_env = "prod", determines which GCP environment to use from config.gcp.prod
+
+    Returns
+    -------
+    dict
+        The updated manifest
+    """
+    if not manifest_blob:
+        return dict(manifest)
+    manifest = dict(manifest)
+    processed_at = datetime.now().isoformat()
+    uploads = iter(gcs_ids if isinstance(gcs_ids, list) else [])
+    for url, file, converted in zip(urls, files, out_files):
+        if not isinstance(converted, list):
+            print(f"Not recording {url}: it was not converted ({converted!r})")
+            continue
+        uploaded = [next(uploads, None) for _ in converted]
+        if not file:
+            continue  # Unchanged, its entry is still valid
+        if not all(isinstance(ids, list) for ids in uploaded):
+            print(f"Not recording {url}: not all of its files were uploaded")
+            continue
+        meta = nld.read_meta(file)
+        manifest[url] = {
+            "sha256": meta.get("sha256"),
+            "etag": meta.get("etag"),
+            "last_modified": meta.get("last_modified"),
+            "processed_at": processed_at,
+        }
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
+    nlu.write_gcs_json(manifest, manifest_blob, gcp)
+    return manifest
+
+
+@task(log_stdout=True)
+def detect_changed_datasets(
+    ids: list,
+    source: str,
+    config: Box,
+    third_party: bool = False,
+    gcp_env: str = "dev",
+    force: bool = False,
+) -> dict:
+    """Finds the Statline datasets that changed since they were last mirrored, in a single pass.
+
+    The `Modified` dates of all datasets are fetched in a single pass over the v3 and v4 catalogs,
+    and compared to the snapshot of the last mirrored dates, see `nl_open_data.catalog`. Datasets
+    whose date differs from the snapshot are mirrored with `force=True`. Datasets missing from the
+    snapshot (or catalog) are mirrored with the `force` of the flow, so that `main` checks them
+    against their metadata in GCP, and the snapshot is seeded as they are recorded afterwards.
+
+    Parameters
+    ----------
+    ids : list of str
+        The dataset ids to check
+    source : str
+        The source of the datasets (i.e. 'cbs' or 'mlz')
+    config : Box
+        Config object
+    third_party : bool, default=False
+        Whether the datasets are in the third party (dataderden) catalog
+    gcp_env : str, default="dev"
+        Determines which GCP configuration to use from config.gcp
+    force : bool, default=False
+        If True, all ids count as changed
+
+    Returns
+    -------
+    dict
+        The 'ids' to mirror, the 'force' to mirror each of them with, and the catalog 'modified'
+        date and odata 'versions' of every id in the catalogs
+    """
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source)
+    modified, versions = nlcat.fetch_modified_versions(third_party, source)
+    if force:
+        changed, unknown = list(ids), []
+    else:
+        snapshots = {
+            odata_version: nlcat.read_snapshot(source, gcp, odata_version)
+            for odata_version in set(versions.values())
+        }
+        snapshot = {id_: snapshots[versions[id_]].get(id_) for id_ in versions}
+        changed, unknown = nlcat.split_changed_ids(ids, modified, snapshot)
+    print(
+        f"{len(changed)} of {len(ids)} datasets changed since they were last mirrored, "
+        f"{len(unknown)} are checked against GCP"
+    )
+    to_mirror = changed + unknown
+    return dict(
+        ids=to_mirror,
+        force=[True] * len(changed) + [force] * len(unknown),
+        modified={id_: modified[id_] for id_ in to_mirror if id_ in modified},
+        versions={id_: versions[id_] for id_ in to_mirror if id_ in versions},
+    )
+
+
+@task(log_stdout=True)
+def update_catalog_snapshot(
+    changes: Mapping, results: list, source: str, config: Box, gcp_env: str = "dev",
+) -> list:
+    """Records the catalog `Modified` dates of the datasets that were mirrored successfully.
+
+    Datasets skipped by `main` as unchanged in GCP are recorded as well, so that they are known
+    to be unchanged in the next run. Meant to run with an `all_finished` trigger, so datasets that
+    did succeed are recorded even if others failed.
+
+    Parameters
+    ----------
+    changes : Mapping
+        As returned by `detect_changed_datasets`
+    results : list
+        The result of mirroring every id, in the same order (exceptions for failures)
+    source, config, gcp_env
+        See `detect_changed_datasets`
+
+    Returns
+    -------
+    list
+        The recorded ids
+    """
+    if changes is None or isinstance(changes, BaseException):
+        return []
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source)
+    results = results if isinstance(results, list) else [results] * len(changes["ids"])
+    mirrored = defaultdict(dict)  # By odata version
+    for id_, result in zip(changes["ids"], results):
+        if id_ in changes["modified"] and not isinstance(result, BaseException):
+            mirrored[changes["versions"][id_]][id_] = changes["modified"][id_]
+    for odata_version, modified in mirrored.items():
+        nlcat.write_snapshot(modified, source, gcp, odata_version)
+    recorded = [id_ for modified in mirrored.values() for id_ in modified]
+    print(f"Recorded {len(recorded)} of {len(changes['ids'])} datasets as mirrored")
+    return recorded
+
+
 @task()
 def list_dir(folder: Union[Path, str], suffix: str = None):
     folder = Path(folder)
@@ -307,10 +842,26 @@ def list_dir(folder: Union[Path, str], suffix: str = None):
         return None
 
 
-@task()
+def _read_fwf(file: Path, engine: str, **kwargs) -> PA_Table:
+    if engine == "numpy":
+        return nlf.read_fwf(file, **kwargs)
+    if engine == "pandas":
+        return PA_Table.from_pandas(pd.read_fwf(file, **kwargs), preserve_index=False)
+    raise ValueError(f"Unknown engine {engine}, use 'numpy' or 'pandas'")
+
+
+@task(tags=[nle.CPU_BOUND])
 def fwf_to_ndjson(
-    file: Union[str, Path], out_file: Union[str, Path] = None, **kwargs
+    file: Union[str, Path],
+    out_file: Union[str, Path] = None,
+    engine: str = "numpy",
+    **kwargs,
 ) -> Path:
+    """Converts a fixed-width txt file to newline delimited json.
+
+    With engine="numpy" the file is parsed by `nl_open_data.fwf.read_fwf`, with engine="pandas"
+    by `pd.read_fwf`. `kwargs` are passed to the parser (i.e. `widths`, `names` and `encoding`).
+    """
     if not file.suffix == ".txt":
         raise TypeError("Only txt files are allowed")
     if out_file is not None:
@@ -319,16 +870,25 @@ def fwf_to_ndjson(
     else:
         folder = nlu.create_dir_util(file.parents[0] / "json")
         out_file = folder / (file.stem + ".json")
-    df = pd.read_fwf(file, **kwargs)
-    df.to_json(out_file, orient="records", lines=True)
+    with nlm.limit_memory(file):
+        df = _read_fwf(file, engine, **kwargs).to_pandas()
+        df.to_json(out_file, orient="records", lines=True)
     os.remove(file)
     return out_file
 
 
-@task()
+@task(tags=[nle.CPU_BOUND])
 def fwf_to_parquet(
-    file: Union[str, Path], out_file: Union[str, Path] = None, **kwargs
+    file: Union[str, Path],
+    out_file: Union[str, Path] = None,
+    engine: str = "numpy",
+    **kwargs,
 ) -> Path:
+    """Converts a fixed-width txt file to parquet.
+
+    With engine="numpy" the file is parsed by `nl_open_data.fwf.read_fwf`, with engine="pandas"
+    by `pd.read_fwf`. `kwargs` are passed to the parser (i.e. `widths`, `names` and `encoding`).
+    """
     if not file.suffix == ".txt":
         raise TypeError("Only txt files are allowed")
     if out_file is not None:
@@ -337,20 +897,121 @@ def fwf_to_parquet(
     else:
         folder = nlu.create_dir_util(file.parents[0] / "parquet")
         out_file = folder / (file.stem + ".parquet")
-    df = pd.read_fwf(file, **kwargs)
-    df.to_parquet(out_file)
+    with nlm.limit_memory(file):
+        pq.write_table(_read_fwf(file, engine, **kwargs), out_file)
     os.remove(file)
     return out_file
 
 
-@task()
+@task(tags=[nle.CPU_BOUND])
+def infer_csv_schemas(
+    files: list,
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    sample_size: int = None,
+    block_size: int = None,
+) -> dict:
+    """Infers a single set of schemas for a dataset of csv files (optionally zipped).
+
+    Only the first existing file in `files` is scanned, so that the schemas are inferred
+    once per flow run and every file in the dataset is then converted to the same types.
+    The whole file is scanned by default, so the types fit all of its values (see
+    `nl_open_data.utils.infer_csv_schema`). A csv file yields one schema, a zip file yields
+    one schema per csv member.
+
+    Parameters
+    ----------
+    files : list of str or Path
+        The csv and/or zip files of the dataset
+    delimiter : str, default=","
+        The delimiter used in the csv files
+    encoding : str, default="utf-8"
+        The encoding of the csv files
+    sample_size : int, default=None
+        If given, the schemas are inferred from only this many bytes at the start of each csv,
+        instead of from the whole csv.
+    block_size : int, default=None
+        Number of bytes of csv to scan per block. If None, pyarrow's default is used.
+
+    Returns
+    -------
+    dict
+        The inferred schemas, keyed by table name (the cleaned stem of the csv file or member)
+    """
+    # Failed upstream children (with the `any_successful` trigger) pass their exception
+    existing = [
+        Path(file)
+        for file in files
+        if isinstance(file, (str, Path)) and Path(file).exists()
+    ]
+    if not existing:
+        raise SKIP("No files to infer a schema from.")
+    sample = existing[0]
+    schemas = {}
+    if sample.suffix == ".zip":
+        with ZipFile(sample, "r") as zf:
+            for member in zf.infolist():
+                member_path = Path(member.filename)
+                if member.is_dir() or member_path.suffix.lower() != ".csv":
+                    continue
+                with zf.open(member) as stream:
+                    schemas[nlu.clean_string(member_path.stem)] = nlu.infer_csv_schema(
+                        stream,
+                        delimiter=delimiter,
+                        encoding=encoding,
+                        sample_size=sample_size,
+                        block_size=block_size,
+                    )
+    else:
+        schemas[nlu.clean_string(sample.stem)] = nlu.infer_csv_schema(
+            sample,
+            delimiter=delimiter,
+            encoding=encoding,
+            sample_size=sample_size,
+            block_size=block_size,
+        )
+    return schemas
+
+
+@task(tags=[nle.CPU_BOUND])
 def csv_to_parquet(
     file: Union[str, Path],
     out_file: Union[str, Path] = None,
     # out_folder: Union[str, Path] = None,
     delimiter: str = ",",
     encoding: str = "utf-8",
+    block_size: int = None,
+    schema: PA_Schema = None,
+    period_column: str = None,
 ) -> Path:
+    """Converts a csv file to a parquet file in bounded memory.
+
+    The csv file is read and written one record batch (row group) at a time,
+    see `nl_open_data.utils.csv_stream_to_parquet`. The csv file is removed afterwards.
+
+    Parameters
+    ----------
+    file : str or Path
+        The csv file to convert
+    out_file : str or Path, default=None
+        The parquet file to write. If None, the file is written in a 'parquet' folder next to the csv file.
+    delimiter : str, default=","
+        The delimiter used in the csv file
+    encoding : str, default="utf-8"
+        The encoding of the csv file
+    block_size : int, default=None
+        Number of bytes of csv to process per batch. If None, pyarrow's default is used.
+    schema : pyarrow.Schema, default=None
+        A schema shared by all files of the dataset (i.e. from `infer_csv_schemas`) to cast the csv to.
+    period_column : str, default=None
+        The name of a column of CBS period codes (i.e. 'Perioden'), to add typed `jaar`,
+        `periode_start` and `periode_type` columns for (see `nl_open_data.periods`)
+
+    Returns
+    -------
+    out_file: Path
+        The path to the written parquet file
+    """
     file = Path(file)
 
     if not file.suffix == ".csv":
@@ -361,21 +1022,53 @@ def csv_to_parquet(
     else:
         folder = nlu.create_dir_util(file.parents[0] / "parquet")
         out_file = folder / (file.stem + ".parquet")
-    table = csv.read_csv(
-        file,
-        read_options=csv.ReadOptions(encoding=encoding),
-        parse_options=csv.ParseOptions(delimiter=delimiter),
-    )
-    pq.write_table(table, out_file)  # TODO -> set proper data types in parquet file
+    with nlm.limit_memory(file):
+        nlu.csv_stream_to_parquet(
+            file,
+            out_file,
+            delimiter=delimiter,
+            encoding=encoding,
+            block_size=block_size,
+            schema=schema,
+            period_column=period_column,
+        )
     os.remove(file)
     return out_file
 
 
-@task()
+@task(tags=[nle.CPU_BOUND])
 def xls_to_parquet(
-    file: Union[str, Path], out_file: Union[str, Path] = None, read_excel_kwargs=None,
+    file: Union[str, Path],
+    out_file: Union[str, Path] = None,
+    column_types: Mapping = None,
+    null_markers: Sequence[str] = nlx.NULL_MARKERS,
+    period_column: str = None,
 ) -> Path:
+    """Converts the first sheet of an Excel (.xls) file to a parquet file.
+
+    The sheet is read into Arrow with `nl_open_data.xls.read_xls`: CBS missing-value markers
+    (i.e. '.'), decimal commas and unit rows below the header are handled for every file, and
+    every column gets a single type. The xls file is removed afterwards.
 
+    Parameters
+    ----------
+    file : str or Path
+        The xls file to convert
+    out_file : str or Path, default=None
+        The parquet file to write. If None, the file is written in a 'parquet' folder next to the xls file.
+    column_types : Mapping, default=None
+        Arrow types (or their names, i.e. 'string') of columns by name, instead of inferring them
+    null_markers : list of str, default=nl_open_data.xls.NULL_MARKERS
+        Text of cells that are missing values
+    period_column : str, default=None
+        The name of a column of CBS period codes (i.e. 'Perioden'), to add typed `jaar`,
+        `periode_start` and `periode_type` columns for (see `nl_open_data.periods`)
+
+    Returns
+    -------
+    out_file: Path
+        The path to the written parquet file
+    """
     file = Path(file)
 
     if file.suffix == ".xls":
@@ -384,11 +1077,11 @@ def xls_to_parquet(
         else:
             folder = nlu.create_dir_util(file.parent / "parquet")
             out_file = folder / (file.stem + ".parquet")
-        if read_excel_kwargs:
-            df = pd.read_excel(file, **read_excel_kwargs)
-        else:
-            df = pd.read_excel(file)
-        df.to_parquet(out_file)
+        with nlm.limit_memory(file):
+            table = nlx.read_xls(file, types=column_types, null_markers=null_markers)
+            if period_column:
+                table = nlp.add_period_columns(table, period_column)
+            pq.write_table(table, out_file)
         os.remove(file)
 
         return out_file
@@ -436,16 +1129,40 @@ def create_path(left, right):
 
 
 @task
-def struct_to_parquet(struct: list, file_name: str, folder_name: str = None):
-    df = pd.DataFrame(struct)
-    table = PA_Table.from_pandas(df)
+def struct_to_parquet(
+    struct: Union[list, PA_Table],
+    file_name: str,
+    folder_name: str = None,
+    folder: Union[str, Path] = None,
+    schema: PA_Schema = None,
+) -> Path:
+    """Writes records (i.e. a CBS catalog) to a parquet file, one record batch at a time.
+
+    See `nlu.records_to_parquet`.
+
+    Parameters
+    ----------
+    struct : list of dict or pyarrow.Table
+        The records to write
+    file_name : str
+        The name of the parquet file, without suffix
+    folder_name : str, default=None
+        If given, the file is written into this subfolder of `folder`
+    folder : str or Path, default=None
+        The folder of this run (i.e. from `create_temp_dir`). If None, a new temp folder is
+        created, so concurrent runs never write to the same file.
+    schema : pyarrow.Schema, default=None
+        The schema of the records. If None, it is inferred from the first batch.
+
+    Returns
+    -------
+    pq_file: Path
+        The path to the written parquet file
+    """
+    folder = Path(folder) if folder else Path(mkdtemp(prefix="struct_to_parquet"))
     if folder_name:
-        pq_file = Path(gettempdir()) / Path(folder_name) / Path(file_name + ".parquet")
-    else:
-        pq_file = Path(gettempdir()) / Path(file_name + ".parquet")
-    with open(pq_file, "wb+") as f:
-        pq.write_table(table, f)
-    return pq_file
+        folder = nlu.create_dir_util(folder / folder_name)
+    return nlu.records_to_parquet(struct, folder / f"{file_name}.parquet", schema=schema)
 
 
 # @task
@@ -474,7 +1191,44 @@ def struct_to_parquet(struct: list, file_name: str, folder_name: str = None):
 #     return ids
 
 
-@task
+@task(log_stdout=True)
+def list_blob_hashes(
+    gcs_folder: str,
+    config: Box,
+    source: str = None,
+    gcp_env: str = "dev",
+    prod_env: str = None,
+) -> dict:
+    """Lists the checksums of all blobs in a GCS folder once, to skip unchanged uploads in `upload_to_gcs`.
+
+    Parameters
+    ----------
+    gcs_folder : str
+        The folder in the bucket files will be uploaded to
+    config : Box
+        Config object
+    source : str, default=None
+        The source of the dataset
+    gcp_env : str, default="dev"
+        Determines which GCP configuration to use from config.gcp
+    prod_env : str, default=None
+        If gcp_env = "prod", determines which GCP environment to use from config.gcp.prod
+
+    Returns
+    -------
+    dict
+        The 'id', 'size', 'md5' and 'crc32c' per blob name, see `nl_open_data.utils.list_blob_hashes`
+    """
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
+    hashes = nlu.list_blob_hashes(gcs_folder, gcp)
+    print(
+        f"{len(hashes)} blobs ({sum(h['size'] or 0 for h in hashes.values())} bytes) "
+        f"already in {gcp.bucket}/{gcs_folder}"
+    )
+    return hashes
+
+
+@task(tags=[nle.IO_BOUND])
 def upload_to_gcs(
     to_upload: Union[str, Path],
     local_parent: Path,
@@ -483,15 +1237,31 @@ def upload_to_gcs(
     source: str = None,
     gcp_env: str = "dev",
     prod_env: str = None,
+    partition: str = None,
+    chunk_size: int = nlup.CHUNK_SIZE,
+    composite_threshold: int = nlup.COMPOSITE_THRESHOLD,
+    existing_hashes: Mapping = None,
 ) -> list:
+    """Uploads a file to GCS, keeping its path relative to `local_parent`.
+
+    If a partition ('key=value') is given, the file is uploaded to a Hive partitioned layout
+    instead ('<gcs_folder>/<file stem>/<partition>/...'), so all uploads of the same file can be
+    queried as a single table (see `nlu.create_partitioned_tables`).
+
+    Files are sent as resumable uploads in chunks of `chunk_size`, verified by their CRC32C checksum.
+    Files of at least `composite_threshold` bytes are uploaded as parallel parts, composed in GCS
+    (see `nl_open_data.upload.upload_file`).
+
+    If `existing_hashes` (as returned by `list_blob_hashes`) holds the blob with the same size and
+    CRC32C / MD5 as the file, the upload is skipped, and the id of the existing blob is returned.
+    """
 
     to_upload = Path(to_upload)
 
     # Set GCP params
     gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
     gcs_folder = gcs_folder.rstrip("/")
-    gcs = storage.Client(project=gcp.project_id)
-    gcs_bucket = gcs.get_bucket(gcp.bucket)
+    gcs_bucket = nlu.get_gcs_bucket(gcp)
     # List to return blob ids
     ids = []
     # Upload file(s)
@@ -501,15 +1271,155 @@ def upload_to_gcs(
     #         gcs_blob.upload_from_filename(to_upload / pfile)
     #         ids.append(gcs_blob.id)
     # elif to_upload.is_file():
-    gcs_blob = gcs_bucket.blob(
-        gcs_folder + "/" + str(to_upload.relative_to(local_parent))
+    blob_name = nlu.upload_blob_name(
+        gcs_folder, to_upload.relative_to(local_parent), partition
+    )
+    result = nlup.upload_file(
+        gcs_bucket,
+        to_upload,
+        blob_name,
+        chunk_size=chunk_size,
+        composite_threshold=composite_threshold,
+        existing=(existing_hashes or {}).get(blob_name),
     )
-    gcs_blob.upload_from_filename(to_upload)
-    ids.append(gcs_blob.id)
+    if result.method == "unchanged":
+        prefect.context.get("logger").info(
+            f"Skipped {to_upload}: {blob_name} is unchanged ({result.size} bytes saved)"
+        )
+    else:
+        prefect.context.get("logger").info(
+            f"Uploaded {to_upload} to {blob_name} ({result.method}, {result.size} bytes in "
+            f"{result.seconds:.1f}s, {result.mb_per_second:.1f} MB/s, crc32c={result.crc32c})"
+        )
+    ids.append(result.blob_id)
 
     return ids
 
 
+@task(log_stdout=True)
+def zip_pipeline(
+    urls: list,
+    local_folder: Union[str, Path],
+    gcs_folder: str,
+    config: Box,
+    source: str = None,
+    gcp_env: str = "dev",
+    prod_env: str = None,
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    block_size: int = None,
+    period_column: str = None,
+    partition: str = None,
+    download_threads: int = 4,
+    convert_threads: int = None,
+    upload_threads: int = 8,
+    queue_size: int = 2,
+) -> list:
+    """Downloads, converts and uploads zipped csv files, overlapping the stages of different files.
+
+    Every url moves through a `nl_open_data.pipeline.run_pipeline` on its own: it is downloaded
+    (see `download`), its members are converted (see `zip_csv_to_parquet`) and the parquet files
+    are uploaded (see `upload_to_gcs`), while other urls are in other stages. Conversions run under
+    the memory budget of `nl_open_data.memory`. The schemas are inferred from the first downloaded
+    file, and all files are cast to them (see `infer_csv_schemas`). Files identical to existing
+    blobs are not uploaded again.
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the zip files
+    local_folder : str or Path
+        The folder to download and convert the files in
+    gcs_folder, config, source, gcp_env, prod_env, partition
+        See `upload_to_gcs`
+    delimiter, encoding, block_size, period_column
+        See `zip_csv_to_parquet`
+    download_threads : int, default=4
+        Number of concurrent downloads
+    convert_threads : int, default=None
+        Number of concurrent conversions. If None, the number of cores.
+    upload_threads : int, default=8
+        Number of concurrent uploads
+    queue_size : int, default=2
+        Maximum number of files waiting for the convert and upload stages
+
+    Returns
+    -------
+    list
+        The uploaded blob ids per url (None for urls that failed)
+    """
+    plan = plan_files.run(urls, local_folder)
+    upload_folder = plan["out_folder"]
+    gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
+    gcs_bucket = nlu.get_gcs_bucket(gcp)
+    existing_hashes = nlu.list_blob_hashes(gcs_folder, gcp)
+    cache = nlc.get_cache()
+    schemas = {}
+    schemas_lock = threading.Lock()
+
+    def download_url(url_and_path: tuple) -> Path:
+        url, filepath = url_and_path
+        return nld.download_file(url, filepath, cache=cache).path
+
+    def convert(zipfile: Path) -> list:
+        with schemas_lock:
+            if not schemas:
+                schemas.update(
+                    infer_csv_schemas.run(
+                        [zipfile],
+                        delimiter=delimiter,
+                        encoding=encoding,
+                        block_size=block_size,
+                    )
+                )
+        return zip_csv_to_parquet.run(
+            zipfile,
+            out_folder=upload_folder,
+            delimiter=delimiter,
+            encoding=encoding,
+            block_size=block_size,
+            schemas=schemas,
+            period_column=period_column,
+        )
+
+    def upload(pq_files: list) -> list:
+        ids = []
+        for pq_file in pq_files:
+            blob_name = nlu.upload_blob_name(
+                gcs_folder, pq_file.relative_to(upload_folder), partition
+            )
+            result = nlup.upload_file(
+                gcs_bucket, pq_file, blob_name, existing=existing_hashes.get(blob_name)
+            )
+            ids.append(result.blob_id)
+            os.remove(pq_file)
+        return ids
+
+    results = nlpl.run_pipeline(
+        zip(urls, plan["download"]),
+        [
+            ("download", download_url, download_threads),
+            ("convert", convert, convert_threads or os.cpu_count() or 1),
+            ("upload", upload, upload_threads),
+        ],
+        queue_size=queue_size,
+    )
+    totals = {}
+    for result in results:
+        for stage, seconds in result.seconds.items():
+            totals[stage] = totals.get(stage, 0) + seconds
+        if not result.ok:
+            url = result.item[0]
+            print(f"Failed to {result.failed_stage} {url}: {result.error!r}")
+    print(
+        "Seconds per stage (summed over urls): "
+        + ", ".join(f"{stage} {seconds:.1f}" for stage, seconds in totals.items())
+    )
+    if not any(result.ok for result in results):
+        raise RuntimeError(f"All {len(results)} urls failed")
+    return [result.value for result in results]
+
+
 @task
 def gcs_folder_to_bq(
     gcs_folder: str,
@@ -518,6 +1428,8 @@ def gcs_folder_to_bq(
     source: str = None,
     gcp_env: str = "dev",
     prod_env: str = None,
+    append: bool = False,
+    partitioned: bool = False,
     **kwargs,
 ):
     gcp = nlu.set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
@@ -525,8 +1437,9 @@ def gcs_folder_to_bq(
     # If source was given, use to cunstruct full dataset_id
     dataset_id = f"{source}_{dataset_name}" if source else dataset_name
 
-    # Check if dataset exists and delete if it does TODO: maybe delete anyway (deleting currently uses not_found_ok to ignore error if does not exist)
-    if nlu.check_bq_dataset(dataset_id=dataset_id, gcp=gcp):
+    # Check if dataset exists and delete if it does, unless appending tables to it (i.e. in incremental runs)
+    # TODO: maybe delete anyway (deleting currently uses not_found_ok to ignore error if does not exist)
+    if not append and nlu.check_bq_dataset(dataset_id=dataset_id, gcp=gcp):
         nlu.delete_bq_dataset(dataset_id=dataset_id, gcp=gcp)
 
     # Create dataset and reset dataset_id to new dataset
@@ -541,12 +1454,20 @@ def gcs_folder_to_bq(
     )
 
     # Link parquet files in GCS to tables in BQ dataset
-    tables = nlu.create_linked_tables(uris, gcp, dataset_id)
+    # Partitioned folders are linked as one table per folder, all other files as a table per file
+    # The report holds the created table, timing and error (if any) per table
+    if partitioned:
+        report = nlu.create_partitioned_tables(uris, gcp, dataset_id)
+    else:
+        report = nlu.create_linked_tables(
+            uris, gcp, dataset_id, append=append, gcs_folder=gcs_folder
+        )
+    prefect.context.get("logger").info(f"GCP clients: {nlu.client_stats()}")
     # tables = nlu.link_pq_folder_to_bq_dataset(
     #     gcs_folder=gcs_folder, gcp=gcp, dataset_id=dataset_id
     # )
 
-    return tables
+    return report
 
 
 @task()
@@ -589,6 +1510,7 @@ def create_linked_dataset(
     # Create dataset and reset dataset_id to new dataset
     dataset_id = nlu.create_bq_dataset(name=dataset_name, gcp=gcp, **kwargs)
 
-    tables = nlu.create_linked_tables(gcs_uris, gcp, dataset_id)
+    report = nlu.create_linked_tables(gcs_uris, gcp, dataset_id)
+    tables = [result["table"] for result in report if result["table"] is not None]
 
     return tables
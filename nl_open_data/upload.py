@@ -0,0 +1,279 @@
+"""High-throughput uploads to GCS.
+
+Files are uploaded with resumable, chunked uploads, so a dropped connection only costs the
+current chunk, and every upload is verified by GCS against its CRC32C checksum. Files larger than
+`COMPOSITE_THRESHOLD` are split into parts that are uploaded in parallel as temporary blobs, and
+composed server-side into the final blob, whose CRC32C is then checked against the local file.
+"""
+from typing import Union, Mapping
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import os
+import time
+
+import google_crc32c
+from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+CHUNK_SIZE = 32 * 2 ** 20  # 32 MiB, must be a multiple of 256 KiB
+COMPOSITE_THRESHOLD = 512 * 2 ** 20  # 512 MiB
+PART_SIZE = 128 * 2 ** 20  # 128 MiB
+MAX_COMPOSE_SOURCES = 32  # Maximum number of blobs GCS composes in a single request
+
+
+@dataclass
+class UploadResult:
+    """The outcome of a single upload.
+
+    `method` is either 'resumable', 'composite' or 'unchanged' (if the upload was skipped).
+    """
+
+    blob_name: str
+    blob_id: str
+    size: int
+    seconds: float
+    method: str
+    crc32c: str
+
+    @property
+    def mb_per_second(self) -> float:
+        if not self.seconds or self.method == "unchanged":
+            return 0.0
+        return self.size / 2 ** 20 / self.seconds
+
+
+def file_md5(filepath: Union[str, Path], chunk_size: int = 2 ** 20) -> str:
+    """Returns the MD5 hash of a file, base64 encoded as in GCS blob metadata."""
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode("ascii")
+
+
+def is_unchanged(
+    filepath: Union[str, Path], existing: Mapping, crc32c: str = None
+) -> bool:
+    """Checks whether a local file is identical to an existing blob, by size and CRC32C (or MD5).
+
+    Parameters
+    ----------
+    filepath : str or Path
+        The local file
+    existing : Mapping
+        The 'size', 'crc32c' and/or 'md5' of the blob, as listed by `nl_open_data.utils.list_blob_hashes`.
+        None if there is no blob.
+    crc32c : str, default=None
+        The CRC32C of the file, if already computed
+
+    Returns
+    -------
+    bool
+        True if the blob holds the same bytes as the file
+    """
+    if not existing or existing.get("size") != Path(filepath).stat().st_size:
+        return False
+    if existing.get("crc32c"):
+        return existing["crc32c"] == (crc32c or file_crc32c(filepath))
+    if existing.get("md5"):
+        return existing["md5"] == file_md5(filepath)
+    return False
+
+
+def file_crc32c(filepath: Union[str, Path], chunk_size: int = 2 ** 20) -> str:
+    """Returns the CRC32C checksum of a file, base64 encoded as in GCS blob metadata."""
+    checksum = google_crc32c.Checksum()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+
+class _FileRange:
+    """A read-only file object over a range of a file, to upload a part of it."""
+
+    def __init__(self, filepath: Path, start: int, size: int):
+        self._file = open(filepath, "rb")
+        self._start = start
+        self._size = size
+        self._file.seek(start)
+
+    def read(self, n: int = -1) -> bytes:
+        remaining = self._start + self._size - self._file.tell()
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        return self._file.read(max(n, 0))
+
+    def tell(self) -> int:
+        return self._file.tell() - self._start
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self.tell() + offset
+        else:
+            position = self._size + offset
+        self._file.seek(self._start + min(max(position, 0), self._size))
+        return self.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _upload_part(
+    bucket: storage.Bucket,
+    filepath: Path,
+    blob_name: str,
+    start: int,
+    size: int,
+    chunk_size: int,
+) -> storage.Blob:
+    blob = bucket.blob(blob_name, chunk_size=chunk_size)
+    with _FileRange(filepath, start, size) as part:
+        blob.upload_from_file(part, size=size, checksum="crc32c", retry=DEFAULT_RETRY)
+    return blob
+
+
+def _compose(
+    bucket: storage.Bucket, blob_name: str, parts: list, temporary: list
+) -> storage.Blob:
+    """Composes parts into a blob, in rounds of at most MAX_COMPOSE_SOURCES parts.
+
+    The names of intermediate blobs are added to `temporary`.
+    """
+    level = 0
+    while len(parts) > MAX_COMPOSE_SOURCES:
+        level += 1
+        composed = []
+        for i in range(0, len(parts), MAX_COMPOSE_SOURCES):
+            blob = bucket.blob(f"{blob_name}.parts/compose-{level}-{i}")
+            temporary.append(blob.name)
+            blob.compose(parts[i : i + MAX_COMPOSE_SOURCES], retry=DEFAULT_RETRY)
+            composed.append(blob)
+        parts = composed
+    blob = bucket.blob(blob_name)
+    blob.compose(parts, retry=DEFAULT_RETRY)
+    return blob
+
+
+def _delete_blobs(bucket: storage.Bucket, blob_names: list) -> None:
+    for name in blob_names:
+        try:
+            bucket.blob(name).delete(retry=DEFAULT_RETRY)
+        except NotFound:
+            pass
+
+
+def upload_file(
+    bucket: storage.Bucket,
+    filepath: Union[str, Path],
+    blob_name: str,
+    chunk_size: int = CHUNK_SIZE,
+    composite_threshold: int = COMPOSITE_THRESHOLD,
+    part_size: int = PART_SIZE,
+    max_workers: int = 8,
+    existing: Mapping = None,
+) -> UploadResult:
+    """Uploads a file to a GCS blob, verified by its CRC32C checksum.
+
+    If the checksums of the existing blob are given and match the file, the upload is skipped.
+
+    * Files smaller than `composite_threshold` are uploaded with a single resumable upload,
+      sent in chunks of `chunk_size`, and retried on transient errors.
+    * Larger files are split into parts of `part_size`, which are uploaded in parallel as temporary
+      blobs ('<blob_name>.parts/<n>') and composed into the final blob server-side. The CRC32C of the
+      composed blob is compared to that of the local file, and the temporary blobs are removed.
+
+    Parameters
+    ----------
+    bucket : storage.Bucket
+        The bucket to upload to (i.e. from `nl_open_data.utils.get_gcs_bucket`)
+    filepath : str or Path
+        The file to upload
+    blob_name : str
+        The name of the blob within the bucket
+    chunk_size : int, default=32 MiB
+        Number of bytes sent per request of a resumable upload. Must be a multiple of 256 KiB.
+    composite_threshold : int, default=512 MiB
+        Files of at least this many bytes are uploaded as parallel parts
+    part_size : int, default=128 MiB
+        Number of bytes per part of a composite upload
+    max_workers : int, default=8
+        Maximum number of parts uploaded concurrently
+    existing : Mapping, default=None
+        The 'id', 'size', 'crc32c' and/or 'md5' of the existing blob (i.e. from
+        `nl_open_data.utils.list_blob_hashes`), if any
+
+    Returns
+    -------
+    UploadResult
+        The blob name and id, size, duration, method and checksum of the upload
+
+    Raises
+    ------
+    ValueError
+        If the CRC32C checksum of a composed blob does not match the local file
+    """
+    filepath = Path(filepath)
+    size = filepath.stat().st_size
+    start_time = time.perf_counter()
+    crc32c = file_crc32c(filepath)
+
+    if is_unchanged(filepath, existing, crc32c):
+        return UploadResult(
+            blob_name=blob_name,
+            blob_id=existing.get("id"),
+            size=size,
+            seconds=time.perf_counter() - start_time,
+            method="unchanged",
+            crc32c=crc32c,
+        )
+    if size < composite_threshold:
+        blob = bucket.blob(blob_name, chunk_size=chunk_size)
+        blob.upload_from_filename(str(filepath), checksum="crc32c", retry=DEFAULT_RETRY)
+        method = "resumable"
+    else:
+        ranges = [
+            (start, min(part_size, size - start)) for start in range(0, size, part_size)
+        ]
+        temporary = [f"{blob_name}.parts/{i}" for i in range(len(ranges))]
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                parts = list(
+                    pool.map(
+                        lambda i: _upload_part(
+                            bucket, filepath, temporary[i], *ranges[i], chunk_size
+                        ),
+                        range(len(ranges)),
+                    )
+                )
+            blob = _compose(bucket, blob_name, parts, temporary)
+        finally:
+            _delete_blobs(bucket, temporary)
+        blob.reload()
+        if blob.crc32c != crc32c:
+            blob.delete()
+            raise ValueError(
+                f"CRC32C of composed {blob_name} ({blob.crc32c}) "
+                f"does not match {filepath} ({crc32c})"
+            )
+        method = "composite"
+
+    return UploadResult(
+        blob_name=blob_name,
+        blob_id=blob.id,
+        size=size,
+        seconds=time.perf_counter() - start_time,
+        method=method,
+        crc32c=crc32c,
+    )
@@ -1,11 +1,48 @@
-from typing import Union, List, Mapping, Sequence
+from typing import (
+    Union,
+    List,
+    Mapping,
+    Sequence,
+    BinaryIO,
+    Optional,
+    Callable,
+    Iterable,
+)
 from pathlib import Path
-
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import Counter
+from itertools import islice
+import json
+import os
+import re
+import struct
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+import pyarrow as pa
+from pyarrow import csv
+import pyarrow.parquet as pq
 from google.cloud import storage
 from google.cloud import bigquery
 from google.cloud import exceptions
 import google.api_core.exceptions as google_execptions
 
+import nl_open_data.periods as nlp
+
+# Records per record batch (and row group) in `records_to_parquet`
+RECORDS_PER_BATCH = 100_000
+
+# Hive-style partition folder, i.e. "run_date=2021-06-04"
+PARTITION_PATTERN = re.compile(r"^[^=/]+=[^=/]+$")
+
+# Per-process registry of GCP clients and buckets, see `get_bq_client`
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.RLock()
+_client_stats = Counter()
+
 
 def clean_string(s: str, extra_chars: str = ""):
     """Method to replace various chars with an underscore and remove leading and trailing whitespace
@@ -53,6 +90,449 @@ def create_dir_util(path: Union[Path, str]) -> Path:
         return None
 
 
+def url_filenames(urls: Sequence[str]) -> list:
+    """Returns the decoded file name of every url, numbered where names clash.
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the files
+
+    Returns
+    -------
+    list
+        The file names, in the order of the urls, unique among them
+
+    Examples
+    --------
+    >>> url_filenames(["https://host/2020/data%20set.zip", "https://host/2021/data%20set.zip?v=2"])
+    ['data set.zip', 'data set_1.zip']
+    """
+    filenames = []
+    used = set()
+    for url in urls:
+        filename = unquote(urlsplit(url).path.split("/")[-1])
+        stem, suffix = Path(filename).stem, Path(filename).suffix
+        i = 0
+        while filename in used:
+            i += 1
+            filename = f"{stem}_{i}{suffix}"
+        used.add(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def plan_file(
+    url: str,
+    download_folder: Union[str, Path],
+    out_folder: Union[str, Path],
+    out_suffix: str = ".parquet",
+    filename: str = None,
+) -> dict:
+    """Returns all paths derived from the url of a file to download and convert.
+
+    Parameters
+    ----------
+    url : str
+        The url of the file
+    download_folder : str or Path
+        The folder to download the file into
+    out_folder : str or Path
+        The folder to write the converted file into
+    out_suffix : str, default=".parquet"
+        The suffix of the converted file
+    filename : str, default=None
+        The name of the downloaded file. If None, the decoded name of the file in the url.
+
+    Returns
+    -------
+    dict
+        The 'url', its 'filename', the 'download' path and the 'out_file' path (named after the
+        cleaned stem of the file, see `clean_string`)
+
+    Examples
+    --------
+    >>> plan_file("https://www.cbs.nl/kwb-2019.xls", "/tmp/xls", "/tmp/upload")["out_file"]
+    PosixPath('/tmp/upload/kwb_2019.parquet')
+    """
+    filename = filename or url_filenames([url])[0]
+    return dict(
+        url=url,
+        filename=filename,
+        download=Path(download_folder) / filename,
+        out_file=Path(out_folder) / (clean_string(Path(filename).stem) + out_suffix),
+    )
+
+
+def process_local(key: tuple, factory):
+    """Returns the object registered under key in this process, creating it with factory on first use.
+
+    Used to share clients (GCP clients and buckets, the http session for downloads) between all calls
+    within a process. The registry is reset in forked processes (i.e. Dask worker processes), as clients
+    and their connections can not be shared across processes. Creation and reuse are counted per
+    kind (the first element of key), see `client_stats`.
+
+    Parameters
+    ----------
+    key : tuple
+        The kind of object, followed by everything that identifies it
+    factory : callable
+        Called without arguments to create the object if it is not registered yet
+
+    Returns
+    -------
+    The registered object
+    """
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _client_stats.clear()
+            _clients_pid = os.getpid()
+        if key in _clients:
+            _client_stats[f"{key[0]}_reused"] += 1
+        else:
+            _clients[key] = factory()
+            _client_stats[f"{key[0]}_created"] += 1
+        return _clients[key]
+
+
+def _gcp_key(gcp: Mapping) -> tuple:
+    """Identifies a GCP environment, as returned by `set_gcp`, by all of its settings."""
+    if gcp is None:
+        return (None, None, None)
+    return (gcp.get("project_id"), gcp.get("bucket"), gcp.get("location"))
+
+
+def get_bq_client(gcp: Mapping = None) -> bigquery.Client:
+    """Returns the BigQuery client of a GCP environment, shared by all calls within this process.
+
+    Parameters
+    ----------
+    gcp : Box, default=None
+        A Box object, holding GCP project parameters, as returned by `set_gcp`. If None, the
+        default project of the environment's credentials is used.
+
+    Returns
+    -------
+    bigquery.Client
+    """
+    project = gcp.project_id if gcp else None
+    location = gcp.get("location") if gcp else None
+    return process_local(
+        ("bigquery",) + _gcp_key(gcp),
+        lambda: bigquery.Client(project=project, location=location),
+    )
+
+
+def get_gcs_client(gcp: Mapping) -> storage.Client:
+    """Returns the storage client of a GCP environment, shared by all calls within this process.
+
+    Parameters
+    ----------
+    gcp : Box
+        A Box object, holding GCP project parameters, as returned by `set_gcp`
+
+    Returns
+    -------
+    storage.Client
+    """
+    return process_local(
+        ("storage",) + _gcp_key(gcp), lambda: storage.Client(project=gcp.project_id)
+    )
+
+
+def get_gcs_bucket(gcp: Mapping) -> storage.Bucket:
+    """Returns the bucket of a GCP environment, shared by all calls within this process.
+
+    The bucket's metadata is fetched once per process, instead of once for every uploaded file.
+
+    Parameters
+    ----------
+    gcp : Box
+        A Box object, holding GCP project parameters, as returned by `set_gcp`
+
+    Returns
+    -------
+    storage.Bucket
+    """
+    return process_local(
+        ("bucket",) + _gcp_key(gcp),
+        lambda: get_gcs_client(gcp).get_bucket(gcp.bucket),
+    )
+
+
+def client_stats() -> dict:
+    """Returns how many clients (per kind) were created and reused by this process.
+
+    Returns
+    -------
+    dict
+        Counts per kind, i.e. {"bigquery_created": 1, "bigquery_reused": 12, "bucket_created": 1, ...},
+        and the id of the process
+    """
+    with _clients_lock:
+        return dict(_client_stats, pid=os.getpid())
+
+
+# Conversion errors of pyarrow's csv reader, i.e. "In CSV column #0: Row #300002: CSV conversion error to int64: ..."
+CSV_CONVERSION_ERROR = re.compile(r"CSV column #(\d+).*CSV conversion error")
+
+
+def _rewind(source: Union[str, Path, BinaryIO]) -> bool:
+    """Prepares a csv source to be read again from the start, returning whether that is possible."""
+    if isinstance(source, (str, Path)):
+        return True
+    if getattr(source, "seekable", lambda: False)():
+        source.seek(0)
+        return True
+    return False
+
+
+def _stream_csv(
+    source: Union[str, Path, BinaryIO],
+    consume,
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    block_size: int = None,
+    column_types: Mapping = None,
+) -> pa.Schema:
+    """Streams a csv through `consume(reader)`, falling back to string for columns that fail to convert.
+
+    pyarrow infers the type of every column from the first block of the csv only. If a later block holds
+    a value that does not fit that type (i.e. 'foo' after a million rows of integers), the column is
+    widened (integers to float, anything else to string) and the csv is read again from the start.
+
+    Returns
+    -------
+    schema: pyarrow.Schema
+        The schema the whole csv was read with
+    """
+    column_types = dict(column_types or {})
+    read_options = csv.ReadOptions(encoding=encoding)
+    if block_size:
+        read_options.block_size = block_size
+    while True:
+        reader = csv.open_csv(
+            source,
+            read_options=read_options,
+            parse_options=csv.ParseOptions(delimiter=delimiter),
+            convert_options=csv.ConvertOptions(column_types=column_types),
+        )
+        try:
+            consume(reader)
+            return reader.schema
+        except pa.ArrowInvalid as error:
+            match = CSV_CONVERSION_ERROR.search(str(error))
+            if not match:
+                raise
+            field = reader.schema.field(int(match.group(1)))
+            if pa.types.is_string(field.type) or not _rewind(source):
+                raise
+            # Integers are widened to floats first, anything else is read as string
+            wider = pa.float64() if pa.types.is_integer(field.type) else pa.string()
+            print(
+                f"Column '{field.name}' does not fit the {field.type} type inferred from the start "
+                f"of the csv ({error}), reading it as {wider} instead"
+            )
+            column_types[field.name] = wider
+
+
+def infer_csv_schema(
+    source: Union[str, Path, BinaryIO],
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    sample_size: int = None,
+    block_size: int = None,
+) -> pa.Schema:
+    """Infers the schema of a csv file or stream.
+
+    By default, the whole csv is scanned (one block at a time, without keeping any data), so the
+    schema fits every value in it: columns holding values that do not fit the type inferred from
+    their first block are widened to float (if integer) or string. Columns that are empty throughout are typed as string
+    as well, so that values appearing in other files sharing this schema can still be read.
+
+    Parameters
+    ----------
+    source : str, Path or file-like object
+        The csv file, or an open, seekable binary stream (i.e. a member of a ZipFile)
+    delimiter : str, default=","
+        The delimiter used in the csv
+    encoding : str, default="utf-8"
+        The encoding of the csv
+    sample_size : int, default=None
+        If given, the schema is inferred from only this many bytes at the start of the csv,
+        instead of from the whole csv.
+    block_size : int, default=None
+        Number of bytes to scan per block. If None, pyarrow's default is used.
+
+    Returns
+    -------
+    schema: pyarrow.Schema
+        The inferred schema
+    """
+    if sample_size:
+        read_options = csv.ReadOptions(encoding=encoding, block_size=sample_size)
+        schema = csv.open_csv(
+            source,
+            read_options=read_options,
+            parse_options=csv.ParseOptions(delimiter=delimiter),
+        ).schema
+    else:
+
+        def scan(reader):
+            for _ in reader:
+                pass
+
+        schema = _stream_csv(
+            source, scan, delimiter=delimiter, encoding=encoding, block_size=block_size
+        )
+    return pa.schema(
+        [
+            field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+            for field in schema
+        ]
+    )
+
+
+def csv_stream_to_parquet(
+    source: Union[str, Path, BinaryIO],
+    out_file: Union[str, Path],
+    delimiter: str = ",",
+    encoding: str = "utf-8",
+    block_size: int = None,
+    schema: pa.Schema = None,
+    period_column: str = None,
+) -> Path:
+    """Converts a csv file or stream to a parquet file, one record batch at a time.
+
+    The csv is read incrementally with `pyarrow.csv.open_csv`, and every batch is
+    written as a separate row group, so peak memory is bounded by `block_size`
+    rather than by the size of the csv. Columns holding values that do not fit their
+    type (either from the schema, or inferred from the first batch) are widened to float
+    (if integer) or string.
+
+    Parameters
+    ----------
+    source : str, Path or file-like object
+        The csv file, or an open, seekable binary stream (i.e. a member of a ZipFile)
+    out_file : str or Path
+        The parquet file to write
+    delimiter : str, default=","
+        The delimiter used in the csv
+    encoding : str, default="utf-8"
+        The encoding of the csv
+    block_size : int, default=None
+        Number of bytes of csv to process per batch. If None, pyarrow's default is used.
+    schema : pyarrow.Schema, default=None
+        Data types to read the columns as (i.e. as returned by `infer_csv_schema`).
+        Columns not in the schema are inferred from the first batch.
+    period_column : str, default=None
+        The name of a column of CBS period codes (i.e. 'Perioden'), to add its decoded `jaar`,
+        `periode_start` and `periode_type` columns (see `nl_open_data.periods.add_period_columns`)
+
+    Returns
+    -------
+    out_file: Path
+        The path to the written parquet file
+    """
+    out_file = Path(out_file)
+
+    def transform(table):
+        if period_column:
+            return nlp.add_period_columns(table, period_column)
+        return table
+
+    def write(reader):
+        schema = transform(reader.schema.empty_table()).schema
+        with pq.ParquetWriter(out_file, schema) as writer:
+            for batch in reader:
+                writer.write_table(transform(pa.Table.from_batches([batch])))
+
+    _stream_csv(
+        source,
+        write,
+        delimiter=delimiter,
+        encoding=encoding,
+        block_size=block_size,
+        column_types={field.name: field.type for field in schema} if schema else None,
+    )
+    return out_file
+
+
+def _chunks(items: Iterable, size: int) -> Iterable[list]:
+    """Yields lists of `size` items (the last one possibly shorter) of an iterable."""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def records_to_parquet(
+    records: Union[Iterable[Mapping], pa.Table],
+    out_file: Union[str, Path],
+    schema: pa.Schema = None,
+    batch_size: int = RECORDS_PER_BATCH,
+) -> Path:
+    """Writes records (i.e. the json of an OData collection) to a parquet file, one batch at a time.
+
+    The records are turned into Arrow record batches of `batch_size` records directly, without a
+    DataFrame in between, and every batch is written as a separate row group, so peak memory is
+    bounded by `batch_size` rather than by the number of records (if given as an iterator).
+
+    Parameters
+    ----------
+    records : iterable of dict or pyarrow.Table
+        The records to write
+    out_file : str or Path
+        The parquet file to write
+    schema : pyarrow.Schema, default=None
+        The schema of the records. Fields missing from a record are null, and fields missing from
+        the schema are dropped. If None, the schema is inferred from the first batch (with empty
+        columns typed as string), and all later batches are read with it.
+    batch_size : int, default=RECORDS_PER_BATCH
+        Number of records per batch
+
+    Returns
+    -------
+    out_file: Path
+        The path to the written parquet file
+    """
+    out_file = Path(out_file)
+    if isinstance(records, pa.Table):
+        if schema is not None:
+            records = records.select(schema.names).cast(schema)
+        chunks = records.to_batches(max_chunksize=batch_size)
+    else:
+        chunks = _chunks(records, batch_size)
+    writer = None
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, pa.RecordBatch):
+                batch = chunk
+            else:
+                batch = pa.RecordBatch.from_pylist(chunk, schema=schema)
+            if writer is None:
+                schema = schema or pa.schema(
+                    [
+                        field.with_type(pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                        for field in batch.schema
+                    ]
+                )
+                writer = pq.ParquetWriter(out_file, schema)
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        if writer is None:  # No records: an empty file with the schema, if any
+            pq.write_table((schema or pa.schema([])).empty_table(), out_file)
+    finally:
+        if writer is not None:
+            writer.close()
+    return out_file
+
+
 def set_gcp(
     config: Mapping, gcp_env: str, source: str = None, prod_env: str = None
 ) -> Mapping:
@@ -123,7 +603,7 @@ def check_bq_dataset(dataset_id: str, gcp: Mapping) -> bool:
         - True if exists, False if does not exists
     """
 
-    client = bigquery.Client(project=gcp.project_id)
+    client = get_bq_client(gcp)
 
     try:
         client.get_dataset(dataset_id)  # Make an API request.
@@ -149,8 +629,8 @@ def delete_bq_dataset(dataset_id: str, gcp: Mapping) -> None:
         None
     """
 
-    # Construct a bq client
-    client = bigquery.Client(project=gcp.project_id)
+    # Get the shared bq client
+    client = get_bq_client(gcp)
 
     # Delete the dataset and its contents
     client.delete_dataset(dataset_id, delete_contents=True, not_found_ok=True)
@@ -180,8 +660,8 @@ def create_bq_dataset(
         The id of the created BQ dataset
     """
 
-    # Construct a BigQuery client object.
-    client = bigquery.Client(project=gcp.project_id)
+    # Get the shared BigQuery client object.
+    client = get_bq_client(gcp)
 
     # Set dataset_id to the ID of the dataset to create.
     if source:
@@ -213,12 +693,12 @@ def create_bq_dataset(
 def link_pq_folder_to_bq_dataset(gcs_folder: str, gcp: Mapping, dataset_id: str):
 
     # Get blobs within gcs_folder
-    storage_client = storage.Client(project=gcp.project_id)
+    storage_client = get_gcs_client(gcp)
     blobs = storage_client.list_blobs(gcp.bucket, prefix=gcs_folder)
     names = [blob.name for blob in blobs]
 
-    # Initialize client
-    bq_client = bigquery.Client(project=gcp.project_id)
+    # Get the shared client
+    bq_client = get_bq_client(gcp)
 
     # Configure the external data source
     dataset_ref = bigquery.DatasetReference(gcp.project_id, dataset_id)
@@ -269,68 +749,595 @@ def get_gcs_uris(
         List of gs uris to all blobs with the gcs_folder prefix
     """
     gcp = set_gcp(config=config, gcp_env=gcp_env, source=source, prod_env=prod_env)
-    client = storage.Client(project=gcp.project_id)
+    client = get_gcs_client(gcp)
     blobs = client.list_blobs(gcp.bucket, prefix=gcs_folder)
     uris = ["gs://" + gcp.bucket + "/" + blob.name for blob in blobs]
     return uris
 
 
-def create_linked_tables(source_uris: List[str], gcp: Mapping, dataset_id: str):
+def list_blob_hashes(gcs_folder: str, gcp: Mapping) -> dict:
+    """Lists the checksums of all blobs in a GCS folder, in a single (paged) listing request.
+
+    Parameters
+    ----------
+    gcs_folder : str
+        The folder (prefix) in the bucket of the GCP environment
+    gcp : Box
+        A Box object, holding GCP project parameters
+
+    Returns
+    -------
+    dict
+        Per blob name, its 'id', 'size', 'md5' and 'crc32c' (base64 encoded, as in the blob metadata).
+        Composite blobs have no md5.
+    """
+    client = get_gcs_client(gcp)
+    blobs = client.list_blobs(
+        gcp.bucket,
+        prefix=gcs_folder.rstrip("/") + "/",
+        fields="items(id,name,size,md5Hash,crc32c),nextPageToken",
+    )
+    return {
+        blob.name: dict(
+            id=blob.id, size=blob.size, md5=blob.md5_hash, crc32c=blob.crc32c
+        )
+        for blob in blobs
+    }
+
+
+def read_gcs_json(blob_name: str, gcp: Mapping) -> Optional[dict]:
+    """Reads a json blob from the GCS bucket of a GCP environment.
+
+    Parameters
+    ----------
+    blob_name : str
+        The name of the blob within the bucket
+    gcp : Box
+        A Box object, holding GCP project parameters
+
+    Returns
+    -------
+    dict or None
+        The parsed json, or None if the blob does not exist
+    """
+    blob = get_gcs_client(gcp).bucket(gcp.bucket).blob(blob_name)
+    try:
+        return json.loads(blob.download_as_bytes())
+    except exceptions.NotFound:
+        return None
+
+
+def write_gcs_json(obj: Mapping, blob_name: str, gcp: Mapping) -> str:
+    """Writes an object as a json blob to the GCS bucket of a GCP environment.
+
+    Parameters
+    ----------
+    obj : Mapping
+        A json serializable object
+    blob_name : str
+        The name of the blob within the bucket
+    gcp : Box
+        A Box object, holding GCP project parameters
+
+    Returns
+    -------
+    str
+        The id of the written blob
+    """
+    blob = get_gcs_client(gcp).bucket(gcp.bucket).blob(blob_name)
+    blob.upload_from_string(
+        json.dumps(obj, indent=2, default=str), content_type="application/json"
+    )
+    return blob.id
+
+
+def unique_table_ids(source_uris: List[str], gcs_folder: str = None) -> list:
+    """Returns a table id for every uri, named after its file, and unique among the uris.
+
+    Files with the same name in different folders (i.e. the same csv member of different zip
+    files) are named after their file and as many of their parent folders as needed to tell
+    them apart, so the same uris always get the same table ids.
+
+    Parameters
+    ----------
+    source_uris : List[str]
+        gs uris, i.e. as returned by `get_gcs_uris`
+    gcs_folder : str, default=None
+        If given, the folder in the bucket holding all uris. The first folder below it (i.e. the
+        folder of a zip file or run) is then always included, to keep ids unique with tables
+        linked in previous runs, when appending to a dataset.
+
+    Returns
+    -------
+    list
+        The table ids, in the order of the uris
+
+    Raises
+    ------
+    ValueError
+        If a uri is given more than once, or is not in `gcs_folder`
+
+    Examples
+    --------
+    >>> unique_table_ids(["gs://b/uwv/a/vacatures.parquet", "gs://b/uwv/b/vacatures.parquet", "gs://b/uwv/a/cvs.parquet"])
+    ['a_vacatures', 'b_vacatures', 'cvs']
+    >>> unique_table_ids(["gs://b/uwv/a/data/pak/bon.parquet"], gcs_folder="uwv")
+    ['a_bon']
+    """
+    duplicates = {uri for uri, n in Counter(source_uris).items() if n > 1}
+    if duplicates:
+        raise ValueError(f"Uris given more than once: {sorted(duplicates)}")
+    root = [part for part in (gcs_folder or "").split("/") if part]
+    # The path of every uri (within its bucket or `gcs_folder`), with the suffix removed from the
+    # file name, split in the folder always named (head) and the rest (tail)
+    heads, tails = {}, {}
+    for uri in source_uris:
+        path = uri.split("/")[3:-1] + [uri.split("/")[-1].split(".")[-2]]
+        if gcs_folder is not None:
+            if path[: len(root)] != root:
+                raise ValueError(f"{uri} is not in {gcs_folder}")
+            path = path[len(root) :]
+        if gcs_folder is not None and len(path) > 1:
+            heads[uri], tails[uri] = path[:1], path[1:]
+        else:
+            heads[uri], tails[uri] = [], path
+    depths = {uri: 1 for uri in source_uris}
+    while True:
+        ids = {
+            uri: clean_string("_".join(heads[uri] + tails[uri][-depths[uri] :]))
+            for uri in source_uris
+        }
+        counts = Counter(ids.values())
+        clashing = [uri for uri in source_uris if counts[ids[uri]] > 1]
+        if not clashing:
+            return [ids[uri] for uri in source_uris]
+        for uri in clashing:
+            if depths[uri] == len(tails[uri]):
+                raise ValueError(f"Can not name {uri} apart from {clashing}")
+            depths[uri] += 1
+
+
+def _external_table(
+    dataset_ref: bigquery.DatasetReference, uri: str, table_id: str = None
+) -> bigquery.Table:
+    """Configures an external table linked to a single parquet or json file in GCS.
+
+    If no table_id is given, the table is named after the file.
+    """
+    table_id, suffix = (
+        table_id or uri.split("/")[-1].split(".")[-2],
+        uri.split("/")[-1].split(".")[-1],
+    )
+    table = bigquery.Table(dataset_ref.table(table_id))
+    if suffix == "parquet":
+        external_config = bigquery.ExternalConfig("PARQUET")
+    elif suffix == "json":
+        external_config = bigquery.ExternalConfig("NEWLINE_DELIMITED_JSON")
+        external_config.autodetect = True
+    else:
+        raise TypeError(
+            "Only json or parquet files are supported, file suffix is neither"
+        )
+    external_config.source_uris = [uri]
+    table.external_data_configuration = external_config
+    return table
+
+
+def _create_table(
+    bq_client: bigquery.Client, table: bigquery.Table, uri: str, replace: bool = False
+) -> dict:
+    """Creates a single table, returning the result, duration and error (if any) instead of raising."""
+    start = time.perf_counter()
+    table_id = table.table_id
+    try:
+        if replace:
+            bq_client.delete_table(table.reference, not_found_ok=True)
+        table = bq_client.create_table(table, exists_ok=True)
+        error = None
+    except Exception as e:
+        table, error = None, e
+    return dict(
+        uri=uri,
+        table_id=table_id,
+        table=table,
+        seconds=time.perf_counter() - start,
+        error=error,
+    )
+
+
+def create_tables_concurrently(
+    tables: Sequence,
+    bq_client: bigquery.Client,
+    max_workers: int = 16,
+    replace: bool = False,
+) -> list:
+    """Creates BQ tables through a bounded thread pool, and reports per-table timing and failures.
+
+    Tables whose source uris are not found are reported and skipped. Any other error is
+    raised once all tables have been attempted.
+
+    Parameters
+    ----------
+    tables : Sequence of (uri, bigquery.Table) tuples
+        The tables to create, each with the uri it is reported by
+    bq_client : bigquery.Client
+        The client to create all tables with
+    max_workers : int, default=16
+        The maximum number of concurrent create_table requests
+    replace : bool, default=False
+        Whether to replace existing tables with the same id. If False, existing tables are kept.
+
+    Returns
+    -------
+    report: list of dict
+        Per table, in the order they were given: its 'uri', 'table_id', the created 'table'
+        (None if it failed), the 'seconds' it took and the 'error' (None if it succeeded)
+
+    Raises
+    ------
+    ValueError
+        If several tables share a table id, as which of them would be linked depends on
+        which request finishes first
+    """
+    counts = Counter(table.table_id for _, table in tables)
+    duplicates = sorted(table_id for table_id, n in counts.items() if n > 1)
+    if duplicates:
+        raise ValueError(f"Several tables would be named {duplicates}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(
+            pool.map(
+                lambda item: _create_table(bq_client, item[1], item[0], replace),
+                tables,
+            )
+        )
+    created = [result["table"] for result in results if result["error"] is None]
+    failed = [result for result in results if result["error"] is not None]
+
+    for result in results:
+        status = "failed" if result["error"] is not None else "linked"
+        print(f"{status} {result['uri']} in {result['seconds']:.2f}s")
+    for result in failed:
+        if isinstance(result["error"], google_execptions.NotFound):
+            # TODO: Better handling?
+            print(f"URI {result['uri']} Not found")
+        else:
+            print(f"URI {result['uri']} failed: {result['error']!r}")
+    print(
+        f"Created {len(created)} of {len(results)} tables in "
+        f"{time.perf_counter() - start:.2f}s ({len(failed)} failed)"
+    )
+    for result in failed:
+        if not isinstance(result["error"], google_execptions.NotFound):
+            raise result["error"]
+    return results
+
+
+def create_linked_tables(
+    source_uris: List[str],
+    gcp: Mapping,
+    dataset_id: str,
+    bq_client: bigquery.Client = None,
+    max_workers: int = 16,
+    append: bool = False,
+    gcs_folder: str = None,
+) -> list:
     """Takes a list of GCS uris and creates a linked table per uri nested under the given dataset_id
 
+    Tables are named after their files, qualified by their folders where file names clash (see
+    `unique_table_ids`). The tables are created concurrently with a single client, see
+    `create_tables_concurrently`.
+
     Parameters
     ----------
     source_uris : List[str]
-        [description]
+        The gs uris of the parquet or (newline delimited) json files to link
     gcp : Box
-        [description]
+        A Box object, holding GCP project parameters
     dataset_id : str
-        [description]
+        The id of the dataset to create the tables in
+    bq_client : bigquery.Client, default=None
+        The client to use. If None, the shared client of the gcp project is used.
+    max_workers : int, default=16
+        The maximum number of concurrent create_table requests
+    append : bool, default=False
+        Whether the tables are added to a dataset holding tables of previous runs. If True, tables
+        are always named after the first folder below `gcs_folder` as well (i.e. '<zip name>_<csv
+        name>'), so they do not clash with tables of files with the same name from previous runs,
+        and existing tables with the same id (i.e. of a file that was uploaded again) are replaced.
+    gcs_folder : str, default=None
+        The folder in the bucket holding the uris, required if `append`
 
     Returns
     -------
-    [type]
-        [description]
+    report: list of dict
+        The created table, timing and error per uri, see `create_tables_concurrently`
     """
+    if append and gcs_folder is None:
+        raise ValueError("The gcs_folder of the uris is needed to append tables")
 
-    # Initialize client
-    bq_client = bigquery.Client(project=gcp.project_id)
+    # Get the shared client
+    if bq_client is None:
+        bq_client = get_bq_client(gcp)
 
     # Initialize the external data source
     dataset_ref = bigquery.DatasetReference(gcp.project_id, dataset_id)
-    tables = []
+    table_ids = unique_table_ids(source_uris, gcs_folder=gcs_folder if append else None)
+    tables = [
+        (uri, _external_table(dataset_ref, uri, table_id))
+        for uri, table_id in zip(source_uris, table_ids)
+    ]
+
+    return create_tables_concurrently(
+        tables, bq_client, max_workers=max_workers, replace=append
+    )
+
+
+def partitioned_blob_name(
+    gcs_folder: str, relative_path: Union[str, Path], partition: str
+) -> str:
+    """Returns a Hive-style partitioned blob name for a file to upload.
+
+    Files with the same name (i.e. the same csv member in different zip files) end up in the same
+    table folder, in which every upload gets its own partition folder. The folders the file was
+    nested in locally become its name within the partition.
+
+    Parameters
+    ----------
+    gcs_folder : str
+        The folder in the bucket holding all tables
+    relative_path : str or Path
+        The path of the file, relative to the local folder being uploaded
+    partition : str
+        The partition folder, formatted as '<key>=<value>' (i.e. 'run_date=2021-06-04')
+
+    Returns
+    -------
+    str
+        The blob name, i.e. '<gcs_folder>/<file stem>/<partition>/<parent folders><suffix>'
+
+    Examples
+    --------
+    >>> partitioned_blob_name("uwv/open_match_data", "UWVopenmatch_20191126/vacatures.parquet", "run_date=2021-06-04")
+    'uwv/open_match_data/vacatures/run_date=2021-06-04/UWVopenmatch_20191126.parquet'
+    """
+    relative_path = Path(relative_path)
+    if not PARTITION_PATTERN.match(partition):
+        raise ValueError(f"Partition must be formatted as 'key=value', not {partition}")
+    filename = "_".join(relative_path.parent.parts) or relative_path.stem
+    return "/".join(
+        [
+            gcs_folder.rstrip("/"),
+            relative_path.stem,
+            partition,
+            filename + relative_path.suffix,
+        ]
+    )
+
+
+def upload_blob_name(
+    gcs_folder: str, relative_path: Union[str, Path], partition: str = None
+) -> str:
+    """Returns the blob name to upload a file to, keeping its path relative to the uploaded folder.
+
+    If a partition is given, the blob name is Hive partitioned, see `partitioned_blob_name`.
+    """
+    if partition:
+        return partitioned_blob_name(gcs_folder, relative_path, partition)
+    return gcs_folder.rstrip("/") + "/" + str(relative_path)
+
+
+def group_partitioned_uris(source_uris: List[str]) -> dict:
+    """Groups uris by the table folder preceding their first Hive-style ('key=value') partition folder.
+
+    Uris without a partition folder each form their own group, keyed by the uri itself.
+
+    Parameters
+    ----------
+    source_uris : List[str]
+        gs uris, i.e. as returned by `get_gcs_uris`
+
+    Returns
+    -------
+    dict
+        The uris, keyed by their table folder uri (or their own uri if not partitioned)
+    """
+    groups = {}
     for uri in source_uris:
-        table_id, suffix = (
-            uri.split("/")[-1].split(".")[-2],
-            uri.split("/")[-1].split(".")[-1],
+        parts = uri.split("/")
+        partition_idx = next(
+            (i for i, part in enumerate(parts[3:-1], 3) if PARTITION_PATTERN.match(part)),
+            None,
         )
-        table = bigquery.Table(dataset_ref.table(table_id))
+        prefix = "/".join(parts[:partition_idx]) if partition_idx else uri
+        groups.setdefault(prefix, []).append(uri)
+    return groups
+
+
+def read_gcs_parquet_schema(uri: str, gcp: Mapping) -> pa.Schema:
+    """Reads the schema of a parquet file in GCS from its footer, without downloading the whole file.
+
+    Parameters
+    ----------
+    uri : str
+        The gs uri of the parquet file
+    gcp : Box
+        A Box object, holding GCP project parameters
+
+    Returns
+    -------
+    schema: pyarrow.Schema
+        The schema of the parquet file
+    """
+    bucket, name = uri[len("gs://") :].split("/", 1)
+    blob = get_gcs_client(gcp).bucket(bucket).get_blob(name)
+    # A parquet file ends with its footer, the footer length (4 bytes) and b"PAR1"
+    tail = blob.download_as_bytes(start=blob.size - 8)
+    footer_length = struct.unpack("<I", tail[:4])[0]
+    footer = blob.download_as_bytes(start=blob.size - 8 - footer_length)
+    return pq.read_schema(pa.BufferReader(b"PAR1" + footer))
+
+
+def _split_partitions_by_schema(
+    uris: List[str], read_schema: Callable, max_workers: int = 16
+) -> list:
+    """Groups the partition folders of a partitioned table by the schema of their (first) file.
+
+    Returns
+    -------
+    list
+        Lists of partition folder uris sharing a schema, the one of the earliest partition first
+    """
+    partitions = {}
+    for uri in sorted(uris):
+        partitions.setdefault(uri.rsplit("/", 1)[0], uri)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        schemas = list(pool.map(read_schema, partitions.values()))
+    variants = []
+    for partition, schema in zip(partitions, schemas):
+        schema = schema.remove_metadata()
+        for variant_schema, variant in variants:
+            if variant_schema.equals(schema):
+                variant.append(partition)
+                break
+        else:
+            variants.append((schema, [partition]))
+    return [variant for _, variant in variants]
+
+
+def create_partitioned_tables(
+    source_uris: List[str],
+    gcp: Mapping,
+    dataset_id: str,
+    require_partition_filter: bool = False,
+    bq_client: bigquery.Client = None,
+    max_workers: int = 16,
+    read_schema: Callable = None,
+) -> list:
+    """Creates a single external table per group of Hive partitioned files, instead of one table per file.
+
+    Files are grouped by `group_partitioned_uris`. Every group with partition folders becomes one table,
+    named after its table folder, that links to all of its files with a wildcard uri. The partition keys
+    are exposed as columns (with their types detected from their values), so queries filtering on them
+    only scan the matching partitions. Files that are not partitioned are linked as a table per file,
+    as in `create_linked_tables`.
+
+    The partitions of a group of parquet files are only linked as a single table if they share a schema
+    (compared on the first file of each partition), as BigQuery can not query the table otherwise. If
+    types changed between runs (i.e. a column inferred as int64 in one run and as string in another),
+    the group is split: the partitions sharing the schema of the earliest partition keep the table
+    name, the others are linked as '<name>_v2', '<name>_v3', etc. Split tables list their partition
+    folders instead of a single wildcard uri, so existing tables are replaced to include new partitions.
+
+    Parameters
+    ----------
+    source_uris : List[str]
+        The gs uris of the parquet or (newline delimited) json files to link
+    gcp : Box
+        A Box object, holding GCP project parameters
+    dataset_id : str
+        The id of the dataset to create the tables in
+    require_partition_filter : bool, default=False
+        Whether queries on the partitioned tables must filter on a partition key
+    bq_client : bigquery.Client, default=None
+        The client to use. If None, the shared client of the gcp project is used.
+    max_workers : int, default=16
+        The maximum number of concurrent create_table (and schema) requests
+    read_schema : callable, default=None
+        Called with the uri of a parquet file to get its schema. If None, `read_gcs_parquet_schema` is used.
+
+    Returns
+    -------
+    report: list of dict
+        The created table, timing and error per table, see `create_tables_concurrently`
+    """
+    if bq_client is None:
+        bq_client = get_bq_client(gcp)
+    if read_schema is None:
+        read_schema = partial(read_gcs_parquet_schema, gcp=gcp)
+    dataset_ref = bigquery.DatasetReference(gcp.project_id, dataset_id)
+
+    groups = group_partitioned_uris(source_uris)
+    # Partitioned tables are named after their table folder
+    table_uris = {
+        prefix: prefix if prefix == uris[0] else f"{prefix}.{uris[0].split('.')[-1]}"
+        for prefix, uris in groups.items()
+    }
+    table_ids = dict(zip(groups, unique_table_ids(list(table_uris.values()))))
+
+    tables = []
+    for prefix, uris in groups.items():
+        if prefix == uris[0]:
+            tables.append(
+                (prefix, _external_table(dataset_ref, prefix, table_ids[prefix]))
+            )
+            continue
+        suffix = uris[0].split(".")[-1]
         if suffix == "parquet":
-            external_config = bigquery.ExternalConfig("PARQUET")
-        elif suffix == "json":
-            external_config = bigquery.ExternalConfig("NEWLINE_DELIMITED_JSON")
-            external_config.autodetect = True
+            variants = _split_partitions_by_schema(uris, read_schema, max_workers)
         else:
-            raise TypeError(
-                "Only json or parquet files are supported, file suffix is neither"
+            variants = [None]
+        if len(variants) > 1:
+            print(
+                f"Partitions of {prefix} have {len(variants)} different schemas, "
+                f"linking them as {len(variants)} tables"
             )
-        external_config.source_uris = [uri]
-        table.external_data_configuration = external_config
-        try:
-            table = bq_client.create_table(table, exists_ok=True)
-            tables.append(table)
-        except google_execptions.NotFound:
-            # TODO: Better handling?
-            print(f"URI {uri} Not found")
-            pass
+        for i, partitions in enumerate(variants):
+            table_id = table_ids[prefix] + (f"_v{i + 1}" if i else "")
+            if len(variants) == 1:
+                wildcard_uris = [f"{prefix}/*.{suffix}"]
+            else:
+                wildcard_uris = [f"{partition}/*.{suffix}" for partition in partitions]
+            table = _external_table(dataset_ref, table_uris[prefix], table_id)
+            external_config = table.external_data_configuration
+            external_config.source_uris = wildcard_uris
+            hive_partitioning = bigquery.external_config.HivePartitioningOptions()
+            hive_partitioning.mode = "AUTO"
+            hive_partitioning.source_uri_prefix = prefix + "/"
+            hive_partitioning.require_partition_filter = require_partition_filter
+            external_config.hive_partitioning = hive_partitioning
+            table.external_data_configuration = external_config
+            tables.append((wildcard_uris[0], table))
 
-    return tables
+    return create_tables_concurrently(
+        tables, bq_client, max_workers=max_workers, replace=True
+    )
+
+
+def query_catalog_tables(third_party: bool = False, odata_version: str = "v3") -> list:
+    """Queries all datasets of a CBS catalog in BigQuery, as loaded by the 'statline-catalogs' flow.
+
+    Parameters
+    ----------
+    third_party : bool, default=False
+        Flag to indicate whether to query core or external catatlog
+    odata_version : str, default="v3"
+        version of the odata for this dataset - must be either "v3" or "v4"
+
+    Returns
+    -------
+    list of dict
+        The `Identifier`, `Catalog`, `Modified`, `RecordCount` and `ColumnCount` of every dataset
+    """
+    # NOTE:
+    # CBS provides both 'Catalog' and 'Source' fields. Both provide mostly similar, but not identical information.
+    # 'Catalog' seems more strictly defined and additionally 'Source' is not present in the v4 catalog,
+    # so we choose to use 'Catalog' for now, but that could change.
+    catalog = "external" if third_party else "cbs"
+    query = f"""
+        SELECT `Identifier`, `Catalog`, `Modified`, `RecordCount`, `ColumnCount`
+        FROM `dataverbinders-open-dwh.catalogs.{catalog}_{odata_version}`
+    """
+    return [dict(row.items()) for row in get_bq_client().query(query)]
 
 
 def query_cbs_catalogs(
     third_party: bool = False, odata_version: str = "v3", source: str = None
 ) -> dict:
-    """Queries dataset ids from CBS catalog and returns a dict with source name as key a list of all related dataset ids as value
+    """Returns a dict with source name as key a list of all related dataset ids as value
+
+    The ids are read from the local catalog index (see `nl_open_data.catalog.CatalogIndex`),
+    which is refreshed from the catalogs in BigQuery only if it is stale.
 
     Parameters
     ----------
@@ -339,56 +1346,52 @@ def query_cbs_catalogs(
     odata_version : str, default="v3"
         version of the odata for this dataset - must be either "v3" or "v4"
     source : str, default=None
-        The source of the dataset to be used as a WHERE caluse. If None, returns results from all sources
+        If given, only the ids of this source are returned. If None, returns results from all sources
 
     Returns
     -------
     ids : dict
         collection with source name as keys and all dataset ids from source as list
     """
+    import nl_open_data.catalog as nlcat
 
-    ## Get all v3 dataset ids #TODO: add v4 support
-    bq_client = bigquery.Client()
+    index = nlcat.get_catalog_index()
+    catalog = nlcat.load_catalog(third_party, odata_version, index)
+    if source:
+        tables = index.tables(catalog, source=source)
+        return {source.lower(): [table["identifier"] for table in tables]}
+    return index.ids_by_source(catalog)
 
-    # NOTE:
-    # CBS provides both 'Catalog' and 'Source' fields. Both provide mostly similar, but not identical information.
-    # 'Catalog' seems more strictly defined and additionally 'Source' is not present in the v4 catalog,
-    # so we choose to use 'Catalog' for now, but that could change.
 
-    if third_party:
-        select_string = f"""
-            SELECT `Identifier`, `Catalog`
-            FROM `dataverbinders-open-dwh.catalogs.external_{odata_version}`
-        """
-    else:
-        select_string = f"""
-            SELECT `Identifier`, `Catalog`
-            FROM `dataverbinders-open-dwh.catalogs.cbs_{odata_version}`
-        """
-    if source:
-        where_string = f"""
-            WHERE LOWER(Catalog)='{source.lower()}'
-        """
-    else:
-        where_string = ""
+def query_cbs_catalog_sizes(
+    third_party: bool = False, odata_version: str = "v3", source: str = None
+) -> dict:
+    """Returns the number of rows and columns of all datasets in a CBS catalog.
 
-    query = select_string + "\n" + where_string
-    query_job = bq_client.query(query)
-    ids = []
-    sources = []
-    for row in query_job:
-        ids.append(row[0])
-        sources.append(row[1])
+    The sizes are read from the local catalog index, see `query_cbs_catalogs`.
 
-    # Separate to different source
-    datasets = dict(zip(ids, sources))
-    sources_set = set(sources)
+    Parameters
+    ----------
+    third_party : bool, default=False
+        Flag to indicate whether to query core or external catatlog
+    odata_version : str, default="v3"
+        version of the odata for this dataset - must be either "v3" or "v4"
+    source : str, default=None
+        The source of the datasets (`Catalog`). If None, returns results from all sources
 
-    ids = {}
-    for source in sources_set:
-        ids[source.lower()] = [k for k, v in datasets.items() if v == source]
+    Returns
+    -------
+    dict
+        The `RecordCount` and `ColumnCount` per dataset id
+    """
+    import nl_open_data.catalog as nlcat
 
-    return ids
+    index = nlcat.get_catalog_index()
+    catalog = nlcat.load_catalog(third_party, odata_version, index)
+    return {
+        table["identifier"]: (table["record_count"], table["column_count"])
+        for table in index.tables(catalog, source=source)
+    }
 
 
 if __name__ == "__main__":
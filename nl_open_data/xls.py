@@ -0,0 +1,203 @@
+"""Reading CBS Excel (.xls) sheets into Arrow tables.
+
+`pd.read_excel` reads columns holding both numbers and text (i.e. '5,0' or a '.' for a missing
+value amid numbers) as `object` columns, which then fail to convert to parquet, and needs every
+file's missing-value markers spelled out. Here the cells of every column are read with `xlrd`,
+split by cell type into NumPy arrays, and turned into a single typed Arrow array:
+
+* Text cells holding a CBS missing-value marker (see `NULL_MARKERS`, stripped of padding) are null.
+* Text cells holding a number, with a decimal comma or point, are numbers. Text with leading
+  zeros (i.e. municipality codes such as '0003') is not.
+* A column is numeric (int64 if all its values are whole numbers, else float64) if all its non-null
+  cells are numbers, a timestamp if they are all dates, and a string column otherwise. Types can
+  also be declared per column.
+* Rows between the header and the data describing the columns (i.e. units, as in the Nabijheid
+  files) are skipped.
+"""
+from typing import Union, Mapping, Sequence, Tuple
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import xlrd
+
+# Missing values in CBS tables: '.' (unknown), 'x' (secret) and '?' (uncertain)
+NULL_MARKERS = ("", ".", "..", "...", "x", "X", "?")
+# Numbers with a decimal comma or point. Text with leading zeros (i.e. '0003') is a code, not a number.
+NUMBER_PATTERN = r"^[+-]?((0|[1-9]\d*)([.,]\d*)?|[.,]\d+)([eE][+-]?\d+)?$"
+MAX_UNIT_ROWS = 5  # Maximum number of rows skipped between the header and the data
+EXCEL_EPOCH_DAYS = 25569  # Days from 1899-12-30 (the Excel epoch) to 1970-01-01
+
+_NUMBER, _DATE, _BOOLEAN = xlrd.XL_CELL_NUMBER, xlrd.XL_CELL_DATE, xlrd.XL_CELL_BOOLEAN
+
+
+def _text_column(
+    types: np.ndarray, values: np.ndarray, null_markers: Sequence[str]
+) -> Tuple[pa.Array, pa.Array]:
+    """Returns the stripped text of all cells (null for others and for markers), and whether it is a number."""
+    is_text = types == xlrd.XL_CELL_TEXT
+    text = np.where(is_text, values, "").astype(str)
+    text = pc.utf8_trim_whitespace(pa.array(text, mask=~is_text))
+    text = pc.if_else(
+        pc.is_in(text, value_set=pa.array(null_markers, pa.string())),
+        pa.scalar(None, pa.string()),
+        text,
+    )
+    return text, pc.match_substring_regex(text, NUMBER_PATTERN)
+
+
+def _number_column(
+    types: np.ndarray, values: np.ndarray, text: pa.Array, is_number_text: pa.Array
+) -> pa.Array:
+    """Returns the numbers of number cells and of text cells holding numbers, as float64."""
+    is_number = (types == _NUMBER) | (types == _BOOLEAN)
+    numbers = np.where(is_number, values, np.nan).astype(np.float64)
+    number_text = pc.if_else(is_number_text, text, pa.scalar(None, pa.string()))
+    parsed = pc.cast(pc.replace_substring(number_text, ",", "."), pa.float64())
+    from_text = pc.is_valid(parsed).to_numpy(zero_copy_only=False)
+    numbers[from_text] = parsed.to_numpy(zero_copy_only=False)[from_text]
+    return pa.array(numbers, mask=~(is_number | from_text))
+
+
+def _column(
+    types: np.ndarray,
+    values: np.ndarray,
+    type_: pa.DataType = None,
+    null_markers: Sequence[str] = NULL_MARKERS,
+) -> pa.Array:
+    """Converts the cells of a column to a single typed array."""
+    text, is_number_text = _text_column(types, values, null_markers)
+    is_date = types == _DATE
+    filled = (types == _NUMBER) | (types == _BOOLEAN) | is_date
+    filled |= pc.is_valid(text).to_numpy(zero_copy_only=False)
+    has_text = pc.any(pc.invert(is_number_text)).as_py()
+
+    if type_ is None:
+        if filled.any() and (is_date == filled).all():
+            type_ = pa.timestamp("s")
+        elif has_text or not filled.any():
+            type_ = pa.string()
+        else:
+            numbers = _number_column(types, values, text, is_number_text)
+            whole = pc.all(pc.equal(numbers, pc.floor(numbers))).as_py() is not False
+            return pc.cast(numbers, pa.int64()) if whole else numbers
+
+    if pa.types.is_timestamp(type_) or pa.types.is_date(type_):
+        days = np.where(is_date, values, np.nan).astype(np.float64)
+        seconds = np.nan_to_num(np.round((days - EXCEL_EPOCH_DAYS) * 86400))
+        dates = pa.array(seconds.astype(np.int64), pa.timestamp("s"), mask=~is_date)
+        return pc.cast(dates, type_)
+    if pa.types.is_string(type_):
+        # Text is kept as is, i.e. codes with leading zeros or a decimal comma
+        no_text = pa.array(np.zeros(len(types), dtype=bool))
+        numbers = _number_column(types, values, text, no_text)
+        return pc.coalesce(text, pc.cast(numbers, pa.string()))
+    return pc.cast(_number_column(types, values, text, is_number_text), type_)
+
+
+def _unit_rows(
+    sheet: "xlrd.sheet.Sheet", first_row: int, null_markers: Sequence[str]
+) -> int:
+    """Counts the rows from `first_row` holding text but no numbers in the numeric columns below them."""
+    end = min(first_row + MAX_UNIT_ROWS, sheet.nrows)
+    numeric = [
+        i
+        for i in range(sheet.ncols)
+        if _NUMBER in sheet.col_types(i, start_rowx=first_row)
+    ]
+    n_rows = 0
+    for row in range(first_row, end if numeric else first_row):
+        types = np.array([sheet.cell_type(row, i) for i in numeric], dtype=np.int64)
+        values = np.array([sheet.cell_value(row, i) for i in numeric], dtype=object)
+        _, is_number_text = _text_column(types, values, null_markers)
+        has_text = pc.any(pc.invert(is_number_text)).as_py()
+        if _NUMBER in types or not has_text:
+            break
+        n_rows += 1
+    return n_rows
+
+
+def sheet_to_table(
+    sheet: "xlrd.sheet.Sheet",
+    header_row: int = 0,
+    types: Mapping[str, pa.DataType] = None,
+    null_markers: Sequence[str] = NULL_MARKERS,
+    skip_unit_rows: bool = True,
+) -> pa.Table:
+    """Converts an xlrd sheet to an Arrow table, see the module docstring.
+
+    Parameters
+    ----------
+    sheet : xlrd.sheet.Sheet
+        The sheet to convert
+    header_row : int, default=0
+        The row holding the column names
+    types : Mapping, default=None
+        Arrow types (or their names, i.e. 'string') of columns by name, instead of inferring them
+    null_markers : list of str, default=NULL_MARKERS
+        Text of cells that are missing values
+    skip_unit_rows : bool, default=True
+        Whether rows without numbers between the header and the data are skipped
+
+    Returns
+    -------
+    pa.Table
+        The contents of the sheet
+    """
+    names = [str(name).strip() for name in sheet.row_values(header_row)]
+    first_row = header_row + 1
+    if skip_unit_rows:
+        first_row += _unit_rows(sheet, first_row, null_markers)
+    types = {
+        name: pa.type_for_alias(type_) if isinstance(type_, str) else type_
+        for name, type_ in (types or {}).items()
+    }
+    columns = [
+        _column(
+            np.array(sheet.col_types(i, start_rowx=first_row), dtype=np.int64),
+            np.array(sheet.col_values(i, start_rowx=first_row), dtype=object),
+            types.get(name),
+            null_markers,
+        )
+        for i, name in enumerate(names)
+    ]
+    return pa.table(columns, names=names)
+
+
+def read_xls(
+    file: Union[str, Path],
+    sheet: Union[int, str] = 0,
+    header_row: int = 0,
+    types: Mapping[str, pa.DataType] = None,
+    null_markers: Sequence[str] = NULL_MARKERS,
+    skip_unit_rows: bool = True,
+) -> pa.Table:
+    """Reads a sheet of an Excel (.xls) file into an Arrow table, see `sheet_to_table`.
+
+    Parameters
+    ----------
+    file : str or Path
+        The xls file
+    sheet : int or str, default=0
+        The index or name of the sheet
+    header_row, types, null_markers, skip_unit_rows
+        See `sheet_to_table`
+
+    Returns
+    -------
+    pa.Table
+        The contents of the sheet
+    """
+    with xlrd.open_workbook(file, on_demand=True) as workbook:
+        if isinstance(sheet, str):
+            xls_sheet = workbook.sheet_by_name(sheet)
+        else:
+            xls_sheet = workbook.sheet_by_index(sheet)
+        return sheet_to_table(
+            xls_sheet,
+            header_row=header_row,
+            types=types,
+            null_markers=null_markers,
+            skip_unit_rows=skip_unit_rows,
+        )
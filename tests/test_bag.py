@@ -0,0 +1,134 @@
+"""Tests for `nl_open_data.bag`."""
+import io
+from zipfile import ZipFile
+
+import pyarrow.parquet as pq
+
+import nl_open_data.bag as nlb
+
+NUM_RECORD = """
+    <sl-bag-extract:bagObject>
+      <Objecten:Nummeraanduiding>
+        <Objecten:heeftAlsHoofdadres/>
+        <Objecten:identificatie domein="NL.IMBAG.Nummeraanduiding">{id}</Objecten:identificatie>
+        <Objecten:huisnummer>{huisnummer}</Objecten:huisnummer>
+        <Objecten:postcode>9901AD</Objecten:postcode>
+        <Objecten:typeAdresseerbaarObject>Verblijfsobject</Objecten:typeAdresseerbaarObject>
+        <Objecten:status>Naamgeving uitgegeven</Objecten:status>
+        <Objecten:geconstateerd>N</Objecten:geconstateerd>
+        <Objecten:documentdatum>2018-03-26</Objecten:documentdatum>
+        <Objecten:documentnummer>2018-0001</Objecten:documentnummer>
+        <Objecten:voorkomen>
+          <Historie:Voorkomen>
+            <Historie:voorkomenidentificatie>1</Historie:voorkomenidentificatie>
+            <Historie:beginGeldigheid>2018-03-26</Historie:beginGeldigheid>
+            <Historie:tijdstipRegistratie>2018-03-26T11:56:37.000</Historie:tijdstipRegistratie>
+          </Historie:Voorkomen>
+        </Objecten:voorkomen>
+        <Objecten:ligtAan>
+          <Objecten-ref:OpenbareRuimteRef domein="NL.IMBAG.Openbareruimte">0003300000116985</Objecten-ref:OpenbareRuimteRef>
+        </Objecten:ligtAan>
+      </Objecten:Nummeraanduiding>
+    </sl-bag-extract:bagObject>"""
+
+VBO_RECORD = """
+    <sl-bag-extract:bagObject>
+      <Objecten:Verblijfsobject>
+        <Objecten:heeftAlsHoofdadres>
+          <Objecten-ref:NummeraanduidingRef>0003200000133980</Objecten-ref:NummeraanduidingRef>
+        </Objecten:heeftAlsHoofdadres>
+        <Objecten:geometrie>
+          <Objecten:punt><gml:Point><gml:pos>252740.0 593674.0 0.0</gml:pos></gml:Point></Objecten:punt>
+        </Objecten:geometrie>
+        <Objecten:identificatie>0003010000125985</Objecten:identificatie>
+        <Objecten:gebruiksdoel>woonfunctie</Objecten:gebruiksdoel>
+        <Objecten:gebruiksdoel>winkelfunctie</Objecten:gebruiksdoel>
+        <Objecten:oppervlakte>72</Objecten:oppervlakte>
+        <Objecten:maaktDeelUitVan>
+          <Objecten-ref:PandRef>0003100000117987</Objecten-ref:PandRef>
+        </Objecten:maaktDeelUitVan>
+      </Objecten:Verblijfsobject>
+    </sl-bag-extract:bagObject>"""
+
+
+def bag_xml(records: str) -> bytes:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<sl:bagStand xmlns:sl="http://www.espertech.com/stuf/lvbag-extract/sl"
+    xmlns:sl-bag-extract="http://www.kadaster.nl/schemas/lvbag/extract-deelbestand-lvc/v20200601"
+    xmlns:Objecten="www.kadaster.nl/schemas/lvbag/imbag/objecten/v20200601"
+    xmlns:Objecten-ref="www.kadaster.nl/schemas/lvbag/imbag/objecten-ref/v20200601"
+    xmlns:Historie="www.kadaster.nl/schemas/lvbag/imbag/historie/v20200601"
+    xmlns:gml="http://www.opengis.net/gml/3.2">
+  <sl:standBestand>
+    <sl:stand>{records}
+    </sl:stand>
+  </sl:standBestand>
+</sl:bagStand>""".encode()
+
+
+def test_parse_bag_xml(tmp_path):
+    xml = bag_xml(
+        "".join(
+            NUM_RECORD.format(id=f"000320000013398{i}", huisnummer=i) for i in range(3)
+        )
+    )
+    out_file = tmp_path / "9999NUM08042022-000001.parquet"
+
+    n_objects = nlb.parse_bag_xml(io.BytesIO(xml), nlb.NUM, out_file, batch_size=2)
+
+    assert n_objects == 3
+    parquet_file = pq.ParquetFile(out_file)
+    assert parquet_file.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.schema == nlb.NUM.schema
+    assert table["huisnummer"].to_pylist() == [0, 1, 2]
+    row = table.slice(0, 1).to_pylist()[0]
+    assert row["identificatie"] == "0003200000133980"
+    assert row["openbare_ruimte_id"] == "0003300000116985"
+    assert row["huisletter"] is None
+    assert row["voorkomenidentificatie"] == 1
+    assert str(row["begin_geldigheid"]) == "2018-03-26"
+    assert str(row["tijdstip_registratie"]) == "2018-03-26 11:56:37"
+
+
+def test_parse_bag_xml_without_objects(tmp_path):
+    out_file = tmp_path / "empty.parquet"
+
+    assert nlb.parse_bag_xml(io.BytesIO(bag_xml("")), nlb.NUM, out_file) == 0
+    assert pq.read_table(out_file).schema == nlb.NUM.schema
+
+
+def test_extract_bag(tmp_path):
+    num_zip = io.BytesIO()
+    with ZipFile(num_zip, "w") as zf:
+        for i in range(3):
+            xml = NUM_RECORD.format(id=f"000320000013398{i}", huisnummer=i)
+            zf.writestr(f"9999NUM08042022-00000{i + 1}.xml", bag_xml(xml))
+    vbo_zip = io.BytesIO()
+    with ZipFile(vbo_zip, "w") as zf:
+        zf.writestr("9999VBO08042022-000001.xml", bag_xml(VBO_RECORD))
+    bag_zip = tmp_path / "lvbag-extract-nl.zip"
+    with ZipFile(bag_zip, "w") as zf:
+        zf.writestr("9999NUM08042022.zip", num_zip.getvalue())
+        zf.writestr("9999VBO08042022.zip", vbo_zip.getvalue())
+        zf.writestr("Leveringsdocument-BAG-Extract.xml", "<levering/>")
+
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    datasets = nlb.extract_bag(
+        bag_zip, tmp_path / "bag", max_workers=2, spool_folder=spool
+    )
+
+    assert datasets == {
+        "NUM": dict(folder=tmp_path / "bag" / "NUM", objects=3),
+        "VBO": dict(folder=tmp_path / "bag" / "VBO", objects=1),
+    }
+    num = pq.read_table(tmp_path / "bag" / "NUM").sort_by("huisnummer")
+    assert num["huisnummer"].to_pylist() == [0, 1, 2]
+    vbo = pq.read_table(tmp_path / "bag" / "VBO").to_pylist()[0]
+    assert vbo["hoofdadres_id"] == "0003200000133980"
+    assert vbo["nevenadres_ids"] == []
+    assert vbo["gebruiksdoelen"] == ["woonfunctie", "winkelfunctie"]
+    assert vbo["pand_ids"] == ["0003100000117987"]
+    assert vbo["punt"] == "252740.0 593674.0 0.0"
+    assert not any(spool.iterdir())  # The decompressed nested zips are removed
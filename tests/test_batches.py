@@ -0,0 +1,60 @@
+"""Tests for `nl_open_data.batches`."""
+import nl_open_data.batches as nlb
+
+
+def test_estimate_seconds_prefers_longer_previous_duration():
+    seconds = nlb.estimate_seconds(1000, 10, cells_per_second=100, overhead_seconds=5)
+    assert seconds == 105
+    assert nlb.estimate_seconds(1000, 10, previous_seconds=42) == 42
+    # A huge table skipped as unchanged in its previous run is still estimated by its size
+    seconds = nlb.estimate_seconds(10_000_000, 20, previous_seconds=3)
+    assert seconds == nlb.estimate_seconds(10_000_000, 20)
+
+
+def test_plan_batches_balances_work():
+    costs = {"huge": 100, "a": 30, "b": 30, "c": 20, "d": 10, "e": 10}
+
+    batches = nlb.plan_batches(costs, target_seconds=50)
+
+    assert batches[0] == ["huge"]
+    loads = [sum(costs[id_] for id_ in batch) for batch in batches]
+    assert loads == sorted(loads, reverse=True)
+    assert max(loads[1:]) - min(loads[1:]) <= 10
+    assert sorted(id_ for batch in batches for id_ in batch) == sorted(costs)
+
+
+def test_plan_batches_limits_batch_size():
+    costs = {str(i): 1 for i in range(10)}
+
+    batches = nlb.plan_batches(costs, target_seconds=100, max_batch_size=3)
+
+    assert [len(batch) for batch in batches] == [3, 3, 2, 2]
+
+
+def test_submit_batches_caps_running_flow_runs(tmp_path):
+    running, max_running = set(), [0]
+
+    def submit(i, ids):
+        running.add(i)
+        max_running[0] = max(max_running[0], len(running))
+        return i
+
+    def is_finished(flow_run_id):
+        running.discard(flow_run_id)
+        return True
+
+    history = nlb.DurationHistory(tmp_path / "durations.json")
+    flow_run_ids = nlb.submit_batches(
+        [["a", "b"], ["c"], ["d"]],
+        submit,
+        is_finished,
+        max_concurrent=2,
+        poll_seconds=0,
+        on_finished=lambda ids, seconds: history.record_batch(
+            ids, 9, {"a": 2, "b": 1, "c": 1, "d": 1}
+        ),
+    )
+
+    assert flow_run_ids == [0, 1, 2]
+    assert max_running[0] == 2
+    assert history.seconds == {"a": 6, "b": 3, "c": 9, "d": 9}
@@ -0,0 +1,77 @@
+"""Tests for `nl_open_data.flows.builders`."""
+from zipfile import ZipFile
+
+import nl_open_data.tasks as nlt
+import nl_open_data.download as nld
+import nl_open_data.upload as nlup
+from nl_open_data.flows.builders import build_zip_flow, count_task_runs
+
+
+def test_plan_files(tmp_path):
+    urls = ["https://www.cbs.nl/-/media/kwb-2019.xls", "https://host/nabijheid(1).xls"]
+
+    plan = nlt.plan_files.run(urls, tmp_path, download_dir="xls")
+
+    assert plan["download_folder"].is_dir() and plan["out_folder"].is_dir()
+    assert plan["download"] == [
+        tmp_path / "xls" / "kwb-2019.xls",
+        tmp_path / "xls" / "nabijheid(1).xls",
+    ]
+    assert plan["out_file"] == [
+        tmp_path / "upload_to_gcs" / "kwb_2019.parquet",
+        tmp_path / "upload_to_gcs" / "nabijheid_1_.parquet",
+    ]
+
+
+def _fake_io(monkeypatch):
+    """Downloads a small zip for every url (but those containing 'broken'), uploads nothing."""
+
+    def download_file(url, filepath, cache=None):
+        if "broken" in url:
+            raise ConnectionError(f"Could not download {url}")
+        with ZipFile(filepath, "w") as zf:
+            zf.writestr("data.csv", "a,b\n1,x\n")
+        return nld.DownloadResult(url, filepath, "downloaded", 0, 0.0)
+
+    def upload_file(bucket, filepath, blob_name, **kwargs):
+        return nlup.UploadResult(blob_name, blob_name, 0, 0.0, "resumable", "")
+
+    monkeypatch.setattr(nlt.nld, "download_file", download_file)
+    monkeypatch.setattr(nlt.nlup, "upload_file", upload_file)
+    monkeypatch.setattr(nlt.nlu, "get_gcs_bucket", lambda gcp: None)
+    monkeypatch.setattr(nlt.nlu, "list_blob_hashes", lambda folder, gcp: {})
+    monkeypatch.setattr(nlt.nlc, "get_cache", lambda: None)
+
+
+def test_zip_flow_runs_one_task_per_file_and_stage(monkeypatch):
+    _fake_io(monkeypatch)
+    urls = [f"https://host/file_{i}.zip" for i in range(3)]
+
+    flow = build_zip_flow()
+    state = flow.run(parameters=dict(urls=urls, gcs_folder="uwv/open_match"))
+
+    assert state.is_successful()
+    mapped = [task for task, result in state.result.items() if result.is_mapped()]
+    # Only the download, conversion and upload tasks run per file
+    assert sorted(task.name for task in mapped) == [
+        "download",
+        "drop_unchanged_file",
+        "upload_to_gcs",
+        "zip_csv_to_parquet",
+    ]
+    assert count_task_runs(state) == len(flow.tasks) - len(mapped) + 4 * len(urls)
+
+
+def test_zip_flow_tolerates_a_failed_download(monkeypatch):
+    _fake_io(monkeypatch)
+    urls = ["https://host/broken.zip", "https://host/file_1.zip", "https://host/file_2.zip"]
+
+    flow = build_zip_flow()
+    state = flow.run(parameters=dict(urls=urls, gcs_folder="uwv/open_match"))
+
+    by_name = {task.name: result for task, result in state.result.items()}
+    assert by_name["infer_csv_schemas"].is_successful()
+    converted = by_name["zip_csv_to_parquet"].map_states
+    assert [child.is_successful() for child in converted] == [False, True, True]
+    uploaded = by_name["upload_to_gcs"].map_states
+    assert sum(child.is_successful() for child in uploaded) == 2
@@ -0,0 +1,237 @@
+"""Tests for `nl_open_data.catalog`."""
+from types import SimpleNamespace
+
+import pyarrow as pa
+
+import nl_open_data.catalog as nlcat
+import nl_open_data.tasks as nlt
+from nl_open_data.config import config
+
+
+class FakeBucket:
+    def __init__(self):
+        self.blobs = {}
+
+    def blob(self, name):
+        bucket = self
+
+        class Blob(SimpleNamespace):
+            def upload_from_string(self, data):
+                bucket.blobs[self.name] = self
+
+        return Blob(name=name, metadata=None)
+
+    def list_blobs(self, prefix):
+        return [blob for name, blob in self.blobs.items() if name.startswith(prefix)]
+
+
+class FakeSession:
+    def get(self, url, params=None, timeout=None):
+        tables = [
+            dict(Identifier="1NED", Modified="2021-06-01T02:00:00", Catalog="MLZ"),
+            dict(Identifier="2NED", Modified="2021-06-04T02:00:00", Catalog="MLZ"),
+            dict(Identifier="3NED", Modified="2021-06-04T02:00:00", Catalog="JM"),
+        ]
+        return SimpleNamespace(
+            raise_for_status=lambda: None, json=lambda: {"value": tables}
+        )
+
+
+def test_fetch_modified_filters_source():
+    modified = nlcat.fetch_modified(True, "mlz", session=FakeSession())
+
+    assert modified == {"1NED": "2021-06-01T02:00:00", "2NED": "2021-06-04T02:00:00"}
+
+
+def test_split_changed_ids():
+    modified = {"1NED": "2021-06-01", "2NED": "2021-06-04", "3NED": "2021-06-04"}
+    snapshot = {"1NED": "2021-06-01", "2NED": "2021-05-01"}
+
+    changed, unknown = nlcat.split_changed_ids(
+        ["1NED", "2NED", "3NED", "4NED"], modified, snapshot
+    )
+
+    assert changed == ["2NED"]
+    assert unknown == ["3NED", "4NED"]
+
+
+def test_snapshot_records_only_mirrored_datasets(monkeypatch):
+    bucket = FakeBucket()
+    monkeypatch.setattr(nlcat, "get_gcs_bucket", lambda gcp: bucket)
+    monkeypatch.setattr(nlcat, "get_session", FakeSession)
+    nlcat.write_snapshot({"1NED": "2021-05-01T02:00:00"}, "mlz", config.gcp.dev)
+
+    changes = nlt.detect_changed_datasets.run(
+        ["1NED", "2NED"], "mlz", config, third_party=True
+    )
+    # 1NED changed since the snapshot, 2NED is not in it and left to `main` to check
+    assert changes["ids"] == ["1NED", "2NED"]
+    assert changes["force"] == [True, False]
+
+    recorded = nlt.update_catalog_snapshot.run(
+        changes, [ValueError("failed"), ValueError("failed")], "mlz", config
+    )
+    assert recorded == []
+    nlt.update_catalog_snapshot.run(changes, [["file.parquet"], None], "mlz", config)
+    assert nlcat.read_snapshot("mlz", config.gcp.dev) == {
+        "1NED": "2021-06-01T02:00:00",
+        "2NED": "2021-06-04T02:00:00",
+    }
+    changes = nlt.detect_changed_datasets.run(
+        ["1NED", "2NED"], "mlz", config, third_party=True
+    )
+    assert changes["ids"] == []
+
+
+class VersionedSession:
+    """Serves a v3 and a v4 catalog, with a dataset in both."""
+
+    tables = {
+        "v3": [dict(Identifier="1NED", Modified="2021-06-01T02:00:00", Catalog="CBS")],
+        "v4": [
+            dict(Identifier="1NED", Modified="2021-06-09T02:00:00", Catalog="CBS"),
+            dict(Identifier="85000NED", Modified="2021-06-04T02:00:00", Catalog="CBS"),
+        ],
+    }
+
+    def get(self, url, params=None, timeout=None):
+        version = "v4" if url == nlcat.CATALOG_URLS["cbs_v4"] else "v3"
+        return SimpleNamespace(
+            raise_for_status=lambda: None, json=lambda: {"value": self.tables[version]}
+        )
+
+
+def test_v4_datasets_are_recorded_in_the_v4_snapshot(monkeypatch):
+    bucket = FakeBucket()
+    monkeypatch.setattr(nlcat, "get_gcs_bucket", lambda gcp: bucket)
+    monkeypatch.setattr(nlcat, "get_session", VersionedSession)
+
+    changes = nlt.detect_changed_datasets.run(["1NED", "85000NED"], "cbs", config)
+    assert changes["versions"] == {"1NED": "v3", "85000NED": "v4"}
+    nlt.update_catalog_snapshot.run(changes, [None, None], "cbs", config)
+
+    assert nlcat.read_snapshot("cbs", config.gcp.dev, "v4") == {
+        "85000NED": "2021-06-04T02:00:00"
+    }
+    changes = nlt.detect_changed_datasets.run(["1NED", "85000NED"], "cbs", config)
+    assert changes["ids"] == []
+
+
+TABLES = [
+    dict(
+        Identifier="1NED",
+        Catalog="MLZ",
+        Modified="2021-06-01T02:00:00",
+        RecordCount=100,
+        ColumnCount=5,
+    ),
+    dict(
+        Identifier="2NED",
+        Catalog="MLZ",
+        Modified="2021-06-04T02:00:00",
+        RecordCount=10_000,
+        ColumnCount=8,
+    ),
+    dict(
+        Identifier="3NED",
+        Catalog="JM",
+        Modified="2021-05-01T02:00:00",
+        RecordCount=50,
+        ColumnCount=3,
+    ),
+]
+
+
+def test_catalog_index_lookups(tmp_path):
+    index = nlcat.CatalogIndex(tmp_path / "catalogs.sqlite")
+    assert index.is_stale("external_v3")
+
+    assert index.refresh("external_v3", TABLES) == 3
+
+    assert not index.is_stale("external_v3")
+    assert index.ids_by_source("external_v3") == {
+        "mlz": ["1NED", "2NED"],
+        "jm": ["3NED"],
+    }
+    tables = index.tables("external_v3", source="MLZ", modified_since="2021-06-02")
+    assert [table["identifier"] for table in tables] == ["2NED"]
+    tables = index.tables("external_v3", max_records=100)
+    assert [table["identifier"] for table in tables] == ["1NED", "3NED"]
+
+
+def test_query_cbs_catalogs_falls_back_to_bigquery_when_stale(tmp_path, monkeypatch):
+    queries = []
+
+    def query_catalog_tables(third_party, odata_version):
+        queries.append((third_party, odata_version))
+        return TABLES
+
+    index = nlcat.CatalogIndex(tmp_path / "catalogs.sqlite", max_age_hours=1)
+    monkeypatch.setattr(nlcat, "_index", index)
+    monkeypatch.setattr(nlcat, "query_catalog_tables", query_catalog_tables)
+
+    assert nlt.nlu.query_cbs_catalogs(third_party=True, source="mlz") == {
+        "mlz": ["1NED", "2NED"]
+    }
+    assert nlt.nlu.query_cbs_catalog_sizes(third_party=True, source="jm") == {
+        "3NED": (50, 3)
+    }
+    assert queries == [(True, "v3")]
+
+
+class PagedSession:
+    """Serves a v3 and a v4 catalog of two pages each."""
+
+    pages = {
+        "https://host/v3": {
+            "value": [{"Identifier": "1NED", "RecordCount": 10}],
+            "odata.nextLink": "https://host/v3?$skip=1",
+        },
+        "https://host/v3?$skip=1": {"value": [{"Identifier": "2NED"}]},
+        "https://host/v4": {
+            "value": [{"Identifier": "3", "Status": None}],
+            "@odata.nextLink": "v4?$skip=1",
+        },
+        "https://host/v4?$skip=1": {"value": [{"Identifier": "4", "Status": "ok"}]},
+    }
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append((url, params, timeout))
+        return SimpleNamespace(
+            raise_for_status=lambda: None, json=lambda: self.pages[url]
+        )
+
+
+def test_iter_pages_follows_next_links():
+    session = PagedSession()
+
+    pages = list(nlcat.iter_pages("https://host/v3", session=session))
+
+    assert pages == [
+        [{"Identifier": "1NED", "RecordCount": 10}],
+        [{"Identifier": "2NED"}],
+    ]
+    assert session.requests[0][1] == {"$format": "json"}
+    assert session.requests[1][1] is None  # The next link holds its own parameters
+    assert all(timeout for _, _, timeout in session.requests)
+
+
+def test_fetch_catalogs(monkeypatch):
+    monkeypatch.setattr(nlcat, "get_session", PagedSession)
+    schema = pa.schema([("Identifier", pa.string()), ("RecordCount", pa.int64())])
+
+    tables = nlcat.fetch_catalogs(
+        {"cbs_v3": "https://host/v3", "cbs_v4": "https://host/v4"},
+        schemas={"cbs_v3": schema},
+    )
+
+    assert tables["cbs_v3"].schema == schema
+    assert tables["cbs_v3"].to_pydict() == {
+        "Identifier": ["1NED", "2NED"],
+        "RecordCount": [10, None],
+    }
+    # The null column of the first page is promoted to the type of the second
+    assert tables["cbs_v4"].column("Status").to_pylist() == [None, "ok"]
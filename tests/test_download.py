@@ -0,0 +1,163 @@
+"""Tests for `nl_open_data.download`, against a local http server stand-in."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import hashlib
+import os
+import time
+
+import pytest
+
+import nl_open_data.download as nld
+import nl_open_data.utils as nlu
+from nl_open_data.cache import DownloadCache
+
+CONTENT = os.urandom(300_000)
+ETAG = '"v1"'
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT with ETag, conditional GET and single range support."""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        RangeHandler.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start, end = 0, len(CONTENT) - 1
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == ETAG):
+            start, end = range_header.split("=")[1].split("-")
+            start, end = int(start), int(end) if end else len(CONTENT) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[start : end + 1]
+        self.send_header("ETag", ETAG)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    RangeHandler.requests = []
+    yield f"http://127.0.0.1:{server.server_port}/data.zip"
+    server.shutdown()
+
+
+def test_download_and_conditional_get(url, tmp_path):
+    filepath = tmp_path / "data.zip"
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+
+    result = nld.download_file(url, filepath, expected_sha256=sha256)
+    assert result.status == "downloaded"
+    assert result.sha256 == sha256
+    assert filepath.read_bytes() == CONTENT
+
+    result = nld.download_file(url, filepath)
+    assert result.status == "not_modified"
+    assert RangeHandler.requests[-1]["If-None-Match"] == ETAG
+    assert filepath.read_bytes() == CONTENT
+
+
+def test_download_resume(url, tmp_path):
+    filepath = tmp_path / "data.zip"
+    (tmp_path / "data.zip.part").write_bytes(CONTENT[:1000])
+    nld._write_meta(filepath, dict(url=url, partial=True, etag=ETAG))
+
+    result = nld.download_file(url, filepath)
+
+    assert result.status == "resumed"
+    assert RangeHandler.requests[-1]["Range"] == "bytes=1000-"
+    assert result.sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert filepath.read_bytes() == CONTENT
+
+
+def test_download_parallel_ranges(url, tmp_path):
+    filepath = tmp_path / "data.zip"
+
+    result = nld.download_file(url, filepath, part_size=64_000, max_workers=3)
+
+    assert filepath.read_bytes() == CONTENT
+    assert result.sha256 == hashlib.sha256(CONTENT).hexdigest()
+    ranges = [r["Range"] for r in RangeHandler.requests if "Range" in r]
+    assert len(ranges) == 5
+
+
+def test_download_checksum_mismatch(url, tmp_path):
+    filepath = tmp_path / "data.zip"
+    with pytest.raises(ValueError):
+        nld.download_file(url, filepath, expected_sha256="0" * 64)
+    assert not filepath.exists()
+
+
+def test_download_cache_across_runs(url, tmp_path):
+    cache = DownloadCache(tmp_path / "cache", max_bytes=10 * len(CONTENT))
+
+    first = nld.download_file(url, tmp_path / "run_1" / "data.zip", cache=cache)
+    second = nld.download_file(url, tmp_path / "run_2" / "data.zip", cache=cache)
+
+    assert first.status == "downloaded"
+    assert second.status == "cached"
+    assert RangeHandler.requests[-1]["If-None-Match"] == ETAG
+    assert second.path.read_bytes() == CONTENT
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_download_cache_evicts_least_recently_used(tmp_path):
+    cache = DownloadCache(tmp_path / "cache", max_bytes=25)
+    for name in ("a", "b", "c"):
+        file = tmp_path / name
+        file.write_bytes(name.encode() * 10)
+        cache.store(f"http://host/{name}", file, sha256=name * 64)
+        if name == "b":
+            cache.fetch(cache.lookup("http://host/a"), tmp_path / "a_again")
+        time.sleep(0.01)
+
+    assert cache.lookup("http://host/a") is not None
+    assert cache.lookup("http://host/b") is None
+    assert cache.lookup("http://host/c") is not None
+    assert cache.stats()["size_bytes"] == 20
+    assert cache.stats()["evictions"] == 1
+
+
+def test_session_is_shared_within_process(monkeypatch):
+    session = nld.get_session()
+    assert nld.get_session() is session
+
+    # A forked process (i.e. a Dask worker) gets a session of its own
+    monkeypatch.setattr(nlu, "_clients_pid", -1)
+    assert nld.get_session() is not session
+
+
+def test_download_cache_entry_evicted_after_lookup(url, tmp_path, monkeypatch):
+    cache = DownloadCache(tmp_path / "cache", max_bytes=10 * len(CONTENT))
+    nld.download_file(url, tmp_path / "run_1" / "data.zip", cache=cache)
+
+    # Another worker evicts the cached file between lookup and fetch
+    lookup = cache.lookup
+
+    def lookup_then_evict(url):
+        entry = lookup(url)
+        if entry:
+            cache.object_path(entry["sha256"]).unlink()
+        return entry
+
+    monkeypatch.setattr(cache, "lookup", lookup_then_evict)
+    result = nld.download_file(url, tmp_path / "run_2" / "data.zip", cache=cache)
+
+    assert result.status == "downloaded"
+    assert result.path.read_bytes() == CONTENT
+    assert (cache.hits, cache.misses) == (0, 2)
@@ -0,0 +1,41 @@
+"""Tests for `nl_open_data.executors`."""
+from prefect import Flow
+
+import nl_open_data.executors as nle
+import nl_open_data.tasks as nlt
+
+GB = nle.GB
+
+
+def test_conversion_workers_are_limited_by_memory(monkeypatch):
+    monkeypatch.setattr(nle.os, "cpu_count", lambda: 8)
+    workers = nle.conversion_workers(
+        memory_per_process_gb=2, io_threads=4, total_memory=5 * GB
+    )
+
+    assert sorted(workers) == ["cpu-0", "cpu-1", "io"]
+    assert workers["cpu-0"]["options"]["nthreads"] == 1
+    assert workers["cpu-0"]["options"]["resources"] == {"CPU": 1}
+    assert workers["io"]["options"]["nthreads"] == 4
+    assert workers["io"]["options"]["resources"] == {"IO": 4}
+
+
+def test_conversion_tasks_are_tagged():
+    assert nle.CPU_BOUND in nlt.xls_to_parquet.tags
+    assert nle.CPU_BOUND in nlt.zip_csv_to_parquet.tags
+    assert nle.IO_BOUND in nlt.upload_to_gcs.tags
+
+
+def test_threads_executor_runs_tagged_tasks(tmp_path):
+    file = tmp_path / "data.csv"
+    file.write_text("a,b\n1,x\n")
+    with Flow("test") as flow:
+        out_file = nlt.csv_to_parquet(file)
+    executor = nle.dask_executor(
+        {"mode": "threads", "threads": {"n_workers": 1, "processes": False}}
+    )
+
+    state = flow.run(executor=executor)
+
+    assert state.is_successful()
+    assert state.result[out_file].result.exists()
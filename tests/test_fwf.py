@@ -0,0 +1,66 @@
+"""Tests for `nl_open_data.fwf`."""
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import nl_open_data.fwf as nlf
+import nl_open_data.tasks as nlt
+
+RECORDS = "0010123Jansen    19900101\n0020456de Vries  00000000\n0030789          31121999\n"
+WIDTHS = [3, 4, 10, 8]
+NAMES = ["a", "b", "naam", "datum"]
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "latin-1"])
+def test_read_fwf_matches_pandas(encoding):
+    text = "kolom  waarde  n\r\nbron   UWV     01\r\n\r\nx      é       2.5\r\nyy\r\n"
+
+    table = nlf.read_fwf(io.BytesIO(text.encode(encoding)), encoding=encoding)
+
+    expected = pd.read_fwf(io.BytesIO(text.encode(encoding)), encoding=encoding)
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+
+
+def test_read_fwf_fixed_length_records(tmp_path):
+    file = tmp_path / "agb.txt"
+    file.write_text(RECORDS)
+
+    table = nlf.read_fwf(
+        file, widths=WIDTHS, names=NAMES, dtypes={"b": pa.string()}, batch_size=2
+    )
+
+    assert table.to_pydict() == {
+        "a": [1, 2, 3],
+        "b": ["0123", "0456", "0789"],
+        "naam": ["Jansen", "de Vries", None],
+        "datum": [19900101, 0, 31121999],
+    }
+    expected = pd.read_fwf(file, widths=WIDTHS, names=NAMES, dtype={"b": str})
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+
+
+
+def test_read_fwf_without_trailing_newline(tmp_path):
+    file = tmp_path / "codes.txt"
+    file.write_text("0010\n0020\n0030")
+
+    table = nlf.read_fwf(file, widths=[3, 1], names=["a", "b"])
+
+    assert table.to_pydict() == {"a": [1, 2, 3], "b": [0, 0, 0]}
+
+
+@pytest.mark.parametrize("engine", ["numpy", "pandas"])
+def test_fwf_to_parquet(tmp_path, engine):
+    file = tmp_path / "agb.txt"
+    file.write_text(RECORDS)
+
+    out_file = nlt.fwf_to_parquet.run(
+        file, engine=engine, widths=WIDTHS, names=NAMES, header=None
+    )
+
+    assert out_file == tmp_path / "parquet" / "agb.parquet"
+    assert pq.read_table(out_file)["naam"].to_pylist() == ["Jansen", "de Vries", None]
+    assert not file.exists()
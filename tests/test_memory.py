@@ -0,0 +1,48 @@
+"""Tests for `nl_open_data.memory`."""
+from zipfile import ZipFile
+import threading
+import time
+
+import nl_open_data.memory as nlm
+
+
+def test_estimate_memory_uses_uncompressed_zip_members(tmp_path):
+    zip_file = tmp_path / "data.zip"
+    with ZipFile(zip_file, "w", compression=8) as zf:
+        zf.writestr("a.csv", "0" * 1000)
+        zf.writestr("meta/b.txt", "0" * 100)
+    csv_file = tmp_path / "c.csv"
+    csv_file.write_text("0" * 1000)
+
+    factors = {".csv": 2, ".txt": 10}
+    assert nlm.estimate_memory(zip_file, factors) == 1000 * 2 + 100 * 10
+    assert nlm.estimate_memory(csv_file, factors) == 1000 * 2
+
+
+def test_memory_budget_queues_large_reservations():
+    budget = nlm.MemoryBudget(100)
+    first = budget.acquire(60)
+    admitted = []
+    waiting = threading.Thread(target=lambda: admitted.append(budget.acquire(60)))
+    waiting.start()
+    time.sleep(0.1)
+    assert not admitted
+
+    budget.release(first)
+    waiting.join(timeout=5)
+    assert admitted == [60]
+    # Reservations larger than the budget wait for all others and then run alone
+    budget.release(60)
+    assert budget.acquire(1000) == 100
+
+
+def test_limit_memory_reports_peak_rss(tmp_path):
+    file = tmp_path / "data.csv"
+    file.write_text("a\n1\n")
+
+    with nlm.limit_memory(file, {"budget_gb": 1}) as rss:
+        data = bytearray(50 * nlm.MB)
+        time.sleep(0.3)
+    assert rss.peak - rss.start >= 40 * nlm.MB
+    assert nlm.get_budget({"budget_gb": 1}).available == 2 ** 30
+    del data
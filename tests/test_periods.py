@@ -0,0 +1,45 @@
+"""Tests for `nl_open_data.periods`."""
+from datetime import date
+
+import pyarrow as pa
+
+import nl_open_data.periods as nlp
+
+
+def test_decode_periods():
+    codes = pa.array(["2019JJ00", "2020HJ02", "2020KW01", "2020MM12", "2018X000", None])
+
+    jaar, periode_start, periode_type = nlp.decode_periods(codes)
+
+    assert jaar.to_pylist() == [2019, 2020, 2020, 2020, 2018, None]
+    assert periode_start.to_pylist() == [
+        date(2019, 1, 1),
+        date(2020, 7, 1),
+        date(2020, 1, 1),
+        date(2020, 12, 1),
+        None,
+        None,
+    ]
+    assert periode_type.to_pylist() == ["JJ", "HJ", "KW", "MM", None, None]
+
+
+def test_decode_periods_out_of_range():
+    codes = pa.array(["2020MM13", "2020KW00", "2020KW05", "2020HJ03", "2020KW04"])
+
+    jaar, periode_start, periode_type = nlp.decode_periods(codes)
+
+    assert jaar.to_pylist() == [2020] * 5
+    assert periode_start.to_pylist() == [None, None, None, None, date(2020, 10, 1)]
+    assert periode_type.to_pylist() == ["MM", "KW", "KW", "HJ", "KW"]
+
+
+def test_add_period_columns_without_column():
+    table = pa.table({"a": [1]})
+
+    assert nlp.add_period_columns(table) is table
+
+
+def test_parse_dates():
+    dates = nlp.parse_dates(pa.array([1011990, 31121999, 0, None]))
+
+    assert dates.to_pylist() == [date(1990, 1, 1), date(1999, 12, 31), None, None]
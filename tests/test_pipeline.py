@@ -0,0 +1,60 @@
+"""Tests for `nl_open_data.pipeline`."""
+import threading
+import time
+
+import nl_open_data.pipeline as nlpl
+
+
+def test_stages_overlap():
+    def stage(value):
+        time.sleep(0.1)
+        return value + 1
+
+    start = time.perf_counter()
+    results = nlpl.run_pipeline(
+        range(5), [("a", stage, 1), ("b", stage, 1), ("c", stage, 1)]
+    )
+    seconds = time.perf_counter() - start
+
+    assert [result.value for result in results] == [3, 4, 5, 6, 7]
+    # Sequential stages would take 5 * 3 * 0.1s, overlapped ones (5 + 2) * 0.1s
+    assert seconds < 1.2
+    assert set(results[0].seconds) == {"a", "b", "c"}
+
+
+def test_failed_items_are_dropped():
+    def fail_on_two(value):
+        if value == 2:
+            raise ValueError("two")
+        return value
+
+    results = nlpl.run_pipeline(
+        range(4), [("a", fail_on_two, 2), ("b", lambda value: value * 10, 2)]
+    )
+
+    assert [result.value for result in results] == [0, 10, None, 30]
+    assert not results[2].ok
+    assert results[2].failed_stage == "a"
+    assert "b" not in results[2].seconds
+
+
+def test_queues_apply_backpressure():
+    started = []
+    release = threading.Event()
+
+    def slow(value):
+        release.wait()
+        return value
+
+    thread = threading.Thread(
+        target=nlpl.run_pipeline,
+        args=(range(10), [("fast", started.append, 1), ("slow", slow, 1)]),
+        kwargs=dict(queue_size=2),
+    )
+    thread.start()
+    time.sleep(0.3)
+    # One item in the slow stage, two in its queue, and one waiting to be put in it
+    assert len(started) == 4
+    release.set()
+    thread.join(timeout=5)
+    assert len(started) == 10
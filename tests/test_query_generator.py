@@ -0,0 +1,76 @@
+"""Tests for `nl_open_data.datamarts.query_generator`."""
+import re
+
+from box import Box
+
+import nl_open_data.datamarts.query_generator as qg
+import nl_open_data.utils as nlu
+
+GCP = Box(project_id="test-project", bucket="test-bucket", location="EU")
+PROPERTIES = {
+    "83674NED": [
+        {"Key": "Geslacht", "Title": "Geslacht", "Type": "Dimension"},
+        {"Key": "Perioden", "Title": "Perioden", "Type": "TimeDimension"},
+        {"Key": "RegioS", "Title": "Regio's", "Type": "GeoDimension"},
+        {"Key": "Bevolking_1", "Title": "Bevolking (aantal)", "Type": "Topic"},
+    ],
+    "84583NED": [{"Key": "Inkomen_1", "Title": "Inkomen", "Type": "Topic"}],
+}
+
+
+class FakeBigQueryClient:
+    """Answers the INFORMATION_SCHEMA and UNION ALL queries from `PROPERTIES`."""
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        if "INFORMATION_SCHEMA" in query:
+            return [
+                {"table_schema": "cbs", "table_name": f"{id_}_DataProperties"}
+                for id_ in PROPERTIES
+            ]
+        ids = re.findall(r"'(\w+)' AS dataset_id", query)
+        return [
+            dict(row, dataset_schema="cbs", dataset_id=id_)
+            for id_ in ids
+            for row in PROPERTIES[id_]
+        ]
+
+
+def test_split_properties():
+    by_type = qg.split_properties(PROPERTIES["83674NED"])
+
+    assert by_type["Dimension"] == {"Geslacht": "Geslacht"}
+    assert by_type["GeoDimension"] == {"RegioS": "Regio's"}
+    assert by_type["Topic"] == {"Bevolking_1": "Bevolking (aantal)"}
+    assert by_type["GeoDetail"] == {}
+
+
+def test_cache_refresh_in_bulk(tmp_path, monkeypatch):
+    bq = FakeBigQueryClient()
+    monkeypatch.setattr(nlu, "get_bq_client", lambda gcp=None: bq)
+
+    cache = qg.DataPropertiesCache(tmp_path / "data_properties.json")
+    assert cache.refresh(GCP) == 2
+    # One query listing the tables, and one reading both of them
+    assert len(bq.queries) == 2
+    assert bq.queries[1].count("UNION ALL") == 1
+
+    reloaded = qg.DataPropertiesCache(tmp_path / "data_properties.json")
+    assert reloaded.get("84583NED") == PROPERTIES["84583NED"]
+
+
+def test_flatten_table_from_cache_without_queries(tmp_path, monkeypatch):
+    def no_queries(gcp=None):
+        raise AssertionError("BigQuery should not be queried")
+
+    cache = qg.DataPropertiesCache(tmp_path / "data_properties.json")
+    cache.properties = {cache.key(id_): rows for id_, rows in PROPERTIES.items()}
+    monkeypatch.setattr(nlu, "get_bq_client", no_queries)
+
+    query = qg.flatten_table("83674NED", join_type="left", GCP=GCP, properties=cache)
+
+    assert "fct.Bevolking_1 AS bevolking_aantal" in query
+    assert "LEFT JOIN test-project.cbs.83674NED_Geslacht AS Geslacht" in query
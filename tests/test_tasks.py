@@ -0,0 +1,184 @@
+"""Tests for `nl_open_data.tasks`."""
+from datetime import date
+from zipfile import ZipFile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import nl_open_data.tasks as nlt
+import nl_open_data.download as nld
+from nl_open_data.config import config
+
+
+def test_zip_csv_to_parquet(tmp_path):
+    zip_path = tmp_path / "UWV-open match.zip"
+    with ZipFile(zip_path, "w") as zf:
+        zf.writestr("data/pak-bon.csv", "a;b\n1;x\n2;\xe9\n".encode("latin-1"))
+        zf.writestr("data/meta data.txt", "kolom  waarde\nbron   UWV\n")
+        zf.writestr("data/readme.md", "not converted")
+    out_folder = tmp_path / "parquet"
+
+    out_files = nlt.zip_csv_to_parquet.run(
+        zip_path, out_folder, delimiter=";", encoding="8859", block_size=4
+    )
+
+    assert out_files == [
+        out_folder / "UWV_open match" / "data" / "pak_bon.parquet",
+        out_folder / "UWV_open match" / "data" / "meta data.json",
+    ]
+    table = pq.read_table(out_files[0])
+    assert table.to_pydict() == {"a": [1, 2], "b": ["x", "é"]}
+    assert out_files[1].read_text() == '{"kolom":"bron","waarde":"UWV"}\n'
+
+    assert not zip_path.exists()
+
+
+def test_csv_to_parquet_with_shared_schema(tmp_path):
+    # Types that only show after the first block are part of the inferred schema
+    first = tmp_path / "first.csv"
+    first.write_text("a,b,c\n" + "1,,1\n" * 20_000 + "1.5,x,foo\n")
+    second = tmp_path / "second.csv"
+    second.write_text("a,b,c\n2,y,3\n")
+
+    schemas = nlt.infer_csv_schemas.run(
+        [tmp_path / "missing.csv", first], block_size=2 ** 14
+    )
+    schema = schemas["first"]
+    assert schema.types == [pa.float64(), pa.string(), pa.string()]
+
+    out_files = [
+        nlt.csv_to_parquet.run(file, block_size=2 ** 14, schema=schema)
+        for file in (first, second)
+    ]
+
+    for out_file in out_files:
+        assert pq.read_schema(out_file).equals(schema)
+    assert pq.read_table(out_files[1]).to_pydict() == {
+        "a": [2.0],
+        "b": ["y"],
+        "c": ["3"],
+    }
+    assert not first.exists() and not second.exists()
+
+
+def test_csv_to_parquet_falls_back_to_string(tmp_path):
+    # Without a schema, a column is typed from the first block only
+    file = tmp_path / "late_string.csv"
+    file.write_text("a,b\n" + "1,2\n" * 20_000 + "foo,3\n")
+
+    out_file = nlt.csv_to_parquet.run(file, block_size=2 ** 14)
+
+    table = pq.read_table(out_file)
+    assert table.schema.types == [pa.string(), pa.int64()]
+    assert table.num_rows == 20_001
+    assert table.column("a")[-1].as_py() == "foo"
+
+
+def test_incremental_manifest_without_blob_processes_everything():
+    urls = ["https://host/a.zip", "https://host/b.zip"]
+
+    manifest = nlt.load_manifest.run(None, config=None)
+    assert nlt.filter_new_urls.run(urls, manifest) == urls
+    assert nlt.update_manifest.run(None, manifest, urls, [], [], [], config=None) == {}
+
+
+def test_incremental_manifest_records_only_uploaded_urls(tmp_path, monkeypatch):
+    written = {}
+    monkeypatch.setattr(
+        nlt.nlu, "write_gcs_json", lambda obj, blob, gcp: written.update(obj)
+    )
+    urls = [f"https://host/{name}.zip" for name in "abcd"]
+    files = []
+    for name in "abcd":
+        file = tmp_path / f"{name}.zip"
+        nld._write_meta(file, dict(url=f"https://host/{name}.zip", sha256=name * 64))
+        files.append(file)
+    files[2] = None  # Unchanged since the previous run
+    out_files = [["a1", "a2"], ["b1"], [], ["d1"]]
+    gcs_ids = [["id_a1"], ["id_a2"], ValueError("upload failed"), ["id_d1"]]
+    manifest = {urls[2]: {"sha256": "c" * 64}}
+
+    nlt.update_manifest.run(
+        "manifest.json", manifest, urls, files, out_files, gcs_ids, config=config
+    )
+
+    assert sorted(written) == [urls[0], urls[2], urls[3]]
+    assert written[urls[0]]["sha256"] == "a" * 64
+    assert written[urls[2]] == {"sha256": "c" * 64}
+
+
+def test_drop_unchanged_file(tmp_path):
+    file = tmp_path / "a.zip"
+    file.write_bytes(b"zip")
+    url = "https://host/a.zip"
+
+    assert nlt.drop_unchanged_file.run(file, url, {}) == file
+    manifest = {url: {"sha256": nld.file_sha256(file)}}
+    assert nlt.drop_unchanged_file.run(file, url, manifest) is None
+    assert not file.exists()
+
+
+def test_csv_to_parquet_decodes_periods(tmp_path):
+    file = tmp_path / "83502NED.csv"
+    file.write_text("Perioden;Bevolking_1\n2019JJ00;10\n2020KW03;20\n2020MM12;30\n")
+
+    out_file = nlt.csv_to_parquet.run(
+        file, delimiter=";", block_size=32, period_column="Perioden"
+    )
+
+    table = pq.read_table(out_file)
+    assert table.schema.field("jaar").type == pa.int64()
+    assert table.schema.field("periode_start").type == pa.date32()
+    assert table.select(["jaar", "periode_start", "periode_type"]).to_pydict() == {
+        "jaar": [2019, 2020, 2020],
+        "periode_start": [date(2019, 1, 1), date(2020, 7, 1), date(2020, 12, 1)],
+        "periode_type": ["JJ", "KW", "MM"],
+    }
+
+
+def test_zip_pipeline(tmp_path, monkeypatch):
+    downloaded = []
+
+    def download_file(url, filepath, cache=None):
+        downloaded.append(filepath.name)
+        with ZipFile(filepath, "w") as zf:
+            zf.writestr("data.csv", "a,b\n1,x\n")
+        return nld.DownloadResult(url, filepath, "downloaded", 0, 0.0)
+
+    uploaded = []
+
+    def upload_file(bucket, filepath, blob_name, existing=None):
+        uploaded.append(blob_name)
+        return nlt.nlup.UploadResult(
+            blob_name, "id/" + blob_name, 0, 0.0, "resumable", ""
+        )
+
+    monkeypatch.setattr(nlt.nld, "download_file", download_file)
+    monkeypatch.setattr(nlt.nlup, "upload_file", upload_file)
+    monkeypatch.setattr(nlt.nlu, "get_gcs_bucket", lambda gcp: None)
+    monkeypatch.setattr(nlt.nlu, "list_blob_hashes", lambda folder, gcp: {})
+    monkeypatch.setattr(nlt.nlc, "get_cache", lambda: None)
+    # Files with the same name are downloaded to different paths
+    urls = ["https://host/2020/open%20match.zip", "https://host/2021/open%20match.zip"]
+
+    gcs_ids = nlt.zip_pipeline.run(urls, tmp_path, "uwv/open_match", config=config)
+
+    assert sorted(downloaded) == ["open match.zip", "open match_1.zip"]
+    assert gcs_ids == [
+        ["id/uwv/open_match/open match/data.parquet"],
+        ["id/uwv/open_match/open match_1/data.parquet"],
+    ]
+    assert len(set(uploaded)) == 2
+
+
+def test_struct_to_parquet_in_separate_folders():
+    records = [{"Identifier": "83765NED", "RecordCount": 10}]
+
+    first = nlt.struct_to_parquet.run(records, "cbs_v3")
+    second = nlt.struct_to_parquet.run(records, "cbs_v3")
+    try:
+        assert first != second  # Concurrent runs do not write to the same file
+        assert pq.read_table(first).to_pylist() == records
+    finally:
+        for pq_file in (first, second):
+            nlt.remove_dir.run(pq_file.parent)
@@ -0,0 +1,104 @@
+"""Tests for `nl_open_data.upload`, against a local GCS emulator.
+
+Uses the emulator at STORAGE_EMULATOR_HOST if set, and otherwise starts one with `gcp-storage-emulator`.
+"""
+import os
+import socket
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from box import Box
+from google.cloud import storage
+
+import nl_open_data.upload as nlup
+import nl_open_data.utils as nlu
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture(scope="module")
+def bucket():
+    server = None
+    host = os.environ.get("STORAGE_EMULATOR_HOST")
+    if host is None:
+        emulator = pytest.importorskip("gcp_storage_emulator.server")
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = emulator.create_server("127.0.0.1", port, in_memory=True)
+        server.start()
+        host = f"http://127.0.0.1:{port}"
+        os.environ["STORAGE_EMULATOR_HOST"] = host
+    client = storage.Client(
+        project="test-project",
+        credentials=AnonymousCredentials(),
+        client_options={"api_endpoint": host},
+    )
+    bucket = client.bucket(BUCKET)
+    if not bucket.exists():
+        bucket = client.create_bucket(BUCKET)
+    yield bucket
+    if server is not None:
+        server.stop()
+        del os.environ["STORAGE_EMULATOR_HOST"]
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    file = tmp_path / "data.parquet"
+    file.write_bytes(os.urandom(3 * 2 ** 20 + 123))
+    return file
+
+
+def test_resumable_upload(bucket, data_file):
+    result = nlup.upload_file(
+        bucket, data_file, "uwv/resumable.parquet", chunk_size=2 ** 20
+    )
+
+    assert result.method == "resumable"
+    assert result.crc32c == nlup.file_crc32c(data_file)
+    blob = bucket.get_blob("uwv/resumable.parquet")
+    assert blob.crc32c == result.crc32c
+    assert blob.download_as_bytes() == data_file.read_bytes()
+
+
+def test_composite_upload(bucket, data_file, monkeypatch):
+    # Compose in rounds, to cover files with more parts than a single compose request takes
+    monkeypatch.setattr(nlup, "MAX_COMPOSE_SOURCES", 3)
+
+    result = nlup.upload_file(
+        bucket,
+        data_file,
+        "uwv/composite.parquet",
+        chunk_size=2 ** 18,
+        composite_threshold=2 ** 20,
+        part_size=2 ** 18,
+    )
+
+    assert result.method == "composite"
+    assert bucket.get_blob("uwv/composite.parquet").crc32c == result.crc32c
+    assert bucket.blob("uwv/composite.parquet").download_as_bytes() == (
+        data_file.read_bytes()
+    )
+    assert [blob.name for blob in bucket.list_blobs(prefix="uwv/composite")] == [
+        "uwv/composite.parquet"
+    ]
+
+
+def test_unchanged_upload_is_skipped(bucket, data_file, monkeypatch):
+    monkeypatch.setattr(nlu, "get_gcs_client", lambda gcp: bucket.client)
+    gcp = Box(bucket=BUCKET)
+    first = nlup.upload_file(bucket, data_file, "cbs/unchanged/data.parquet")
+
+    existing = nlu.list_blob_hashes("cbs/unchanged", gcp)
+    second = nlup.upload_file(
+        bucket,
+        data_file,
+        "cbs/unchanged/data.parquet",
+        existing=existing["cbs/unchanged/data.parquet"],
+    )
+
+    assert second.method == "unchanged"
+    assert second.blob_id == first.blob_id
+    data_file.write_bytes(b"changed")
+    assert not nlup.is_unchanged(data_file, existing["cbs/unchanged/data.parquet"])
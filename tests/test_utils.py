@@ -0,0 +1,292 @@
+"""Tests for `nl_open_data.utils`."""
+import threading
+import time
+
+from box import Box
+import pyarrow as pa
+import pyarrow.parquet as pq
+import google.api_core.exceptions as google_exceptions
+import pytest
+
+import nl_open_data.utils as nlu
+
+GCP = Box(project_id="test-project", bucket="test-bucket", location="EU")
+SCHEMA = pa.schema([("vacatures", pa.int64())])
+
+
+class FakeBigQueryClient:
+    """Stands in for `bigquery.Client`, recording created tables and request concurrency."""
+
+    def __init__(self, delay=0.05, missing=(), broken=()):
+        self.delay = delay
+        self.missing = missing
+        self.broken = broken
+        self.created = []
+        self.deleted = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def create_table(self, table, exists_ok=False):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        uri = table.external_data_configuration.source_uris[0]
+        if uri in self.missing:
+            raise google_exceptions.NotFound(uri)
+        if uri in self.broken:
+            raise google_exceptions.Forbidden(uri)
+        self.created.append(table)
+        return table
+
+    def delete_table(self, table, not_found_ok=False):
+        self.deleted.append(table.table_id)
+
+
+def uris(n):
+    return [f"gs://test-bucket/uwv/table_{i}.parquet" for i in range(n)]
+
+
+def test_create_linked_tables_concurrently():
+    client = FakeBigQueryClient()
+
+    report = nlu.create_linked_tables(
+        uris(20), GCP, "uwv_open_match_data", bq_client=client, max_workers=10
+    )
+    tables = [result["table"] for result in report]
+
+    assert [table.table_id for table in tables] == [f"table_{i}" for i in range(20)]
+    assert tables[0].dataset_id == "uwv_open_match_data"
+    assert client.max_active == 10
+    assert all(result["seconds"] >= client.delay for result in report)
+
+
+def test_create_linked_tables_reports_failures(capsys):
+    missing, broken = uris(3)[1], uris(3)[2]
+    client = FakeBigQueryClient(delay=0, missing=[missing], broken=[broken])
+
+    with pytest.raises(google_exceptions.Forbidden):
+        nlu.create_linked_tables(uris(3), GCP, "uwv", bq_client=client)
+
+    out = capsys.readouterr().out
+    assert f"URI {missing} Not found" in out
+    assert "Created 1 of 3 tables" in out
+    assert len(client.created) == 1
+
+
+def test_same_named_files_get_unique_table_ids():
+    client = FakeBigQueryClient(delay=0)
+    source_uris = [
+        "gs://test-bucket/uwv/20210604/uwvopenmatch_20191126/vacatures.parquet",
+        "gs://test-bucket/uwv/20210604/uwvopenmatch_20191203/vacatures.parquet",
+        "gs://test-bucket/uwv/20210604/uwvopenmatch_20191126/cvs.parquet",
+    ]
+
+    report = nlu.create_linked_tables(source_uris, GCP, "uwv", bq_client=client)
+
+    assert [result["table_id"] for result in report] == [
+        "uwvopenmatch_20191126_vacatures",
+        "uwvopenmatch_20191203_vacatures",
+        "cvs",
+    ]
+    assert [result["uri"] for result in report] == source_uris
+    with pytest.raises(ValueError):
+        nlu.unique_table_ids(
+            ["gs://test-bucket/uwv/cvs.json", "gs://test-bucket/uwv/cvs.parquet"]
+        )
+
+
+def test_appended_tables_are_named_after_their_folder():
+    client = FakeBigQueryClient(delay=0)
+    source_uris = [
+        "gs://test-bucket/uwv/20210611/uwvopenmatch_20210607/vacatures.parquet"
+    ]
+
+    report = nlu.create_linked_tables(
+        source_uris, GCP, "uwv", bq_client=client, append=True, gcs_folder="uwv/20210611"
+    )
+
+    assert report[0]["table_id"] == "uwvopenmatch_20210607_vacatures"
+    assert client.deleted == ["uwvopenmatch_20210607_vacatures"]
+
+
+def test_appended_nested_files_are_named_after_their_run():
+    run_1 = [
+        "gs://test-bucket/uwv/open_match/uwvopenmatch_20210607/data/pak/bon.parquet",
+        "gs://test-bucket/uwv/open_match/uwvopenmatch_20210607/data/pak/cvs.parquet",
+    ]
+    run_2 = [uri.replace("20210607", "20210614") for uri in run_1]
+
+    ids_1 = nlu.unique_table_ids(run_1, gcs_folder="uwv/open_match")
+    ids_2 = nlu.unique_table_ids(run_2, gcs_folder="uwv/open_match/")
+
+    assert ids_1 == ["uwvopenmatch_20210607_bon", "uwvopenmatch_20210607_cvs"]
+    assert ids_2 == ["uwvopenmatch_20210614_bon", "uwvopenmatch_20210614_cvs"]
+    with pytest.raises(ValueError):
+        nlu.create_linked_tables(run_1, GCP, "uwv", bq_client=object(), append=True)
+
+
+def test_partitioned_blob_name():
+    name = nlu.partitioned_blob_name(
+        "uwv/open_match_data/",
+        "uwvopenmatch_20191126/vacatures.parquet",
+        "run_date=2021-06-04",
+    )
+
+    assert name == (
+        "uwv/open_match_data/vacatures/run_date=2021-06-04/uwvopenmatch_20191126.parquet"
+    )
+    with pytest.raises(ValueError):
+        nlu.partitioned_blob_name("uwv", "vacatures.parquet", "20210604")
+
+
+def test_create_partitioned_tables():
+    client = FakeBigQueryClient(delay=0)
+    source_uris = [
+        f"gs://test-bucket/uwv/open_match_data/{table}/run_date={date}/uwvopenmatch_{i}.parquet"
+        for table in ("vacatures", "cvs")
+        for date in ("2021-06-04", "2021-06-11")
+        for i in range(3)
+    ] + ["gs://test-bucket/uwv/open_match_data/metadata.json"]
+
+    report = nlu.create_partitioned_tables(
+        source_uris,
+        GCP,
+        "uwv_open_match_data",
+        require_partition_filter=True,
+        bq_client=client,
+        read_schema=lambda uri: SCHEMA,
+    )
+    tables = [result["table"] for result in report]
+
+    assert [table.table_id for table in tables] == ["vacatures", "cvs", "metadata"]
+    external_config = tables[0].external_data_configuration
+    assert external_config.source_uris == [
+        "gs://test-bucket/uwv/open_match_data/vacatures/*.parquet"
+    ]
+    assert external_config.hive_partitioning.mode == "AUTO"
+    assert (
+        external_config.hive_partitioning.source_uri_prefix
+        == "gs://test-bucket/uwv/open_match_data/vacatures/"
+    )
+    assert external_config.hive_partitioning.require_partition_filter
+    assert tables[2].external_data_configuration.hive_partitioning is None
+
+
+def test_partitions_with_different_schemas_are_split():
+    client = FakeBigQueryClient(delay=0)
+    prefix = "gs://test-bucket/uwv/open_match_data/vacatures"
+    source_uris = [
+        f"{prefix}/run_date={date}/uwvopenmatch_{i}.parquet"
+        for date in ("2021-06-04", "2021-06-11", "2021-06-18")
+        for i in range(2)
+    ]
+    # The run of 2021-06-11 inferred 'vacatures' as string
+    schemas = {
+        uri: (
+            SCHEMA.set(0, SCHEMA.field(0).with_type(pa.string()))
+            if "2021-06-11" in uri
+            else SCHEMA.with_metadata({"run": uri})
+        )
+        for uri in source_uris
+    }
+
+    report = nlu.create_partitioned_tables(
+        source_uris, GCP, "uwv", bq_client=client, read_schema=schemas.get
+    )
+
+    assert [result["table_id"] for result in report] == ["vacatures", "vacatures_v2"]
+    assert [
+        result["table"].external_data_configuration.source_uris for result in report
+    ] == [
+        [
+            f"{prefix}/run_date=2021-06-04/*.parquet",
+            f"{prefix}/run_date=2021-06-18/*.parquet",
+        ],
+        [f"{prefix}/run_date=2021-06-11/*.parquet"],
+    ]
+
+
+def test_read_gcs_parquet_schema(tmp_path, monkeypatch):
+    pq.write_table(pa.table({"a": [1, 2], "b": ["x", "y"]}), tmp_path / "t.parquet")
+    data = (tmp_path / "t.parquet").read_bytes()
+
+    class FakeBlob:
+        size = len(data)
+
+        def download_as_bytes(self, start=0):
+            return data[start:]
+
+    class FakeClient:
+        def bucket(self, name):
+            return Box(get_blob=lambda name: FakeBlob())
+
+    monkeypatch.setattr(nlu, "get_gcs_client", lambda gcp: FakeClient())
+
+    schema = nlu.read_gcs_parquet_schema("gs://test-bucket/uwv/t.parquet", GCP)
+
+    assert schema.names == ["a", "b"]
+    assert schema.types == [pa.int64(), pa.string()]
+
+
+def test_clients_are_shared_within_process(monkeypatch):
+    class FakeStorageClient:
+        instances = 0
+
+        def __init__(self, project=None):
+            FakeStorageClient.instances += 1
+            self.project = project
+            self.buckets_fetched = 0
+
+        def get_bucket(self, name):
+            self.buckets_fetched += 1
+            return (self.project, name)
+
+    monkeypatch.setattr(nlu.storage, "Client", FakeStorageClient)
+    monkeypatch.setattr(nlu, "_clients", {})
+    before = nlu.client_stats()
+    other = Box(project_id="other-project", bucket="other-bucket", location="EU")
+
+    buckets = [nlu.get_gcs_bucket(GCP) for _ in range(100)]
+    client = nlu.get_gcs_client(GCP)
+
+    assert set(buckets) == {("test-project", "test-bucket")}
+    assert FakeStorageClient.instances == 1
+    assert client.buckets_fetched == 1
+    assert nlu.get_gcs_bucket(other) == ("other-project", "other-bucket")
+    assert FakeStorageClient.instances == 2
+    stats = nlu.client_stats()
+    assert stats["bucket_created"] - before.get("bucket_created", 0) == 2
+    assert stats["bucket_reused"] - before.get("bucket_reused", 0) == 99
+
+
+def test_records_to_parquet_in_batches(tmp_path):
+    records = ({"id": i, "name": None if i < 3 else str(i)} for i in range(10))
+
+    out_file = nlu.records_to_parquet(records, tmp_path / "records.parquet", batch_size=3)
+
+    parquet = pq.ParquetFile(out_file)
+    assert parquet.metadata.num_row_groups == 4
+    # Inferred from the first batch, with its empty column typed as string
+    assert parquet.schema_arrow == pa.schema([("id", pa.int64()), ("name", pa.string())])
+    assert parquet.read().column("name").to_pylist()[2:4] == [None, "3"]
+
+
+def test_records_to_parquet_with_schema(tmp_path):
+    schema = pa.schema([("Identifier", pa.string()), ("RecordCount", pa.int64())])
+    records = [{"Identifier": "83765NED", "RecordCount": 1, "Title": "Kerncijfers"}]
+
+    from_list = nlu.records_to_parquet(records, tmp_path / "list.parquet", schema=schema)
+    from_table = nlu.records_to_parquet(
+        pa.Table.from_pylist(records), tmp_path / "table.parquet", schema=schema
+    )
+    empty = nlu.records_to_parquet([], tmp_path / "empty.parquet", schema=schema)
+
+    for out_file in (from_list, from_table):
+        assert pq.read_table(out_file).to_pylist() == [
+            {"Identifier": "83765NED", "RecordCount": 1}
+        ]
+    assert pq.read_table(empty).schema == schema
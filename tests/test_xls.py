@@ -0,0 +1,126 @@
+"""Tests for `nl_open_data.xls`."""
+from datetime import datetime
+
+import pyarrow as pa
+import xlrd
+
+import nl_open_data.xls as nlx
+
+
+class FakeSheet:
+    """An xlrd sheet holding rows of (cell type, value) tuples."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.nrows = len(rows)
+        self.ncols = len(rows[0])
+
+    def row_values(self, rowx):
+        return [value for _, value in self.rows[rowx]]
+
+    def col_types(self, colx, start_rowx=0):
+        return [row[colx][0] for row in self.rows[start_rowx:]]
+
+    def col_values(self, colx, start_rowx=0):
+        return [row[colx][1] for row in self.rows[start_rowx:]]
+
+    def cell_type(self, rowx, colx):
+        return self.rows[rowx][colx][0]
+
+    def cell_value(self, rowx, colx):
+        return self.rows[rowx][colx][1]
+
+
+TEXT, NUMBER, DATE, EMPTY = (
+    xlrd.XL_CELL_TEXT,
+    xlrd.XL_CELL_NUMBER,
+    xlrd.XL_CELL_DATE,
+    xlrd.XL_CELL_EMPTY,
+)
+
+
+def header(*names):
+    return [(TEXT, name) for name in names]
+
+
+def test_sheet_to_table_with_cbs_markers():
+    # i.e. p_stadsv in kwb-2019.xls, holding numbers, text with decimal commas and markers
+    sheet = FakeSheet(
+        [
+            header("gwb_code", "regio", "p_stadsv", "a_inw", "datum"),
+            [
+                (TEXT, "0003"),
+                (TEXT, "Appingedam"),
+                (NUMBER, 5.0),
+                (NUMBER, 11801.0),
+                (DATE, 43831.0),
+            ],
+            [
+                (TEXT, "0010"),
+                (TEXT, "Delfzijl"),
+                (TEXT, "5,5"),
+                (TEXT, "        .       "),
+                (DATE, 43832.5),
+            ],
+            [
+                (TEXT, "0014"),
+                (TEXT, "Groningen"),
+                (TEXT, "x"),
+                (NUMBER, 231299.0),
+                (EMPTY, ""),
+            ],
+        ]
+    )
+
+    table = nlx.sheet_to_table(sheet)
+
+    assert table.schema == pa.schema(
+        [
+            ("gwb_code", pa.string()),
+            ("regio", pa.string()),
+            ("p_stadsv", pa.float64()),
+            ("a_inw", pa.int64()),
+            ("datum", pa.timestamp("s")),
+        ]
+    )
+    assert table.to_pydict() == {
+        "gwb_code": ["0003", "0010", "0014"],
+        "regio": ["Appingedam", "Delfzijl", "Groningen"],
+        "p_stadsv": [5.0, 5.5, None],
+        "a_inw": [11801, None, 231299],
+        "datum": [datetime(2020, 1, 1), datetime(2020, 1, 2, 12), None],
+    }
+
+
+def test_sheet_to_table_skips_unit_rows():
+    # i.e. the Nabijheid files of 2015 and 2016
+    sheet = FakeSheet(
+        [
+            header("regio", "afs_huisarts"),
+            header("Regioaanduiding", "Afstand tot huisartsenpraktijk"),
+            header("", "km"),
+            [(TEXT, "Nederland"), (TEXT, ".")],
+            [(TEXT, "Groningen"), (NUMBER, 1.1)],
+        ]
+    )
+
+    table = nlx.sheet_to_table(sheet)
+
+    assert table.to_pydict() == {
+        "regio": ["Nederland", "Groningen"],
+        "afs_huisarts": [None, 1.1],
+    }
+
+
+def test_sheet_to_table_with_declared_types():
+    sheet = FakeSheet(
+        [
+            header("code", "waarde"),
+            [(NUMBER, 3.0), (NUMBER, 1.0)],
+            [(TEXT, "0010"), (TEXT, "2,0")],
+        ]
+    )
+
+    table = nlx.sheet_to_table(sheet, types={"code": "string", "waarde": pa.float32()})
+
+    assert table.to_pydict() == {"code": ["3", "0010"], "waarde": [1.0, 2.0]}
+    assert table.schema.field("waarde").type == pa.float32()